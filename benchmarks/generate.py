@@ -0,0 +1,104 @@
+"""Synthetic seed files for load tests.
+
+Writes `author`, `book` and `author_book_rel` in the format of `data/`
+and a `manifest.json` describing them. Popularity is skewed: the number
+of books per author follows a Zipf distribution, so a few authors have
+thousands of books while most have a handful, and books mostly have a
+single author. Point the service at the output with `SANIC_DB_SEED_DIR`.
+
+    $ python benchmarks/generate.py --relations 1000000 --out /tmp/bookstore-1m
+    $ SANIC_DB_SEED_DIR=/tmp/bookstore-1m SANIC_DB_SCHEMA=reset python run.py
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from bisect import bisect_left
+
+
+WORDS = ['art', 'computer', 'programming', 'structure', 'interpretation', 'language',
+         'compilers', 'principles', 'design', 'patterns', 'elements', 'reusable',
+         'software', 'systems', 'algorithms', 'data', 'concurrent', 'processes',
+         'communicating', 'sequential', 'operating', 'networks', 'theory', 'logic',
+         'functional', 'types', 'practice', 'engineering', 'introduction', 'advanced']
+
+FIRST = ['Ada', 'Alan', 'Barbara', 'Brian', 'Donald', 'Edsger', 'Frances', 'Grace',
+         'John', 'Ken', 'Leslie', 'Margaret', 'Niklaus', 'Robin', 'Tony', 'Whitfield']
+LAST = ['Backus', 'Dijkstra', 'Hoare', 'Hopper', 'Kernighan', 'Knuth', 'Lamport',
+        'Liskov', 'Milner', 'Ritchie', 'Thompson', 'Turing', 'Wirth', 'Allen', 'Diffie']
+
+# Authors per book: mostly one, some co-authored
+AUTHORS_PER_BOOK = [(1, 0.7), (2, 0.2), (3, 0.08), (5, 0.02)]
+
+
+class Zipf:
+    """Draws ranks 0..n-1, rank k with weight 1 / (k + 1) ** s"""
+    def __init__(self, n, s=1.1, rng=random):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for k in range(n):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+
+    def __call__(self):
+        return bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def authors_per_book(rng):
+    x = rng.random()
+    for count, p in AUTHORS_PER_BOOK:
+        if x < p:
+            return count
+        x -= p
+    return AUTHORS_PER_BOOK[-1][0]
+
+
+def generate(out, relations, skew, seed):
+    rng = random.Random(seed)
+    mean = sum(c * p for c, p in AUTHORS_PER_BOOK)
+    books = max(int(relations / mean), 1)
+    authors = max(books // 10, 1)
+    popularity = Zipf(authors, skew, rng)
+    os.makedirs(out, exist_ok=True)
+
+    with open(os.path.join(out, 'author'), 'w') as f:
+        for i in range(1, authors + 1):
+            f.write('{} {} {}\n'.format(rng.choice(FIRST), rng.choice(LAST), i))
+    written = 0
+    with open(os.path.join(out, 'book'), 'w') as f, \
+            open(os.path.join(out, 'author_book_rel'), 'w') as rel:
+        for book_id in range(1, books + 1):
+            title = ' '.join(rng.sample(WORDS, rng.randint(2, 5))).capitalize()
+            f.write('{} {}\n'.format(title, book_id))
+            # Authors of a book are distinct, so pairs never repeat
+            for author_id in {popularity() + 1 for _ in range(authors_per_book(rng))}:
+                rel.write('{}\t{}\n'.format(author_id, book_id))
+                written += 1
+
+    manifest = {
+        'authors': authors,
+        'books': books,
+        'relations': written,
+        'skew': skew,
+        'seed': seed,
+    }
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--relations', type=int, default=10 ** 5,
+                        help='approximate amount of author_book_rel rows')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of authors')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', required=True)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    manifest = generate(args.out, args.relations, args.skew, args.seed)
+    print('{authors} authors, {books} books, {relations} relations'.format(**manifest),
+          'written in {:.1f}s'.format(time.perf_counter() - started))
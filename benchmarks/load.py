@@ -0,0 +1,234 @@
+"""Load test of a running service with a read/write mix.
+
+Replays the mix against the routes of both `/authors` and `/books` at a
+fixed concurrency for a while and reports latency percentiles and
+throughput per operation along with the pool waits of the service.
+IDs are drawn with the skew of the seed files `generate.py` wrote.
+Results can be saved as a JSON baseline and compared against one.
+
+    $ python benchmarks/load.py --data /tmp/bookstore-1m --duration 60 --concurrency 64 \\
+        --save benchmarks/baselines/1m.json
+    $ python benchmarks/load.py --data /tmp/bookstore-1m --compare benchmarks/baselines/1m.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+
+import aiohttp
+
+from generate import WORDS, Zipf
+
+
+DEFAULT_MIX = ('read=35,page=10,relcount=15,rellist=15,search=5,'
+               'create=6,update=6,relate=6,delete=2')
+
+POOL_COUNTERS = {
+    'bookstore_db_pool_acquired_total': 'acquired',
+    'bookstore_db_pool_wait_seconds_total': 'wait_seconds',
+    'bookstore_db_pool_timeouts_total': 'timeouts',
+}
+
+
+def parse_mix(mix):
+    ops = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        ops[name.strip()] = float(weight)
+    unknown = set(ops) - set(Workload.OPS)
+    if unknown:
+        raise ValueError('Unknown operations: {}'.format(', '.join(sorted(unknown))))
+    return ops
+
+
+def percentile(timings, p):
+    return timings[min(int(len(timings) * p), len(timings) - 1)]
+
+
+class Workload:
+    """Requests of every operation against one of the two
+    resources, IDs of popular records come up more often.
+    """
+    OPS = ('read', 'page', 'relcount', 'rellist', 'search',
+           'create', 'update', 'relate', 'delete')
+
+    def __init__(self, url, manifest, rng):
+        self.url = url.rstrip('/')
+        self.rng = rng
+        self.sizes = {'authors': manifest['authors'], 'books': manifest['books']}
+        self.popular = {slug: Zipf(size, manifest.get('skew', 1.1), rng)
+                        for slug, size in self.sizes.items()}
+        # Only records created by the run get deleted
+        self.created = {'authors': [], 'books': []}
+
+    def pick(self, slug):
+        return self.popular[slug]() + 1
+
+    def request(self, op):
+        """(method, path, JSON body) of a random request of `op`"""
+        slug = self.rng.choice(['authors', 'books'])
+        if op == 'read':
+            return 'GET', '/{}/{}'.format(slug, self.pick(slug)), None
+        if op == 'page':
+            after = self.rng.randrange(self.sizes[slug])
+            return 'GET', '/{}?after={}&limit=100'.format(slug, after), None
+        if op in ('relcount', 'rellist'):
+            return 'GET', '/{}/{}/{}'.format(slug, op, self.pick(slug)), None
+        if op == 'search':
+            return 'GET', '/books/search?q={}'.format(self.rng.choice(WORDS)[:3]), None
+        if op == 'create':
+            return 'POST', '/' + slug, {'name': 'Load {}'.format(self.rng.randrange(10 ** 6))}
+        if op == 'update':
+            return 'PUT', '/{}/{}'.format(slug, self.pick(slug)), {
+                'name': 'Renamed {}'.format(self.rng.randrange(10 ** 6))}
+        if op == 'relate':
+            return 'PUT', '/authors/{}'.format(self.pick('authors')), {
+                'book_id': self.rng.randint(1, self.sizes['books'])}
+        if self.created[slug]:
+            return 'DELETE', '/{}/{}'.format(slug, self.created[slug].pop()), None
+        return 'GET', '/{}/{}'.format(slug, self.pick(slug)), None
+
+
+async def pool_counters(session, url):
+    """Pool counters summed over the workers out of /metrics"""
+    async with session.get(url + '/metrics') as response:
+        text = await response.text()
+    counters = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(' ')
+        if name in POOL_COUNTERS:
+            counters[POOL_COUNTERS[name]] = float(value)
+    return counters
+
+
+async def worker(session, workload, ops, weights, deadline, timings, statuses):
+    while time.monotonic() < deadline:
+        op = ops[weighted(workload.rng, weights)]
+        method, path, body = workload.request(op)
+        started = time.monotonic()
+        async with session.request(method, workload.url + path,
+                                   data=None if body is None else json.dumps(body)) as response:
+            payload = await response.read()
+        timings[op].append(time.monotonic() - started)
+        statuses[op][response.status] += 1
+        if op == 'create' and response.status == 201:
+            slug = path.strip('/')
+            workload.created[slug].append(json.loads(payload.decode())['id'])
+
+
+def weighted(rng, weights):
+    """Random index into `weights` (random.choices is 3.6+)"""
+    x = rng.random() * sum(weights)
+    for i, weight in enumerate(weights):
+        if x < weight:
+            return i
+        x -= weight
+    return len(weights) - 1
+
+
+async def run(url, manifest, mix, concurrency, duration, seed):
+    workload = Workload(url, manifest, random.Random(seed))
+    ops = list(mix)
+    weights = [mix[op] for op in ops]
+    timings = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        before = await pool_counters(session, workload.url)
+        started = time.monotonic()
+        await asyncio.gather(*[
+            worker(session, workload, ops, weights, started + duration, timings, statuses)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.monotonic() - started
+        after = await pool_counters(session, workload.url)
+
+    result = {
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'mix': mix,
+        'manifest': manifest,
+        'requests': sum(len(t) for t in timings.values()),
+        'throughput': sum(len(t) for t in timings.values()) / elapsed,
+        'pool': {k: after.get(k, 0) - before.get(k, 0) for k in POOL_COUNTERS.values()},
+        'ops': {},
+    }
+    for op, values in sorted(timings.items()):
+        values.sort()
+        result['ops'][op] = {
+            'count': len(values),
+            'throughput': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'statuses': {str(k): v for k, v in sorted(statuses[op].items())},
+        }
+    return result
+
+
+def report(result):
+    print('{:<10} {:>8} {:>9} {:>9} {:>9} {:>9}  {}'.format(
+        'op', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'))
+    for op, stats in sorted(result['ops'].items()):
+        print('{:<10} {:>8} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}  {}'.format(
+            op, stats['count'], stats['throughput'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'], ' '.join('{}:{}'.format(k, v) for k, v in stats['statuses'].items())))
+    pool = result['pool']
+    print('{:.1f} req/s total, pool: {:.0f} acquired, {:.3f}s waited, {:.0f} timeouts'.format(
+        result['throughput'], pool['acquired'], pool['wait_seconds'], pool['timeouts']))
+
+
+def compare(result, baseline, tolerance):
+    """Prints the change against `baseline`, returns regressions"""
+    regressions = []
+    print('{:<10} {:>12} {:>12}'.format('op', 'p95 change', 'req/s change'))
+    for op, stats in sorted(result['ops'].items()):
+        base = baseline['ops'].get(op)
+        if not base:
+            continue
+        p95 = stats['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0
+        rate = stats['throughput'] / base['throughput'] - 1 if base['throughput'] else 0
+        print('{:<10} {:>+11.1%} {:>+11.1%}'.format(op, p95, rate))
+        if p95 > tolerance or rate < -tolerance:
+            regressions.append(op)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--data', required=True, help='directory generate.py wrote')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='operation=weight pairs')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='JSON file to store the results in')
+    parser.add_argument('--compare', help='JSON baseline to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative p95 or throughput change that is a regression')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.data, 'manifest.json')) as f:
+        manifest = json.load(f)
+    result = asyncio.get_event_loop().run_until_complete(run(
+        args.url, manifest, parse_mix(args.mix), args.concurrency, args.duration, args.seed))
+    report(result)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressed: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
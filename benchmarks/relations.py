@@ -0,0 +1,98 @@
+"""Relation endpoint queries latency as author_book_rel grows.
+
+Builds a scratch schema per mapping table size, once with the schema
+of migration 1 only (no keys on the mapping table) and once fully
+migrated, and times the very SQL `relcount`, `rellist` and the
+relation insert of `update` run, the stored counter `relcount` reads
+on the migrated one.
+
+    $ SANIC_DB_HOST=localhost SANIC_DB_DATABASE=postgres SANIC_DB_PASSWORD=password \\
+        python benchmarks/relations.py --sizes 1000 100000 10000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bookstore.bookstore import authors, books, connection  # noqa: E402
+from bookstore.dao.schema import MIGRATIONS  # noqa: E402
+from bookstore.dao.statements import Statement  # noqa: E402
+
+
+SCHEMA = 'bench_relations'
+
+
+async def populate(conn, size, version):
+    await conn.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}'.format(SCHEMA))
+    await conn.execute('SET search_path TO {}, public'.format(SCHEMA))
+    for v, sql in MIGRATIONS:
+        if v <= version:
+            await conn.execute(sql)
+    # Ten relations per author and per book on average
+    entities = max(size // 10, 1)
+    await conn.execute("INSERT INTO author (name) SELECT 'Author ' || i "
+                       "FROM generate_series(1, $1) i", entities)
+    await conn.execute("INSERT INTO book (name) SELECT 'Book ' || i "
+                       "FROM generate_series(1, $1) i", entities)
+    # Pairs are unique so that the primary key can be added on top
+    await conn.execute('INSERT INTO author_book_rel '
+                       'SELECT i % $2 + 1, (i / $2 + i) % $2 + 1 FROM generate_series(0, $1 - 1) i '
+                       'ON CONFLICT DO NOTHING', size, entities)
+    await conn.execute('ANALYZE')
+    return entities
+
+
+async def timed(conn, sql, params, repeat):
+    timings = []
+    for args in params[:repeat]:
+        started = time.perf_counter()
+        await conn.fetch(sql, *args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+async def main(sizes, repeat):
+    queries = [
+        ('authors relcount', Statement(authors.count_related_query()).sql),
+        ('authors rellist', Statement(authors.list_related_query()).sql),
+        ('books rellist', Statement(books.list_related_query()).sql),
+    ]
+    relate = Statement(authors.relate_query()).sql
+    stored = Statement(authors.stored_count_query()).sql
+    conn = await asyncpg.connect(connection)
+    try:
+        print('{:>10} {:>8} {:<18} {:>9} {:>9}'.format('rows', 'schema', 'query', 'p50 ms', 'p95 ms'))
+        for size in sizes:
+            for version in (1, MIGRATIONS[-1][0]):
+                entities = await populate(conn, size, version)
+                ids = [(random.randint(1, entities),) for _ in range(repeat)]
+                results = []
+                for name, sql in queries:
+                    results.append((name,) + await timed(conn, sql, ids, repeat))
+                if version > 1:
+                    pairs = [(random.randint(1, entities), random.randint(1, entities))
+                             for _ in range(repeat)]
+                    results.append(('relate',) + await timed(conn, relate, pairs, repeat))
+                    # Counters kept by triggers since migration 5
+                    results.append(('authors stored',) + await timed(conn, stored, ids, repeat))
+                for name, p50, p95 in results:
+                    print('{:>10} {:>8} {:<18} {:>9.3f} {:>9.3f}'.format(
+                        size, 'v' + str(version), name, p50, p95))
+    finally:
+        await conn.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(SCHEMA))
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** i for i in range(3, 8)])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(main(args.sizes, args.repeat))
@@ -0,0 +1,94 @@
+"""Name search latency against a synthetic book catalogue.
+
+Builds a scratch schema with all the migrations applied, fills it with
+books named by random words and times the very SQL `/books/search`
+runs for every mode.
+
+    $ SANIC_DB_HOST=localhost SANIC_DB_DATABASE=postgres SANIC_DB_PASSWORD=password \\
+        python benchmarks/search.py --books 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bookstore.bookstore import books, connection  # noqa: E402
+from bookstore.dao.schema import MIGRATIONS  # noqa: E402
+from bookstore.dao.statements import Statement  # noqa: E402
+
+
+SCHEMA = 'bench_search'
+
+WORDS = ['art', 'computer', 'programming', 'structure', 'interpretation', 'language',
+         'compilers', 'principles', 'design', 'patterns', 'elements', 'reusable',
+         'software', 'systems', 'algorithms', 'data', 'concurrent', 'processes',
+         'communicating', 'sequential', 'operating', 'networks', 'theory', 'logic',
+         'functional', 'types', 'practice', 'engineering', 'introduction', 'advanced']
+
+
+def typo(word):
+    """Drops a letter to exercise similarity matching"""
+    i = random.randrange(len(word))
+    return word[:i] + word[i + 1:]
+
+
+async def populate(conn, size):
+    await conn.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}'.format(SCHEMA))
+    await conn.execute('SET search_path TO {}, public'.format(SCHEMA))
+    for _, sql in MIGRATIONS:
+        await conn.execute(sql)
+    # Three to five random words per title, a number keeps them distinct
+    await conn.execute(
+        "INSERT INTO book (name) SELECT array_to_string(ARRAY("
+        "SELECT w[1 + floor(random() * array_length(w, 1))::int] "
+        "FROM generate_series(1, 3 + (i % 3))), ' ') || ' ' || i "
+        "FROM generate_series(1, $1) i, (SELECT $2::text[] AS w) words",
+        size, WORDS
+    )
+    await conn.execute('ANALYZE')
+
+
+async def timed(conn, sql, params):
+    timings = []
+    for args in params:
+        started = time.perf_counter()
+        await conn.fetch(sql, *args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+async def main(size, repeat, limit):
+    conn = await asyncpg.connect(connection)
+    try:
+        started = time.perf_counter()
+        await populate(conn, size)
+        print('{} books loaded and indexed in {:.1f}s'.format(size, time.perf_counter() - started))
+        print('{:<10} {:>9} {:>9}'.format('mode', 'p50 ms', 'p95 ms'))
+        for mode, make in [
+            ('prefix', lambda: {'pattern': random.choice(WORDS)[:4] + '%'}),
+            ('fuzzy', lambda: {'q': typo(random.choice(WORDS))}),
+            ('fulltext', lambda: {'q': ' '.join(random.sample(WORDS, 2))}),
+        ]:
+            statement = Statement(books.search_query(mode))
+            params = [statement.args(dict(make(), offset=0, limit=limit)) for _ in range(repeat)]
+            p50, p95 = await timed(conn, statement.sql, params)
+            print('{:<10} {:>9.3f} {:>9.3f}'.format(mode, p50, p95))
+    finally:
+        await conn.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(SCHEMA))
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=10 ** 6)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(main(args.books, args.repeat, args.limit))
@@ -0,0 +1,65 @@
+"""JSON encoding time and bytes on the wire of large list responses.
+
+Fetches records of the very shape list reads return and encodes them
+the way handlers used to (dicts through sanic's json_dumps) and as records
+through the fast encoder and its default hook, then compresses the result
+with every supported encoding.
+
+    $ SANIC_DB_HOST=localhost SANIC_DB_DATABASE=postgres SANIC_DB_PASSWORD=password \\
+        python benchmarks/serialization.py --rows 10000 100000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+from sanic.response import json_dumps
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bookstore.bookstore import connection  # noqa: E402
+from bookstore.util.encoding import compress, dumps, encodings, orjson  # noqa: E402
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return result, timings[len(timings) // 2]
+
+
+async def main(sizes, repeat):
+    conn = await asyncpg.connect(connection)
+    try:
+        print('encoder: {}'.format('orjson' if orjson else 'json'))
+        print('{:>9} {:<16} {:>9} {:>11}'.format('rows', 'path', 'p50 ms', 'bytes'))
+        for size in sizes:
+            records = await conn.fetch(
+                "SELECT i AS id, 'Book title number ' || i AS name FROM generate_series(1, $1) i",
+                size
+            )
+            body, p50 = timed(
+                lambda: json_dumps({'result': [dict(r) for r in records], 'next': None}).encode(),
+                repeat)
+            print('{:>9} {:<16} {:>9.3f} {:>11}'.format(size, 'dicts', p50, len(body)))
+            body, p50 = timed(lambda: dumps({'result': records, 'next': None}), repeat)
+            print('{:>9} {:<16} {:>9.3f} {:>11}'.format(size, 'records', p50, len(body)))
+            for encoding in encodings():
+                compressed, p50 = timed(lambda: compress(body, encoding), repeat)
+                print('{:>9} {:<16} {:>9.3f} {:>11}'.format(
+                    size, 'records+' + encoding, p50, len(compressed)))
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 4, 10 ** 5])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(main(args.rows, args.repeat))
@@ -0,0 +1,127 @@
+"""Relation insert and rename throughput, one by one against batches.
+
+Builds a scratch schema and has `--concurrency` writers relate
+random authors and books and rename every `--rename-every`th author,
+first in a transaction each as `update` runs them, then group committed
+by WriteBatcher for every `--latencies` window, and prints writes per
+second and latencies.
+
+    $ SANIC_DB_HOST=localhost SANIC_DB_DATABASE=postgres SANIC_DB_PASSWORD=password \\
+        python benchmarks/writes.py --concurrency 200 --writes 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import asyncpg
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bookstore.bookstore import authors, connection  # noqa: E402
+from bookstore.dao.apg import apg  # noqa: E402
+from bookstore.dao.batch import WriteBatcher  # noqa: E402
+from bookstore.dao.schema import MIGRATIONS  # noqa: E402
+from bookstore.dao.statements import Statement  # noqa: E402
+
+
+SCHEMA = 'bench_writes'
+
+RELATE = Statement(authors.relate_query())
+RENAME = Statement(authors.table.update()
+                   .values(name=sa.bindparam('set_name'))
+                   .where(authors.table.c.id == sa.bindparam('id'))
+                   .returning(authors.table.c.id))
+RELATED = Statement(sa.select([authors.related.c.book_id])
+                    .where(authors.related.c.author_id == sa.bindparam('id')))
+
+
+async def populate(conn, entities):
+    await conn.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}'.format(SCHEMA))
+    await conn.execute('SET search_path TO {}, public'.format(SCHEMA))
+    for _, sql in MIGRATIONS:
+        await conn.execute(sql)
+    await conn.execute("INSERT INTO author (name) SELECT 'Author ' || i "
+                       "FROM generate_series(1, $1) i", entities)
+    await conn.execute("INSERT INTO book (name) SELECT 'Book ' || i "
+                       "FROM generate_series(1, $1) i", entities)
+    await conn.execute('ANALYZE')
+
+
+async def one_by_one(db, item):
+    """The statements update() runs for a relation and a rename"""
+    db_id, book_id, fields = item
+    async with db.transaction() as tx:
+        related = bool(await tx.fetchval(RELATE, {'author_id': db_id, 'book_id': book_id}))
+        row = None
+        if fields:
+            row = await tx.fetchval(RENAME, {'set_name': fields['name'], 'id': db_id})
+            if row:
+                await tx.fetch(RELATED, {'id': row})
+    return related, row
+
+
+async def drive(write, items, concurrency):
+    latencies = []
+    queue = iter(items)
+
+    async def worker():
+        for item in queue:
+            started = time.perf_counter()
+            await write(item)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return (len(items) / elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000)
+
+
+async def main(entities, writes, concurrency, rename_every, latencies, pool_size):
+    conn = await asyncpg.connect(connection)
+    pool = None
+    try:
+        await populate(conn, entities)
+        pool = await asyncpg.create_pool(
+            connection, min_size=pool_size, max_size=pool_size,
+            server_settings={'search_path': '{}, public'.format(SCHEMA)})
+        db = apg(pool)
+        print('{:<16} {:>10} {:>9} {:>9} {:>8}'.format('mode', 'writes/s', 'p50 ms', 'p95 ms', 'batches'))
+        runs = [('one by one', None)] + [('batch {:g} ms'.format(l * 1000), l) for l in latencies]
+        for name, latency in runs:
+            items = [(random.randint(1, entities), random.randint(1, entities),
+                      {'name': 'Renamed {}'.format(i)} if i % rename_every == 0 else {})
+                     for i in range(writes)]
+            batches = ''
+            if latency is None:
+                result = await drive(lambda item: one_by_one(db, item), items, concurrency)
+            else:
+                batcher = WriteBatcher(db, max_latency=latency)
+                result = await drive(
+                    lambda item: batcher.submit(authors.batch_update, item), items, concurrency)
+                batches = batcher.batches
+            print('{:<16} {:>10.0f} {:>9.3f} {:>9.3f} {:>8}'.format(name, *(result + (batches,))))
+    finally:
+        if pool is not None:
+            await pool.close()
+        await conn.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(SCHEMA))
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entities', type=int, default=100000)
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--rename-every', type=int, default=10)
+    parser.add_argument('--latencies', type=float, nargs='+', default=[0.002, 0.005, 0.01])
+    parser.add_argument('--pool-size', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(main(
+        args.entities, args.writes, args.concurrency, args.rename_every,
+        args.latencies, args.pool_size))
@@ -0,0 +1,86 @@
+import json as _json
+
+from sanic.blueprints import Blueprint
+from sanic.response import json, stream
+from sanic_openapi import doc
+
+changes = Blueprint("changes", url_prefix="/changes")
+
+TABLES = {'author', 'book', 'author_book_rel'}
+
+# Seconds an idle feed waits before a keepalive
+KEEPALIVE = 15
+
+
+def feed_args(request):
+    """Parses `?since=<seq>` (SSE clients send `Last-Event-ID`
+    on reconnect instead) and `?tables=author,book`.
+    Raises ValueError on malformed values.
+    """
+    since = request.args.get('since') or request.headers.get('Last-Event-ID')
+    tables = {t for t in request.args.get('tables', '').split(',') if t}
+    if not tables <= TABLES:
+        raise ValueError('Only changes of {} are available.'.format(', '.join(sorted(TABLES))))
+    return (int(since) if since else None), tables or None
+
+
+@changes.route("/stream")
+@doc.summary("Server-Sent Events of inserts, updates and deletes, "
+             "`since` replays the changes after a sequence number")
+@doc.produces({"seq": int, "table": str, "op": str, "data": dict, "at": str})
+async def changes_stream(request):
+    try:
+        since, tables = feed_args(request)
+    except ValueError as e:
+        return json({'error': str(e)}, status=400)
+    feed = request.app.changes
+    if feed is None:
+        return json({'error': 'Change feed is disabled.'}, status=503)
+
+    async def streaming_fn(response):
+        subscription = await feed.subscribe(since, tables)
+        try:
+            await response.write('retry: 1000\n\n')
+            while True:
+                change = await subscription.get(KEEPALIVE)
+                if change is not None:
+                    await response.write('id: {}\ndata: {}\n\n'.format(change.seq, change.json))
+                elif subscription.overflowed:
+                    # Fell too far behind, the client has to reload and start over
+                    await response.write('event: reset\ndata: {}\n\n')
+                    return
+                else:
+                    await response.write(': keepalive\n\n')
+        finally:
+            feed.unsubscribe(subscription)
+
+    return stream(streaming_fn, content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*',
+    })
+
+
+@changes.websocket("/ws")
+async def changes_ws(request, ws):
+    try:
+        since, tables = feed_args(request)
+    except ValueError as e:
+        await ws.send(_json.dumps({'error': str(e)}))
+        return
+    feed = request.app.changes
+    if feed is None:
+        await ws.send(_json.dumps({'error': 'Change feed is disabled.'}))
+        return
+    subscription = await feed.subscribe(since, tables)
+    try:
+        while True:
+            change = await subscription.get(KEEPALIVE)
+            if change is not None:
+                await ws.send(change.json)
+            elif subscription.overflowed:
+                await ws.send(_json.dumps({'reset': True}))
+                return
+            else:
+                await ws.ping()
+    finally:
+        feed.unsubscribe(subscription)
@@ -0,0 +1,33 @@
+from sanic.blueprints import Blueprint
+from sanic.response import json, stream
+from sanic_openapi import doc
+
+from bookstore.dao.export import FORMATS, export, snapshot
+
+exports = Blueprint("export", url_prefix="/export")
+
+
+@exports.route("/<table:authors|books|relations>")
+@doc.summary("Whole table streamed straight out of COPY in one snapshot, "
+             "`format=csv|ndjson|columns`")
+async def export_table(request, table):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        return json({'error': 'Formats are {}.'.format(', '.join(sorted(FORMATS)))}, status=400)
+    content_type, extension = FORMATS[fmt]
+    db = request.app.apg.reader(request.get('lsn'))
+
+    async def streaming_fn(response):
+        # COPY hands out bytearray chunks, the response encodes
+        # anything but bytes with str()
+        async def write(chunk):
+            await response.write(bytes(chunk))
+
+        async with snapshot(db) as tx:
+            await export(tx, table, fmt, write)
+
+    return stream(streaming_fn, content_type=content_type, headers={
+        'Content-Disposition': 'attachment; filename="{}.{}"'.format(table, extension),
+        'Cache-Control': 'no-store',
+    })
+
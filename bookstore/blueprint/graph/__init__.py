@@ -0,0 +1,87 @@
+from sanic.blueprints import Blueprint
+from sanic.response import json
+from sanic_openapi import doc
+
+graph = Blueprint("graph", url_prefix="/graph")
+
+KINDS = {'authors': 'author', 'books': 'book'}
+
+MAX_HOPS = 4
+MAX_NODES = 1000
+
+
+def limit_arg(request, default=100, maximum=MAX_NODES):
+    """`?limit=` within 1 and `maximum`, raises ValueError"""
+    limit = int(request.args.get('limit', default))
+    if not 0 < limit <= maximum:
+        raise ValueError('Limit is expected from 1 to {}.'.format(maximum))
+    return limit
+
+
+def index_of(request):
+    return getattr(request.app, 'graph', None)
+
+
+@graph.route("/authors/<author_id:int>/coauthors")
+@doc.summary("Authors sharing books with an author, most shared first, "
+             "answered from the relation graph of this worker")
+@doc.produces([{"id": int, "shared": int}])
+async def graph_coauthors(request, author_id):
+    index = index_of(request)
+    if index is None:
+        return json({'error': 'Relation graph is disabled.'}, status=503)
+    try:
+        limit = limit_arg(request)
+    except ValueError as e:
+        return json({'error': str(e)}, status=400)
+    return json({'result': [
+        {'id': other, 'shared': shared} for other, shared in index.graph.coauthors(author_id, limit)
+    ]})
+
+
+@graph.route("/books/<book_id:int>/related")
+@doc.summary("Books sharing authors with a book, most shared first, "
+             "answered from the relation graph of this worker")
+@doc.produces([{"id": int, "shared": int}])
+async def graph_related(request, book_id):
+    index = index_of(request)
+    if index is None:
+        return json({'error': 'Relation graph is disabled.'}, status=503)
+    try:
+        limit = limit_arg(request)
+    except ValueError as e:
+        return json({'error': str(e)}, status=400)
+    return json({'result': [
+        {'id': other, 'shared': shared} for other, shared in index.graph.related_books(book_id, limit)
+    ]})
+
+
+@graph.route("/<kind:authors|books>/<node_id:int>/neighbourhood")
+@doc.summary("Authors and books within `hops` relations of an author or a book "
+             "with their distance, at most `limit` of them")
+@doc.produces({"authors": [{"id": int, "hops": int}], "books": [{"id": int, "hops": int}]})
+async def graph_neighbourhood(request, kind, node_id):
+    index = index_of(request)
+    if index is None:
+        return json({'error': 'Relation graph is disabled.'}, status=503)
+    try:
+        hops = int(request.args.get('hops', 2))
+        if not 0 < hops <= MAX_HOPS:
+            raise ValueError('Hops are expected from 1 to {}.'.format(MAX_HOPS))
+        limit = limit_arg(request)
+    except ValueError as e:
+        return json({'error': str(e)}, status=400)
+    found = index.graph.neighbourhood(KINDS[kind], node_id, hops, limit)
+    return json({'result': {
+        plural: [{'id': i, 'hops': d} for i, d in sorted(found[kind_].items(), key=lambda n: (n[1], n[0]))]
+        for plural, kind_ in KINDS.items()
+    }})
+
+
+@graph.route("/stats")
+@doc.summary("Size, memory footprint and build time of the relation graph of this worker")
+@doc.produces({"relations": int, "max_author_id": int, "max_book_id": int, "pending": int, "bytes": int,
+               "build_seconds": float, "load_seconds": float, "loads": int})
+async def graph_stats(request):
+    index = index_of(request)
+    return json(index.stats() if index else {})
@@ -10,3 +10,59 @@ health = Blueprint("health", url_prefix="/health")
 @doc.produces({"status": str})
 async def health_status_swagger(request):
     return json({"status": "OK"})
+
+
+@health.route("/statements")
+@doc.summary("Compiled statement cache hit/miss counters")
+@doc.produces({"size": int, "maxsize": int, "hits": int, "misses": int})
+async def health_statements(request):
+    return json(request.app.apg.statements.stats())
+
+
+@health.route("/pool")
+@doc.summary("Connection pool gauges of this worker")
+@doc.produces({"size": int, "idle": int, "in_use": int, "waiting": int,
+               "acquired": int, "wait_seconds": float, "timeouts": int})
+async def health_pool(request):
+    return json(request.app.apg.pool_stats.stats())
+
+
+@health.route("/flights")
+@doc.summary("Identical reads executed and coalesced by this worker")
+@doc.produces({"in_flight": int, "executed": int, "coalesced": int})
+async def health_flights(request):
+    flights = request.app.apg.flights
+    return json(flights.stats() if flights else {})
+
+
+@health.route("/replicas")
+@doc.summary("Replicas reads of this worker go to, their lag and ejections")
+@doc.produces({"max_lag": float, "replicas": [dict]})
+async def health_replicas(request):
+    replicas = request.app.apg.replicas
+    return json(replicas.stats() if replicas else {})
+
+
+@health.route("/writes")
+@doc.summary("Group committed writes of this worker, batches and their sizes")
+@doc.produces({"pending": int, "batches": int, "items": int, "largest": int, "retried": int})
+async def health_writes(request):
+    batcher = getattr(request.app, 'batcher', None)
+    return json(batcher.stats() if batcher else {})
+
+
+@health.route("/ready")
+@doc.summary("Readiness of this worker, 503 while its pool or admission queue is saturated")
+@doc.produces({"ready": bool, "pool": dict, "admission": dict})
+async def health_ready(request):
+    app = request.app
+    pool = app.apg.pool_stats.stats()
+    pool_saturated = pool['in_use'] >= pool['max_size'] and pool['waiting'] > 0
+    admission = getattr(app, 'admission', None)
+    admission_saturated = bool(admission and admission.saturated())
+    ready = not (pool_saturated or admission_saturated)
+    return json({
+        'ready': ready,
+        'pool': pool,
+        'admission': admission.stats() if admission else {},
+    }, status=200 if ready else 503)
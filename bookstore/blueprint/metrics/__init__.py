@@ -0,0 +1,11 @@
+from sanic.blueprints import Blueprint
+from sanic.response import text
+from sanic_openapi import doc
+
+metrics = Blueprint("metrics")
+
+
+@metrics.route("/metrics")
+@doc.summary("Request and query timings of all workers in Prometheus text format")
+async def metrics_text(request):
+    return text(request.app.metrics.render(), content_type="text/plain; version=0.0.4")
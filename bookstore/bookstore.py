@@ -1,8 +1,11 @@
 import os
 import json
 import asyncpg
+import hashlib
 import datetime
 
+from collections import OrderedDict, namedtuple
+
 import uvloop
 import asyncpgsa
 
@@ -12,15 +15,38 @@ from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 
 from sanic import Sanic
-from sanic.response import json as jsonify
+from sanic.response import HTTPResponse, stream
 from sanic_openapi import swagger_blueprint, openapi_blueprint, doc
+from bookstore.blueprint.changes import changes
+from bookstore.blueprint.export import exports
+from bookstore.blueprint.graph import graph
 from bookstore.blueprint.health import health
+from bookstore.blueprint.metrics import metrics
+from bookstore.dao.apg import apg
+from bookstore.dao.batch import WriteBatcher
+from bookstore.dao.cache import MemoryCache, cache_key, create_cache, create_versions
+from bookstore.dao.changes import ChangeFeed
+from bookstore.dao.flight import SingleFlight
+from bookstore.dao.graph import GraphIndex
+from bookstore.dao.pool import PoolStats, pool_options
+from bookstore.dao.replicas import Replica, ReplicaSet, replica_dsns
+from bookstore.dao.schema import prepare_schema
+from bookstore.dao.statements import StatementCache
+from bookstore.dao.tracing import SlowQueryLog
+from bookstore.middleware.admission import register as register_admission
+from bookstore.middleware.compression import register as register_compression
+from bookstore.middleware.metrics import register as register_metrics
+from bookstore.middleware.profile import register as register_profile
+from bookstore.middleware.replicas import register as register_replicas
+from bookstore.util.bulk import integer, parse_records, string, validate
+from bookstore.util.encoding import dumps, json as jsonify
 
 db_user = db_host = os.environ['SANIC_DB_HOST']
 db_name = os.environ['SANIC_DB_DATABASE']
 db_password = os.environ['SANIC_DB_PASSWORD']
 
 connection = 'postgres://{u}:{up}@{h}/{hp}'.format(u=db_user, up=db_password, h=db_host, hp=db_name)
+seed_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
 
 metadata = sa.MetaData()
 Base = declarative_base()
@@ -30,18 +56,38 @@ authors_table = sa.Table(
                 'author', metadata,
                 sa.Column('id', sa.Integer, primary_key=True),
                 sa.Column('name', sa.String(32)),
+                sa.Column('book_count', sa.Integer),
              )
 
 books_table = sa.Table(
                 'book', metadata,
                 sa.Column('id', sa.Integer, primary_key=True),
                 sa.Column('name', sa.String(128)),
+                sa.Column('author_count', sa.Integer),
              )
 
+# Keyset pagination bounds for list reads, see CRUDFactory.read
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Search results are ranked so they are paged by offset up to this one
+MAX_SEARCH_OFFSET = 10000
+# Rows fetched per server-side cursor round-trip when streaming
+STREAM_PREFETCH = 500
+# Row-level errors reported back by bulk endpoints at most
+MAX_BULK_ERRORS = 100
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+    'Access-Control-Max-Age': '1200',
+}
+
+
 mapping_table = sa.Table(
                 'author_book_rel', metadata,
-                sa.Column('author_id', sa.Integer, sa.ForeignKey(authors_table.c.id)),
-                sa.Column('book_id', sa.Integer, sa.ForeignKey(books_table.c.id)),
+                sa.Column('author_id', sa.Integer, sa.ForeignKey(authors_table.c.id), primary_key=True),
+                sa.Column('book_id', sa.Integer, sa.ForeignKey(books_table.c.id), primary_key=True),
+                sa.Index('author_book_rel_book_id_idx', 'book_id'),
              )
 
 
@@ -50,55 +96,150 @@ app = Sanic(__name__)
 app.blueprint(openapi_blueprint)
 app.blueprint(swagger_blueprint)
 
+app.blueprint(changes)
+app.blueprint(exports)
+app.blueprint(graph)
 app.blueprint(health)
+app.blueprint(metrics)
 
+register_metrics(app)
+register_admission(app)
+register_compression(app)
+register_replicas(app)
+register_profile(app)
 
-class apg:
+
+def cors(fn):
+    """A very simple decorator to add CORS headers
+    for the local front without external plugins
     """
-    Reusable asyncpgsa wrappers to reduce
-    the amount of boilerplate wrappers.
-    Handles acquiring a connection from pool
-    for each call.
+    async def wrapper(*args, **kwargs):
+        response = await fn(*args, **kwargs)
+        response.headers.update(CORS_HEADERS)
+        return response
+    return wrapper
+
+
+def page_args(request):
+    """Parses keyset pagination arguments `?after=<id>&limit=N`.
+    Raises ValueError on malformed or out of range values.
     """
-    def __init__(self, pool):
-        self.pool = pool
+    after = int(request.args.get('after', 0))
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if after < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('Invalid pagination arguments.')
+    return after, limit
 
-    async def fetch(self, *args, **kwargs):
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(*args, **kwargs)
 
-    async def fetchrow(self, *args, **kwargs):
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(*args, **kwargs)
+ListArgs = namedtuple('ListArgs', ['fields', 'sort', 'descending', 'after',
+                                   'filters', 'ids', 'limit'])
 
-    async def fetchval(self, *args, **kwargs):
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(*args, **kwargs)
 
-    async def execute(self, *args, **kwargs):
-        async with self.pool.acquire() as conn:
-            return await conn.execute(*args, **kwargs)
+def list_args(request, columns, sortable, counter):
+    """Parses list read arguments: `?fields=id,name` to return,
+    `?sort=<column>|-<column>` descending with a minus, by ID
+    by default (`order_by=` only takes the `counter`),
+    `?filter[<column>]=<value>` or `=<from>..<to>` of integer
+    columns, `?ids=1,2,3` and `?after=<id>&limit=N`, or
+    `?after=<value>,<id>` when sorted by another column.
+    Sorting and filtering are limited to `sortable` columns.
+    The ID and the sort column are always returned.
+    Raises ValueError on malformed or out of range values.
+    """
+    sort = request.args.get('sort')
+    if sort is None:
+        sort = request.args.get('order_by', 'id')
+        if sort != 'id' and sort.lstrip('-') != counter:
+            raise ValueError('Records can only be ordered by {}.'.format(counter))
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in sortable:
+        raise ValueError('Records can only be sorted by {}.'.format(', '.join(sortable)))
 
+    fields = list(columns.keys())
+    if 'fields' in request.args:
+        requested = set(request.args.get('fields').split(','))
+        if not requested <= set(fields):
+            raise ValueError('Known fields are {}.'.format(', '.join(fields)))
+        fields = [f for f in fields if f in requested | {'id', sort}]
 
+    filters = []
+    for key in sorted(request.args):
+        if not key.startswith('filter['):
+            continue
+        name = key[len('filter['):-1]
+        if not key.endswith(']') or name not in sortable:
+            raise ValueError('Records can only be filtered by {}.'.format(', '.join(sortable)))
+        value = request.args.get(key)
+        convert = columns[name].type.python_type
+        if convert is int and '..' in value:
+            low, high = value.split('..')
+            filters += [(name, op, int(v)) for op, v in (('from', low), ('to', high)) if v]
+        else:
+            filters.append((name, 'eq', convert(value)))
 
+    ids = None
+    if 'ids' in request.args:
+        ids = ids_arg(request)
 
+    after = request.args.get('after')
+    if after and sort == 'id':
+        after = int(after)
+        if after < 0:
+            raise ValueError('Invalid pagination arguments.')
+    elif after:
+        if ',' not in after:
+            raise ValueError('Pages sorted by {} continue after <{}>,<id>.'.format(sort, sort))
+        value, db_id = after.rsplit(',', 1)
+        after = (columns[sort].type.python_type(value), int(db_id))
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('Invalid pagination arguments.')
+    return ListArgs(tuple(fields), sort, descending, after or None, tuple(filters), ids, limit)
 
-def cors(fn):
-    """A very simple decorator to add CORS headers
-    for the local front without external plugins
+
+def search_args(request):
+    """Parses `?q=<text>&mode=prefix|fuzzy|fulltext&offset=N&limit=N`.
+    Raises ValueError on malformed or out of range values.
     """
-    async def wrapper(*args, **kwargs):
-        response = await fn(*args, **kwargs)
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
-        response.headers['Access-Control-Max-Age'] = '1200'
-        return response
-    return wrapper
+    q = request.args.get('q', '').strip()
+    mode = request.args.get('mode', 'prefix')
+    offset = int(request.args.get('offset', 0))
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    if not q or mode not in ('prefix', 'fuzzy', 'fulltext'):
+        raise ValueError('Search text and a known mode are expected.')
+    if not 0 <= offset <= MAX_SEARCH_OFFSET or not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('Invalid pagination arguments.')
+    return q, mode, offset, limit
+
+
+def etag_matches(request, etag):
+    """Whether `If-None-Match` of the request lists `etag`,
+    weak comparison as RFC 7232 requires for GET.
+    """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return '*' in tags or opaque in [t[2:] if t.startswith('W/') else t for t in tags]
+
+
+def ids_arg(request):
+    """Parses `?ids=1,2,3` of batched reads.
+    Raises ValueError on malformed or too many IDs.
+    """
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i]
+    if not 0 < len(ids) <= MAX_PAGE_SIZE:
+        raise ValueError('From 1 to {} IDs are expected.'.format(MAX_PAGE_SIZE))
+    return ids
 
 
 class CRUDFactory:
     """As long as both tables have the same column set
     it is possible to design a universal CRUD factory.
+    Related record counters are the only columns named
+    after the other table and are kept by triggers.
     :table: sqlalchemy.schema.Table 
     :slug: an acceptable by sanic.route('/path') decorator
     Sanic instance should be declared globally.
@@ -108,13 +249,26 @@ class CRUDFactory:
         self.slug = slug
 
         self.related = related
+        # Name of the table on the other side of the mapping table
+        self.related_name = [n for n in related.name.split('_')[:-1] if n != table.name].pop()
+        self.counter = table.c[self.related_name + '_count']
+        # Columns clients may set
+        self.writable = set(table.c.keys()) - {self.counter.name}
+        # Columns lists may be sorted and filtered by, all indexed along with the ID
+        self.sortable = ['id', 'name', self.counter.name]
 
         app.route(slug, methods=["POST"])(self.create)
         doc.summary('Creates a record by name, assigns sequential ID.')(self.create)
         doc.consumes({"name": str})
 
         app.route(os.path.join(slug, '<db_id:int>'), methods=["GET",])(self.read)
-        doc.summary('Fetches a single record by ID or all at once')(self.read)
+        doc.summary('Fetches a single record by ID or a page of records '
+                    'after the `after` ID, `stream=ndjson|json` streams the rest, '
+                    '`include=authors|books` embeds related records, '
+                    '`fields=id,name` returns only these columns, '
+                    '`filter[id|name|book_count|author_count]=<value>` or `=<from>..<to>` '
+                    'and `ids=1,2,3` filter them, `sort=[-]name|book_count|author_count` '
+                    'pages by the column after the `after=<value>,<id>` record instead')(self.read)
         doc.produces({"result": {"id": int, "name": str}})(self.read)
 
         app.route(slug, methods=["GET"])(self.read)
@@ -128,22 +282,156 @@ class CRUDFactory:
         doc.summary('Deletes a record by ID.')(self.delete)
         doc.produces({"result": "Success"})(self.delete)
 
+        app.route(os.path.join(slug, 'search'), methods=["GET"])(self.search)
+        doc.summary('Searches records by name prefix (default), trigram similarity '
+                    '`mode=fuzzy` or words `mode=fulltext`, best matches first.')(self.search)
+        doc.produces({"result": [{"id": int, "name": str, "rank": float}], "next": int})(self.search)
+
+        app.route(os.path.join(slug, 'bulk'), methods=["POST"])(self.bulk_create)
+        doc.summary('Creates records from a JSON array, NDJSON or CSV body '
+                    'in a single COPY, returns assigned IDs in order.')(self.bulk_create)
+        doc.consumes([{"name": str}])(self.bulk_create)
+        doc.produces({"result": [int]})(self.bulk_create)
+
+        app.route(os.path.join(slug, 'bulk'), methods=["PUT", "PATCH"])(self.bulk_update)
+        doc.summary('Renames records in a single statement.')(self.bulk_update)
+        doc.consumes([{"id": int, "name": str}])(self.bulk_update)
+
+        app.route(os.path.join(slug, 'bulk'), methods=["DELETE"])(self.bulk_delete)
+        doc.summary('Deletes records by IDs in a single statement.')(self.bulk_delete)
+        doc.consumes([int])(self.bulk_delete)
+
         app.route(os.path.join(slug, 'relcount', '<db_id:int>'), methods=["GET"])(self.count_related)
-        doc.summary('Counts related authors/books by ID.')(self.count_related)
+        doc.summary('Counts related authors/books by ID or by `ids=1,2,3` at once.')(self.count_related)
         doc.produces({"result": int})(self.count_related)
 
+        app.route(os.path.join(slug, 'relcount'), methods=["GET"])(self.count_related)
+
         app.route(os.path.join(slug, 'rellist', '<db_id:int>'), methods=["GET"])(self.list_related)
-        doc.summary('Lists related authors/books by ID.')(self.list_related)
+        doc.summary('Lists related authors/books by ID or by `ids=1,2,3` at once.')(self.list_related)
         doc.produces({"result": [{"id": int, "name": str}]})
 
+        app.route(os.path.join(slug, 'rellist'), methods=["GET"])(self.list_related)
+
 
     @cors
     async def preflight(self, *args, **kwargs):
         return jsonify({'message': 'A workaround for browsers'})
 
+    def statement(self, shape, build):
+        """Compiled statement of this table for the query `shape`,
+        `build` returns the SQLAlchemy query and is only called
+        once per shape.
+        """
+        return app.apg.statements.get((self.table.name, shape), build)
+
+    def reader(self, request):
+        """apg for the reads of `request`, see apg.reader"""
+        return app.apg.reader(request.get('lsn'))
+
+    async def cached(self, kind, db_id, load, db=None):
+        """Read-through `app.cache`, `load` coroutine function is
+        only called on a miss. Missing records are not cached.
+        Reads that have to be fresh bypass the cache.
+        """
+        if db is not None and db.fresh:
+            return await load()
+        key = cache_key(self.table.name, kind, db_id)
+        result = await app.cache.get(key)
+        if result is None:
+            result = await load()
+            if result is not None:
+                await app.cache.set(key, result)
+        return result
+
+    async def related_ids(self, db_id, db=None):
+        """IDs of the records on the other side of the mapping table"""
+        records = await (db or app.apg).fetch(
+            self.statement('relids', lambda: sa.select([self.related.c[self.related_name + '_id']])
+                .where(self.related.c[self.table.name + '_id'] == sa.bindparam('id'))),
+            {'id': db_id}
+        )
+        return [r[0] for r in records]
+
+    async def invalidate(self, db_ids=(), relations=(), related_lists=(), created=False):
+        """Drops cached reads of `db_ids` records, relation reads
+        of both sides for `relations` pairs of (own ID, related ID)
+        and related record lists of `related_lists` IDs that embed
+        names of records of this table.
+        Bumps the versions ETags of these reads are made of,
+        `created` records only change the table version.
+        """
+        keys, versions = [], []
+        for db_id in db_ids:
+            keys += [cache_key(self.table.name, kind, db_id)
+                     for kind in ('read', 'relcount', 'rellist')]
+            versions += [self.version(db_id), self.version(db_id, 'rel')]
+        # Records of both sides carry their related record counters
+        for db_id, related_id in relations:
+            keys += [cache_key(self.table.name, kind, db_id)
+                     for kind in ('read', 'relcount', 'rellist')]
+            keys += [cache_key(self.related_name, kind, related_id)
+                     for kind in ('read', 'relcount', 'rellist')]
+            versions += [self.version(db_id), self.version(db_id, 'rel'),
+                         '{}:{}'.format(self.related_name, related_id),
+                         cache_key(self.related_name, 'rel', related_id)]
+        keys += [cache_key(self.related_name, 'rellist', i) for i in related_lists]
+        versions += [cache_key(self.related_name, 'rel', i) for i in related_lists]
+        if db_ids or created or relations:
+            versions.append(self.table.name)
+        if relations:
+            versions += [self.related_name, self.related.name]
+        versions = set(versions)
+        await self.drop(keys, versions)
+        if app.apg.replicas:
+            # Replicas that had not replayed the write yet may have
+            # filled the caches back meanwhile
+            app.apg.replicas.after_lag(lambda: self.drop(keys, versions))
+
+    @staticmethod
+    async def drop(keys, versions):
+        await app.cache.delete(*keys)
+        await app.versions.bump(*versions)
+
+    def version(self, db_id, kind=None):
+        """Version key of a record or of its relations, e.g. `author:rel:1`"""
+        return cache_key(self.table.name, kind, db_id) if kind else '{}:{}'.format(self.table.name, db_id)
+
+    async def conditional(self, request, versions, respond, db=None):
+        """Answers 304 without calling `respond` coroutine function
+        when `If-None-Match` matches the ETag made of the `versions`
+        keys and the URL, tags a 200 response otherwise.
+        Encoded bodies are kept by ETag in `app.encoded`, so an
+        unchanged response is neither queried nor encoded again.
+        Fresh reads of `db` are neither tagged nor cached.
+        """
+        if db is not None and db.fresh:
+            return await respond()
+        epoch, values = await app.versions.versions(*versions)
+        # Weak, the same body is sent in several content encodings
+        etag = 'W/"{}"'.format(hashlib.sha1('{}|{}|{}|{}'.format(
+            epoch, request.path, request.query_string, values).encode()).hexdigest()[:20])
+        if etag_matches(request, etag):
+            return HTTPResponse(status=304, headers={'ETag': etag})
+        body = await app.encoded.get(etag)
+        if body is not None:
+            return HTTPResponse(body_bytes=body, headers={'ETag': etag},
+                                content_type='application/json')
+        response = await respond()
+        if response.status == 200:
+            response.headers['ETag'] = etag
+            await app.encoded.set(etag, response.body)
+        return response
+
     @cors
     async def create(self, request):
-        result = await app.apg.fetchrow(self.table.insert().values(name=request.json['name'])) 
+        result = await app.apg.fetchrow(
+            self.statement('create', lambda: self.table.insert()
+                .values(name=sa.bindparam('set_name'))
+                .returning(self.table.c.id)),
+            {'set_name': request.json['name']}
+        )
+        await self.invalidate(created=True)
         try:
             return jsonify({'id': result['id']}, status=201)
         except Exception as e:
@@ -151,81 +439,480 @@ class CRUDFactory:
 
     @cors
     async def read(self, request, db_id=False):
+        include = request.args.get('include')
+        if include and include != self.related_name + 's':
+            return jsonify({'error': 'Only {}s can be included.'.format(self.related_name)},
+                           status=400)
+        db = self.reader(request)
         if not db_id:
-            result = [dict(r) for r in await app.apg.fetch(self.table.select())]
-        else:
+            mode = request.args.get('stream')
+            if mode:
+                if set(request.args) - {'stream', 'after', 'limit', '_profile'}:
+                    return jsonify({'error': 'Only plain records are streamed by ID.'},
+                                   status=400)
+                try:
+                    after, limit = page_args(request)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}, status=400)
+                # Streams go on to the last record unless limited
+                if 'limit' not in request.args:
+                    limit = None
+                return self.stream(mode, after, limit, db)
             try:
-                result = dict(await app.apg.fetchrow(self.table.select(self.table.c.id == db_id)))
-            except TypeError:
-                return jsonify({'error': 'No matching record was found.'}, status=404)
+                args = list_args(request, self.table.c, self.sortable, self.counter.name)
+            except ValueError as e:
+                return jsonify({'error': str(e)}, status=400)
+            versions = [self.table.name]
+            if include:
+                versions += [self.related_name, self.related.name]
+            return await self.conditional(
+                request, versions, lambda: self.read_page(args, include, db), db)
+        versions = [self.version(db_id)]
+        if include:
+            versions.append(self.version(db_id, 'rel'))
+        return await self.conditional(
+            request, versions, lambda: self.read_one(db_id, include, db), db)
+
+    def page_query(self, args):
+        """Keyset page of the `args` columns, filtered and sorted
+        in SQL, ties by ID. Sorting by ID alone keeps it a
+        primary key range scan.
+        """
+        table = self.table
+        query = sa.select([table.c[f] for f in args.fields])
+        for name, op, _ in args.filters:
+            column = table.c[name]
+            value = sa.bindparam('{}_{}'.format(name, op), type_=column.type)
+            query = query.where(
+                column == value if op == 'eq' else column >= value if op == 'from' else column <= value)
+        if args.ids is not None:
+            query = query.where(table.c.id == sa.any_(
+                sa.bindparam('ids', type_=postgresql.ARRAY(sa.Integer))))
+        order = [table.c.id]
+        key, bound = table.c.id, sa.bindparam('after')
+        if args.sort != 'id':
+            order.insert(0, table.c[args.sort])
+            key = sa.tuple_(table.c[args.sort], table.c.id)
+            bound = sa.tuple_(sa.bindparam('after_value', type_=table.c[args.sort].type), bound)
+        if args.after is not None:
+            query = query.where(key < bound if args.descending else key > bound)
+        return (query.order_by(*[c.desc() if args.descending else c for c in order])
+                .limit(sa.bindparam('limit', type_=sa.Integer)))
+
+    async def read_page(self, args, include, db):
+        # Fetching one extra row tells whether there is a next page
+        shape = ['page', args.sort, 'desc' if args.descending else 'asc',
+                 'first' if args.after is None else 'after']
+        if args.fields != tuple(self.table.c.keys()):
+            shape.append('fields=' + ','.join(args.fields))
+        shape += ['{}={}'.format(name, op) for name, op, _ in args.filters]
+        if args.ids is not None:
+            shape.append('ids')
+        values = {'limit': args.limit + 1, 'ids': args.ids}
+        values.update(('{}_{}'.format(name, op), value) for name, op, value in args.filters)
+        if args.sort == 'id':
+            values['after'] = args.after
+        elif args.after is not None:
+            values['after_value'], values['after'] = args.after
+        records = await db.fetch(
+            self.statement(tuple(shape), lambda: self.page_query(args)), values)
+        # Records are encoded as they are unless something is embedded
+        result = records[:args.limit]
+        next_after = None
+        if len(records) > args.limit:
+            last = result[-1]
+            next_after = last['id'] if args.sort == 'id' else '{},{}'.format(last[args.sort], last['id'])
+        return jsonify({'result': await self.embed(result, include, db), 'next': next_after})
+
+    async def embed(self, records, include, db):
+        """Records with their related ones under `include` if given"""
+        if not include:
+            return records
+        # A single query for the whole page instead of one per record
+        related = await self.related_many([r['id'] for r in records], db)
+        return [dict(r, **{include: related[r['id']]}) for r in records]
+
+    async def read_one(self, db_id, include, db):
+        async def load():
+            record = await db.fetchrow(
+                self.statement('read', lambda: self.table.select(
+                    self.table.c.id == sa.bindparam('id'))),
+                {'id': db_id}
+            )
+            return record and dict(record)
+
+        result = await self.cached('read', db_id, load, db)
+        if result is None:
+            return jsonify({'error': 'No matching record was found.'}, status=404)
+        if include:
+            # Cached values are shared, hence the copy
+            result = dict(result, **{include: await self.related_one(db_id, db)})
         return jsonify({'result': result})
     
+    def stream(self, mode, after, limit, db):
+        """Streams all records after the `after` ID, the first
+        `limit` of them unless None, straight from a server-side
+        cursor either as NDJSON or as a chunked JSON array keeping
+        memory per request flat.
+        """
+        if mode not in ('ndjson', 'json'):
+            return jsonify({'error': 'Unknown stream mode.'}, status=400)
+        query = self.statement('stream', lambda: self.table.select()
+            .where(self.table.c.id > sa.bindparam('after'))
+            .order_by(self.table.c.id)
+            .limit(sa.bindparam('limit', type_=sa.Integer)))
+        ndjson = mode == 'ndjson'
+
+        async def streaming_fn(response):
+            chunk = []
+            written = []
+
+            async def write(record):
+                chunk.append(dumps(record))
+                if len(chunk) >= STREAM_PREFETCH:
+                    await flush()
+
+            async def flush():
+                if not chunk:
+                    return
+                if ndjson:
+                    await response.write(b'\n'.join(chunk) + b'\n')
+                else:
+                    # Comma goes in front of every chunk but the first one
+                    await response.write((b',' if written else b'') + b','.join(chunk))
+                written.append(len(chunk))
+                del chunk[:]
+
+            if not ndjson:
+                await response.write('{"result":[')
+            # LIMIT NULL is no limit at all
+            await db.iterate(query, write, {'after': after, 'limit': limit},
+                             prefetch=STREAM_PREFETCH)
+            await flush()
+            if not ndjson:
+                await response.write(']}')
+
+        return stream(
+            streaming_fn,
+            content_type='application/x-ndjson' if ndjson else 'application/json'
+        )
+
+    def search_query(self, mode):
+        """Each mode is backed by its own index of the name column"""
+        name = self.table.c.name
+        q = sa.bindparam('q', type_=sa.String)
+        order = None
+        if mode == 'prefix':
+            where = sa.func.lower(name).like(sa.bindparam('pattern', type_=sa.String))
+            rank = sa.cast(sa.literal_column('1'), sa.Float)
+            order = [sa.func.lower(name), self.table.c.id]
+        elif mode == 'fuzzy':
+            # pg_trgm similarity operator, doubled to survive pyformat
+            where = name.op('%%')(q)
+            rank = sa.func.similarity(name, q)
+        else:
+            vector = sa.func.to_tsvector(sa.literal_column("'simple'"), name)
+            query = sa.func.plainto_tsquery(sa.literal_column("'simple'"), q)
+            where = vector.op('@@')(query)
+            rank = sa.func.ts_rank(vector, query)
+        return (sa.select([self.table.c.id, name, rank.label('rank')])
+                .where(where)
+                .order_by(*(order or [rank.desc(), self.table.c.id]))
+                .limit(sa.bindparam('limit', type_=sa.Integer))
+                .offset(sa.bindparam('offset', type_=sa.Integer)))
+
+    @cors
+    async def search(self, request):
+        try:
+            q, mode, offset, limit = search_args(request)
+        except ValueError as e:
+            return jsonify({'error': str(e)}, status=400)
+        pattern = q.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        records = await self.reader(request).fetch(
+            self.statement(('search', mode), lambda: self.search_query(mode)),
+            {'q': q, 'pattern': pattern, 'offset': offset, 'limit': limit + 1}
+        )
+        result = records[:limit]
+        next_offset = offset + limit if len(records) > limit else None
+        return jsonify({'result': result, 'next': next_offset})
+
+    def relate_query(self):
+        """Inserts a relation row in a single call preserving
+        idempotency, nothing is returned for an existing pair
+        """
+        rel_cols = [c + '_id' for c in self.related.name.split('_')[:-1]]
+        return (postgresql.insert(self.related)
+                .values({c: sa.bindparam(c) for c in rel_cols})
+                .on_conflict_do_nothing()
+                .returning(self.related.c[rel_cols[0]]))
+
     @cors
     async def update(self, request, db_id):
+        columns = self.related.name.split('_')[:-1]
+        related_name = [n for n in columns if n != self.table.name].pop()
+        related_id = request.json.pop(related_name + '_id', None)
+        keys = tuple(sorted(request.json))
+        if not set(keys) <= self.writable:
+            return jsonify({'error': 'Unknown field supplied.'}, status=400)
+        related, row, related_lists = False, None, []
         try:
-            modified = False
-            columns = self.related.name.split('_')[:-1]
-            related_name = [n for n in columns if n != self.table.name].pop()
-            related_id = request.json.pop(related_name + '_id', None)
-            if related_id:
-                rel_cols = [c + '_id' for c in columns]
-                values = {self.table.name + '_id': db_id,
-                          related_name + '_id': related_id}
-                # Update related row in a single call preserving idempotency
-                # using from_select()
-                select = sa.select([values[rel_cols[0]], values[rel_cols[1]]]).where(
-                    ~sa.exists(self.related.c).where(
-                        sa.and_(self.related.c[rel_cols[0]] == values[rel_cols[0]],
-                        self.related.c[rel_cols[1]] == values[rel_cols[1]])
-                    )
-                )
-                insert = await app.apg.fetchval(
-                    self.related.insert()
-                        .from_select(rel_cols, select)
-                        .returning(self.related.c[related_name + '_id'])
-                )
-                modified = bool(insert)
-            if request.json:
-                row = await app.apg.fetchval(
-                    self.table.update().values(**request.json)
-                        .where(self.table.c.id == db_id)
-                        .returning(self.table.c.id)
-                )
-                if not row:
-                    return jsonify({'error': 'Not found.'}, status=404)
-                modified = True
-            return jsonify(
-                {'result': 'Success' if modified else 'Relation already exists.'},
-                status=200 if modified else 304
-            )
+            if app.batcher is not None and keys in ((), ('name',)):
+                # Relations and renames of concurrent requests are group committed,
+                # a record deleted after the batch checked it fails the item alone
+                result = await app.batcher.submit(
+                    self.batch_update, (db_id, related_id, request.json))
+                if result is None:
+                    return jsonify({'error': 'Invalid ID supplied.'}, status=400)
+                related, row, related_lists = result
+            else:
+                # Both statements go through one connection atomically
+                async with app.apg.transaction() as db:
+                    if related_id:
+                        related = bool(await db.fetchval(
+                            self.statement('relate', self.relate_query),
+                            {self.table.name + '_id': db_id, related_name + '_id': related_id}
+                        ))
+                    if request.json:
+                        row = await db.fetchval(
+                            self.statement(('update',) + keys, lambda: self.table.update()
+                                .values({k: sa.bindparam('set_' + k) for k in keys})
+                                .where(self.table.c.id == sa.bindparam('id'))
+                                .returning(self.table.c.id)),
+                            dict({'set_' + k: v for k, v in request.json.items()}, id=db_id)
+                        )
+                        if row:
+                            related_lists = await self.related_ids(row, db)
         except asyncpg.exceptions.ForeignKeyViolationError:
             return jsonify({'error': 'Invalid ID supplied.'}, status=400)
+        if related:
+            await self.invalidate(relations=[(db_id, related_id)])
+        if request.json:
+            if not row:
+                return jsonify({'error': 'Not found.'}, status=404)
+            # Names are embedded in the related lists of the other side,
+            # an ID change moves relation rows by ON UPDATE CASCADE
+            await self.invalidate(db_ids={db_id, row}, related_lists=related_lists)
+        modified = related or bool(row)
+        return jsonify(
+            {'result': 'Success' if modified else 'Relation already exists.'},
+            status=200 if modified else 304
+        )
+
+    async def batch_update(self, db, items):
+        """Relations and renames of update() for (ID, related ID,
+        fields) items in a few statements over arrays. Results are
+        (related, row, related_lists) as update() gets them one by
+        one or None for a relation to a missing record, which
+        leaves the rename of the item out as well.
+        """
+        mine, other = self.table.name, self.related_name
+        relating = [i for i, item in enumerate(items) if item[1]]
+        invalid, inserted = set(), set()
+        if relating:
+            found = {r[0] - 1 for r in await db.fetch(
+                'SELECT v.i FROM unnest($1::int[], $2::int[]) WITH ORDINALITY AS v(mine, other, i) '
+                'WHERE EXISTS (SELECT 1 FROM {mine} WHERE id = v.mine) '
+                'AND EXISTS (SELECT 1 FROM {other} WHERE id = v.other)'.format(mine=mine, other=other),
+                [items[i][0] for i in relating], [items[i][1] for i in relating]
+            )}
+            invalid = {i for n, i in enumerate(relating) if n not in found}
+            valid = [i for i in relating if i not in invalid]
+            pairs = set()
+            if valid:
+                pairs = {tuple(r) for r in await db.fetch(
+                    'INSERT INTO {rel} ({mine}_id, {other}_id) SELECT * FROM unnest($1::int[], $2::int[]) '
+                    'ON CONFLICT DO NOTHING RETURNING {mine}_id, {other}_id'.format(
+                        rel=self.related.name, mine=mine, other=other),
+                    [items[i][0] for i in valid], [items[i][1] for i in valid]
+                )}
+            # A pair requested twice is only new to the first request
+            for i in valid:
+                if items[i][:2] in pairs:
+                    pairs.discard(items[i][:2])
+                    inserted.add(i)
+        # The last rename of a record wins as it would one by one
+        names = OrderedDict(
+            (db_id, fields['name']) for i, (db_id, _, fields) in enumerate(items)
+            if fields and i not in invalid
+        )
+        updated, related_lists = set(), {}
+        if names:
+            updated = {r[0] for r in await db.fetch(
+                'UPDATE {t} SET name = v.name FROM unnest($1::int[], $2::text[]) AS v(id, name) '
+                'WHERE {t}.id = v.id RETURNING {t}.id'.format(t=mine),
+                list(names), list(names.values())
+            )}
+            for db_id, related_id in await self.bulk_related(db, list(updated)):
+                related_lists.setdefault(db_id, []).append(related_id)
+        results = []
+        for i, (db_id, _, fields) in enumerate(items):
+            if i in invalid:
+                results.append(None)
+                continue
+            row = db_id if fields and db_id in updated else None
+            results.append((i in inserted, row, related_lists.get(row, [])))
+        return results
 
     
     @cors
     async def delete(self, request, db_id):
-        result = await app.apg.fetchval(
-            self.table.delete().where(self.table.c.id == db_id).returning(self.table.c.id)
-       )
+        async with app.apg.transaction() as db:
+            # Relation rows are gone by ON DELETE CASCADE afterwards
+            related_ids = await self.related_ids(db_id, db)
+            result = await db.fetchval(
+                self.statement('delete', lambda: self.table.delete()
+                    .where(self.table.c.id == sa.bindparam('id'))
+                    .returning(self.table.c.id)),
+                {'id': db_id}
+            )
+        if result:
+            await self.invalidate(
+                db_ids=[db_id],
+                relations=[(db_id, related_id) for related_id in related_ids]
+            )
         return jsonify(
             {'result': 'Success' if result else 'No matching record found.'},
             status=200 if result else 404
         )
 
 
+    def bulk_rows(self, request, fields):
+        """Parses and validates a bulk request body, returns
+        either records or an error response.
+        """
+        try:
+            rows = parse_records(request.body, request.content_type)
+        except ValueError as e:
+            return None, jsonify({'error': str(e)}, status=400)
+        records, errors = validate(rows, fields)
+        if errors:
+            return None, jsonify({'errors': errors[:MAX_BULK_ERRORS]}, status=400)
+        return records, None
+
+    async def bulk_related(self, db, db_ids):
+        """(own ID, related ID) pairs of the mapping table for `db_ids`"""
+        return [tuple(r) for r in await db.fetch(
+            'SELECT {mine}_id, {other}_id FROM {rel} WHERE {mine}_id = ANY($1::int[])'.format(
+                mine=self.table.name, other=self.related_name, rel=self.related.name),
+            db_ids
+        )]
+
     @cors
-    async def count_related(self, request, db_id):
-        related_name = self.table.name + '_id'
-        result = await app.apg.fetchval(
-            sa.select([sa.func.count()])
-                .select_from(self.related)
-                .where(self.related.c[related_name] == db_id)
+    async def bulk_create(self, request):
+        records, error = self.bulk_rows(request, [('name', string(self.table.c.name.type.length))])
+        if error:
+            return error
+        async with app.apg.transaction() as db:
+            # COPY does not return anything so IDs are drawn from the sequence upfront
+            ids = [r[0] for r in await db.fetch(
+                "SELECT nextval(pg_get_serial_sequence('{}', 'id')) "
+                "FROM generate_series(1, $1) ORDER BY 1".format(self.table.name),
+                len(records)
+            )]
+            await db.conn.copy_records_to_table(
+                self.table.name,
+                records=[(i,) + r for i, r in zip(ids, records)],
+                columns=['id', 'name']
+            )
+        await self.invalidate(created=True)
+        return jsonify({'result': ids}, status=201)
+
+    @cors
+    async def bulk_update(self, request):
+        records, error = self.bulk_rows(request, [
+            ('id', integer),
+            ('name', string(self.table.c.name.type.length))
+        ])
+        if error:
+            return error
+        ids = [r[0] for r in records]
+        async with app.apg.transaction() as db:
+            updated = {r[0] for r in await db.fetch(
+                'UPDATE {t} SET name = v.name FROM unnest($1::int[], $2::text[]) AS v(id, name) '
+                'WHERE {t}.id = v.id RETURNING {t}.id'.format(t=self.table.name),
+                ids, [r[1] for r in records]
+            )}
+            pairs = await self.bulk_related(db, list(updated))
+        await self.invalidate(db_ids=updated, related_lists={p[1] for p in pairs})
+        errors = [{'row': i, 'error': 'Not found.'}
+                  for i, db_id in enumerate(ids) if db_id not in updated]
+        return jsonify({'result': sorted(updated), 'errors': errors[:MAX_BULK_ERRORS]})
+
+    @cors
+    async def bulk_delete(self, request):
+        try:
+            rows = parse_records(request.body, request.content_type)
+        except ValueError as e:
+            return jsonify({'error': str(e)}, status=400)
+        # Plain arrays of IDs are accepted as well
+        records, errors = validate(
+            [r if isinstance(r, dict) else {'id': r} for r in rows], [('id', integer)]
         )
-        return jsonify({'result': result})
+        if errors:
+            return jsonify({'errors': errors[:MAX_BULK_ERRORS]}, status=400)
+        ids = [r[0] for r in records]
+        async with app.apg.transaction() as db:
+            # Relation rows are gone by ON DELETE CASCADE afterwards
+            pairs = await self.bulk_related(db, ids)
+            deleted = {r[0] for r in await db.fetch(
+                'DELETE FROM {t} WHERE id = ANY($1::int[]) RETURNING id'.format(t=self.table.name),
+                ids
+            )}
+        await self.invalidate(db_ids=deleted, relations=pairs)
+        errors = [{'row': i, 'error': 'No matching record found.'}
+                  for i, db_id in enumerate(ids) if db_id not in deleted]
+        return jsonify({'result': sorted(deleted), 'errors': errors[:MAX_BULK_ERRORS]})
+
+    def stored_count_query(self, many=False):
+        """Related record counters kept by the mapping table triggers"""
+        if many:
+            return (sa.select([self.table.c.id, self.counter])
+                    .where(self.table.c.id == sa.any_(
+                        sa.bindparam('ids', type_=postgresql.ARRAY(sa.Integer)))))
+        return sa.select([self.counter]).where(self.table.c.id == sa.bindparam('id'))
 
+    def count_related_query(self, many=False):
+        """Counts the mapping table rows, what the stored counters hold"""
+        related_name = self.table.name + '_id'
+        if many:
+            return (sa.select([self.related.c[related_name], sa.func.count()])
+                    .where(self.related.c[related_name] == sa.any_(
+                        sa.bindparam('ids', type_=postgresql.ARRAY(sa.Integer))))
+                    .group_by(self.related.c[related_name]))
+        return (sa.select([sa.func.count()])
+                .select_from(self.related)
+                .where(self.related.c[related_name] == sa.bindparam('id')))
 
     @cors
-    async def list_related(self, request, db_id):
+    async def count_related(self, request, db_id=False):
+        db = self.reader(request)
+        if not db_id:
+            try:
+                ids = ids_arg(request)
+            except ValueError as e:
+                return jsonify({'error': str(e)}, status=400)
+
+            async def respond():
+                counts = dict(await db.fetch(
+                    self.statement('relcount_many', lambda: self.stored_count_query(many=True)),
+                    {'ids': ids}
+                ))
+                return jsonify({'result': {str(i): counts.get(i, 0) for i in ids}})
+
+            return await self.conditional(
+                request, [self.version(i, 'rel') for i in ids], respond, db)
+
+        async def respond():
+            # Missing records have nothing related
+            return jsonify({'result': await self.cached('relcount', db_id, lambda: db.fetchval(
+                self.statement('relcount', self.stored_count_query),
+                {'id': db_id}
+            ), db) or 0})
+
+        return await self.conditional(request, [self.version(db_id, 'rel')], respond, db)
+
+
+    def list_related_query(self, many=False):
         field_names = self.related.name.split('_')[:-1]
         field_names.remove(self.table.name)
         related_name = field_names.pop()
@@ -236,56 +923,194 @@ class CRUDFactory:
         }
         related_table = tables[related_name]
         mapping = tables['mapping']
+        key = mapping.c[self.table.name + '_id']
 
-        result = await app.apg.fetch(
-            sa.select([related_table.c.id, related_table.c.name]).select_from(related_table
+        columns = [related_table.c.id, related_table.c.name]
+        if many:
+            columns.insert(0, key.label('key'))
+        query = sa.select(columns).select_from(related_table
                 .join(mapping, related_table.c.id == mapping.c[related_name + '_id'])
-                .join(self.table, self.table.c.id == mapping.c[self.table.name + '_id'])
-            )    
-           .where(mapping.c[self.table.name + '_id'] == db_id)
-        )
-        return jsonify({'result': [dict(r) for r in result]})
+                .join(self.table, self.table.c.id == key)
+            )
+        if many:
+            return query.where(key == sa.any_(
+                sa.bindparam('ids', type_=postgresql.ARRAY(sa.Integer))))
+        return query.where(key == sa.bindparam('id'))
+
+    async def related_one(self, db_id, db):
+        async def load():
+            result = await db.fetch(
+                self.statement('rellist', self.list_related_query),
+                {'id': db_id}
+            )
+            return [dict(r) for r in result]
+
+        return await self.cached('rellist', db_id, load, db)
+
+    async def related_many(self, ids, db):
+        """Related records of all the `ids` in a single query,
+        a list for every ID even if there is nothing related.
+        """
+        related = {i: [] for i in ids}
+        for r in await db.fetch(
+            self.statement('rellist_many', lambda: self.list_related_query(many=True)),
+            {'ids': ids}
+        ):
+            related[r['key']].append({'id': r['id'], 'name': r['name']})
+        return related
+
+    @cors
+    async def list_related(self, request, db_id=False):
+        db = self.reader(request)
+        if not db_id:
+            try:
+                ids = ids_arg(request)
+            except ValueError as e:
+                return jsonify({'error': str(e)}, status=400)
+
+            async def respond():
+                related = await self.related_many(ids, db)
+                return jsonify({'result': {str(i): related[i] for i in ids}})
+
+            return await self.conditional(
+                request, [self.version(i, 'rel') for i in ids], respond, db)
+
+        async def respond():
+            return jsonify({'result': await self.related_one(db_id, db)})
+
+        return await self.conditional(request, [self.version(db_id, 'rel')], respond, db)
                 
 
-CRUDFactory(authors_table, '/authors', related=mapping_table)
-CRUDFactory(books_table, '/books', related=mapping_table)
+authors = CRUDFactory(authors_table, '/authors', related=mapping_table)
+books = CRUDFactory(books_table, '/books', related=mapping_table)
+
+
+@app.route('/relations/bulk', methods=['POST'])
+@doc.summary('Relates authors and books from a JSON array, NDJSON or CSV body '
+             'in a single COPY, already existing pairs are skipped.')
+@doc.consumes([{"author_id": int, "book_id": int}])
+@doc.produces({"result": {"inserted": int, "skipped": int}})
+@cors
+async def bulk_relate(request):
+    records, error = authors.bulk_rows(request, [('author_id', integer), ('book_id', integer)])
+    if error:
+        return error
+    async with app.apg.transaction() as db:
+        # Rows are staged through a temporary table so that invalid IDs
+        # can be reported by row instead of failing the whole COPY
+        await db.execute('CREATE TEMPORARY TABLE rel_import '
+                           '(row integer, author_id integer, book_id integer) ON COMMIT DROP')
+        await db.conn.copy_records_to_table(
+            'rel_import', records=[(i,) + r for i, r in enumerate(records)]
+        )
+        invalid = await db.fetch(
+            'SELECT row FROM rel_import i '
+            'WHERE NOT EXISTS (SELECT 1 FROM author WHERE id = i.author_id) '
+            'OR NOT EXISTS (SELECT 1 FROM book WHERE id = i.book_id) ORDER BY row '
+            'LIMIT {}'.format(MAX_BULK_ERRORS)
+        )
+        if invalid:
+            return jsonify({'errors': [{'row': r['row'], 'error': 'Invalid ID supplied.'}
+                                       for r in invalid]}, status=400)
+        pairs = [tuple(r) for r in await db.fetch(
+            'INSERT INTO author_book_rel (author_id, book_id) '
+            'SELECT author_id, book_id FROM rel_import '
+            'ON CONFLICT DO NOTHING RETURNING author_id, book_id'
+        )]
+    await authors.invalidate(relations=pairs)
+    return jsonify({'result': {'inserted': len(pairs), 'skipped': len(records) - len(pairs)}},
+                   status=201)
 
 
 @app.listener('before_server_start')
 async def prepare_db(app, loop):
     # Declare asynchronous Postgres (apg) app-wide
-    pool = await asyncpgsa.create_pool(connection)
-    app.apg = apg(pool)
-
-    # Wrapping multiple DB setting up statements in a single transaction
-    # so not yet using app.apg
-    # As long as this is the only use case of a transaction wrapping
-    # not implementing it in the apg class.
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute('DROP TABLE IF EXISTS author_book_rel')
-            await conn.execute('DROP TABLE IF EXISTS author')
-            await conn.execute('DROP TABLE IF EXISTS book')
-            await conn.execute("""CREATE TABLE author (
-                                   id serial primary key,
-                                   name varchar(32)
-                               );
-                               CREATE TABLE book (
-                                   id serial primary key,
-                                   name varchar(128)
-                               );
-                               CREATE TABLE author_book_rel (
-                                   author_id INTEGER REFERENCES author(id)
-                                             ON DELETE CASCADE ON UPDATE CASCADE,
-                                   book_id INTEGER REFERENCES book(id) 
-                                           ON DELETE CASCADE ON UPDATE CASCADE
-                               );""")
-
-            # Postgres docs suggest using COPY method for large bulk inserts,
-            # here it comes for demonstrative purposes only.
-            # ID column turned out not to auto increment on COPY that is why
-            # populating name column explicitly.
-            await conn.execute("COPY author(name) FROM '/initial_data/author'")
-            await conn.execute("COPY book(name) FROM '/initial_data/book'")
-            await conn.execute("COPY author_book_rel FROM '/initial_data/author_book_rel'")
+    pool = await asyncpgsa.create_pool(connection, **pool_options(app.config))
+    acquire_timeout = app.config.get('DB_ACQUIRE_TIMEOUT', 5)
+    acquire_timeout = float(acquire_timeout) if acquire_timeout else None
+    # Coalescing identical reads in flight, DB_COALESCE=0 turns it off
+    coalesce = bool(int(app.config.get('DB_COALESCE', 1)))
+    # Reads go to the standbys of DB_REPLICAS if any
+    dsns = replica_dsns(app.config.get('DB_REPLICAS'), db_user, db_password, db_name)
+    replicas = None
+    if dsns:
+        replicas = ReplicaSet(
+            [Replica(dsn) for dsn in dsns],
+            pool_options(app.config), acquire_timeout, coalesce,
+            max_lag=float(app.config.get('DB_REPLICA_MAX_LAG', 1)),
+            interval=float(app.config.get('DB_REPLICA_CHECK_INTERVAL', 1)),
+            eject_for=float(app.config.get('DB_REPLICA_EJECT', 5))
+        )
+    app.apg = apg(
+        pool,
+        StatementCache(int(app.config.get('DB_STATEMENTS', 256))),
+        PoolStats(pool, acquire_timeout),
+        flights=SingleFlight() if coalesce else None,
+        replicas=replicas
+    )
+    # Relations and renames of update() are group committed with DB_BATCH_WRITES=1
+    app.batcher = None
+    if int(app.config.get('DB_BATCH_WRITES', 0)):
+        app.batcher = WriteBatcher(
+            app.apg,
+            max_latency=float(app.config.get('DB_BATCH_LATENCY', 0.005)),
+            max_size=int(app.config.get('DB_BATCH_SIZE', 256))
+        )
+    # Queries of DB_SLOW_QUERY seconds or more are logged, 0 turns it off
+    slow_query = float(app.config.get('DB_SLOW_QUERY', 0.5))
+    if slow_query:
+        app.apg.hooks.append(SlowQueryLog(
+            slow_query, redact=not int(app.config.get('DB_LOG_PARAMS', 0))))
+    app.cache = await create_cache(
+        app.config.get('CACHE_URL'),
+        maxsize=int(app.config.get('CACHE_SIZE', 10000)),
+        ttl=int(app.config.get('CACHE_TTL', 60))
+    )
+    # ETag write counters every worker shares
+    app.versions = create_versions(app.cache, app.apg)
+    # Encoded response bodies by ETag, always in-process
+    app.encoded = MemoryCache(
+        maxsize=int(app.config.get('ENCODED_CACHE_SIZE', 256)),
+        ttl=int(app.config.get('CACHE_TTL', 60))
+    )
+
+    # Tables are created and seeded once, DB_SCHEMA=reset drops them first
+    await prepare_schema(
+        pool,
+        app.config.get('DB_SEED_DIR', seed_dir),
+        reset=app.config.get('DB_SCHEMA', 'migrate') == 'reset'
+    )
+    if replicas:
+        await replicas.start(app.apg)
+
+    # Every worker listens to the change log on a connection of its own
+    app.changes = None
+    if int(app.config.get('CHANGES', 1)):
+        app.changes = ChangeFeed(
+            connection, app.apg,
+            backlog=int(app.config.get('CHANGES_BACKLOG', 1000)),
+            retention=float(app.config.get('CHANGES_RETENTION', 86400))
+        )
+        await app.changes.start()
+
+    # Relations in memory for graph reads, GRAPH=0 turns it off
+    app.graph = None
+    if int(app.config.get('GRAPH', 1)):
+        app.graph = GraphIndex(
+            app.apg, app.changes,
+            reload=float(app.config.get('GRAPH_RELOAD', 60))
+        )
+        await app.graph.start()
+
 
+@app.listener('after_server_stop')
+async def close_db(app, loop):
+    if app.graph:
+        await app.graph.stop()
+    if app.changes:
+        await app.changes.stop()
+    await app.cache.close()
+    await app.encoded.close()
+    if app.apg.replicas:
+        await app.apg.replicas.stop()
+    await app.apg.pool.close()
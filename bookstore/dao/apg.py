@@ -0,0 +1,158 @@
+import asyncio
+import time
+import weakref
+
+from bookstore.dao.flight import flight_key
+from bookstore.dao.pool import Held, PoolStats, Transaction
+from bookstore.dao.replicas import RETRYABLE, unreachable
+from bookstore.dao.statements import StatementCache, bind
+from bookstore.dao.tracing import QueryTiming
+
+
+current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+
+class apg:
+    """
+    Reusable asyncpgsa wrappers to reduce
+    the amount of boilerplate wrappers.
+    Handles acquiring a connection from pool
+    for each call unless bound to a connection
+    by transaction().
+    Queries are either SQLAlchemy expressions or
+    Statements from the `statements` cache followed
+    by a dict of their values.
+    Every callable of `hooks` gets a QueryTiming of
+    each query once it is done.
+    Identical readonly statements share one round-trip
+    through `flights` unless they run in a transaction.
+    Queries of a task that started a trace are kept
+    in it as well, see start_trace().
+    Reads that tolerate replication lag go through
+    reader() to one of the `replicas` if any.
+    """
+    def __init__(self, pool, statements=None, pool_stats=None, conn=None, hooks=None,
+                 flights=None, replicas=None, traces=None):
+        self.pool = pool
+        self.statements = statements or StatementCache()
+        self.pool_stats = pool_stats or PoolStats(pool)
+        self.conn = conn
+        self.hooks = [] if hooks is None else hooks
+        self.flights = flights
+        self.replicas = replicas
+        # Traces by the task they were started in, gone with it
+        self.traces = weakref.WeakKeyDictionary() if traces is None else traces
+        # Set on readers only: the replica these run on, the wrappers
+        # of the primary to fall back to and whether reads have to see
+        # the writes of the client
+        self.replica = None
+        self.primary = None
+        self.fresh = False
+
+    def acquire(self):
+        if self.conn is not None:
+            return Held(self.conn)
+        return self.pool_stats.acquire()
+
+    def bind(self, conn):
+        """The same wrappers running on `conn` only"""
+        return apg(self.pool, self.statements, self.pool_stats, conn, self.hooks, self.flights,
+                   traces=self.traces)
+
+    def reader(self, after=None):
+        """Wrappers for reads: those of a replica in turn, the
+        primary ones when there is no replica available. Given
+        the `after` LSN of a client write, only a replica that
+        replayed it is taken and reads are neither coalesced
+        nor meant to be cached, see `fresh`.
+        """
+        if self.replicas is None or self.conn is not None:
+            return self
+        replica = self.replicas.pick(after)
+        if replica is None and after is None:
+            return self
+        if replica is None:
+            db = apg(self.pool, self.statements, self.pool_stats, hooks=self.hooks,
+                     traces=self.traces)
+        else:
+            db = apg(replica.pool, self.statements, replica.pool_stats, hooks=self.hooks,
+                     flights=None if after is not None else replica.flights, traces=self.traces)
+            db.replica = replica
+        db.primary = self
+        db.fresh = after is not None
+        return db
+
+    def start_trace(self):
+        """List every query of the current task is appended to as a
+        QueryTiming from now on, traced queries are not coalesced.
+        """
+        trace = self.traces[current_task()] = []
+        return trace
+
+    def stop_trace(self):
+        return self.traces.pop(current_task(), None)
+
+    async def run(self, method, query, args, kwargs):
+        args = bind(query, args)
+        trace = self.traces.get(current_task()) if self.traces else None
+        if (self.flights is not None and self.conn is None and not kwargs and trace is None
+                and getattr(query, 'readonly', False)):
+            return await self.flights.do(
+                flight_key(method, args), lambda: self.call(method, query, args, kwargs))
+        return await self.call(method, query, args, kwargs, trace)
+
+    async def call(self, method, query, args, kwargs, trace=None):
+        if self.replica is None:
+            return await self.call_on(method, query, args, kwargs, trace)
+        try:
+            return await self.call_on(method, query, args, kwargs, trace)
+        except RETRYABLE as e:
+            if unreachable(e):
+                self.primary.replicas.eject(self.replica, e)
+            return await self.primary.call(method, query, args, kwargs, trace)
+
+    async def call_on(self, method, query, args, kwargs, trace=None):
+        if not self.hooks and trace is None:
+            async with self.acquire() as conn:
+                return await getattr(conn, method)(*args, **kwargs)
+        requested = time.monotonic()
+        async with self.acquire() as conn:
+            started = time.monotonic()
+            try:
+                return await getattr(conn, method)(*args, **kwargs)
+            finally:
+                timing = QueryTiming(
+                    query, method, args, started - requested, time.monotonic() - started,
+                    self.replica.name if self.replica else 'primary')
+                for hook in self.hooks:
+                    hook(timing)
+                if trace is not None:
+                    trace.append(timing)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.run('fetch', query, args, kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.run('fetchrow', query, args, kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.run('fetchval', query, args, kwargs)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.run('execute', query, args, kwargs)
+
+    def transaction(self, **kwargs):
+        """`async with app.apg.transaction() as db:` runs the
+        block on a single connection in a transaction,
+        `db` is these wrappers bound to it.
+        """
+        return Transaction(self, **kwargs)
+
+    async def iterate(self, query, callback, *args, prefetch=None):
+        """Feeds records to `callback` coroutine one by one
+        from a server-side cursor, so the result set is never
+        materialized. Cursors require a transaction.
+        """
+        async with self.transaction() as db:
+            async for record in db.conn.cursor(*bind(query, args), prefetch=prefetch):
+                await callback(record)
@@ -0,0 +1,89 @@
+import asyncio
+
+from collections import OrderedDict
+
+
+class WriteBatcher:
+    """Group commit of small writes: items submitted within
+    `max_latency` seconds of the first pending one, `max_size` at
+    most, are applied in a single transaction of `db`, so that they
+    share one connection acquire and one commit.
+    Items are grouped by `apply(db, items)` coroutine function,
+    which returns a result per item in order. When a batch fails
+    every item of it is applied again in a transaction of its own,
+    so an error only reaches the caller of the item it comes from.
+    """
+    def __init__(self, db, max_latency=0.005, max_size=256):
+        self.db = db
+        self.max_latency = max_latency
+        self.max_size = max_size
+        self.pending = OrderedDict()
+        self.size = 0
+        self.timer = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self.retried = 0
+
+    def submit(self, apply, item):
+        """Future of the result of `item`"""
+        future = asyncio.get_event_loop().create_future()
+        self.pending.setdefault(apply, []).append((item, future))
+        self.size += 1
+        if self.size >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(self.max_latency, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, OrderedDict()
+        size, self.size = self.size, 0
+        if batch:
+            self.batches += 1
+            self.items += size
+            self.largest = max(self.largest, size)
+            asyncio.ensure_future(self.commit(batch))
+
+    async def commit(self, batch):
+        try:
+            results = []
+            async with self.db.transaction() as db:
+                for apply, entries in batch.items():
+                    results.append(await apply(db, [item for item, _ in entries]))
+        except Exception:
+            self.retried += 1
+            await asyncio.gather(*[
+                self.commit_one(apply, item, future)
+                for apply, entries in batch.items() for item, future in entries
+            ])
+            return
+        for entries, values in zip(batch.values(), results):
+            for (_, future), value in zip(entries, values):
+                if not future.done():
+                    future.set_result(value)
+
+    async def commit_one(self, apply, item, future):
+        try:
+            async with self.db.transaction() as db:
+                value, = await apply(db, [item])
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(value)
+
+    def stats(self):
+        return {
+            'pending': self.size,
+            'batches': self.batches,
+            'items': self.items,
+            'largest': self.largest,
+            'retried': self.retried,
+            'max_latency': self.max_latency,
+            'max_size': self.max_size,
+        }
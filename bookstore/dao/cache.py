@@ -0,0 +1,145 @@
+import json
+import time
+import uuid
+
+from collections import OrderedDict
+
+try:
+    import aioredis
+except ImportError:
+    aioredis = None
+
+
+def cache_key(table, kind, db_id):
+    """E.g. `author:rellist:1`"""
+    return '{}:{}:{}'.format(table, kind, db_id)
+
+
+class MemoryCache:
+    """In-process TTL/LRU cache. Every worker keeps its own
+    copy, so writes only invalidate the worker that served
+    them and the TTL bounds staleness on the others.
+    :maxsize: amount of keys kept, 0 disables caching
+    :ttl: seconds a value is served for
+    """
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._values = OrderedDict()
+
+    async def get(self, key):
+        try:
+            expires, value = self._values[key]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        if not self.maxsize:
+            return
+        self._values[key] = (time.monotonic() + self.ttl, value)
+        self._values.move_to_end(key)
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def close(self):
+        self._values.clear()
+
+
+class RedisCache:
+    """Shared cache for all the workers behind the same
+    interface as MemoryCache, requires aioredis.
+    Values are stored JSON encoded.
+    """
+    def __init__(self, redis, ttl=60):
+        self.redis = redis
+        self.ttl = ttl
+
+    @classmethod
+    async def create(cls, url, ttl=60):
+        if aioredis is None:
+            raise RuntimeError('aioredis is required for a shared cache.')
+        return cls(await aioredis.create_redis_pool(url), ttl)
+
+    async def versions(self, *keys):
+        """Epoch and write counters of `keys`, the epoch
+        changes whenever Redis loses the counters.
+        """
+        epoch, *values = await self.redis.mget(
+            'version:epoch', *['version:' + key for key in keys])
+        if epoch is None:
+            await self.redis.set('version:epoch', uuid.uuid4().hex,
+                                 exist=self.redis.SET_IF_NOT_EXIST)
+            epoch = await self.redis.get('version:epoch')
+        return epoch.decode(), [int(v) if v else 0 for v in values]
+
+    async def bump(self, *keys):
+        if keys:
+            transaction = self.redis.multi_exec()
+            for key in keys:
+                transaction.incr('version:' + key)
+            await transaction.execute()
+
+    async def get(self, key):
+        value = await self.redis.get(key)
+        return None if value is None else json.loads(value.decode())
+
+    async def set(self, key, value):
+        await self.redis.set(key, json.dumps(value), expire=self.ttl)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.redis.delete(*keys)
+
+    async def close(self):
+        self.redis.close()
+        await self.redis.wait_closed()
+
+
+class DatabaseVersions:
+    """Write counters ETags are made of kept in the `cache_version`
+    table when the cache is in-process, so that a write changes
+    the ETags of every worker. Counters are read from and bumped
+    on the primary, the epoch row is new with every reset.
+    """
+    EPOCH = ':epoch'
+
+    def __init__(self, db):
+        self.db = db
+
+    async def versions(self, *keys):
+        """Epoch and write counters of `keys`"""
+        rows = dict(await self.db.fetch(
+            'SELECT key, version FROM cache_version WHERE key = ANY($1::text[])',
+            [self.EPOCH] + list(keys)))
+        return str(rows.get(self.EPOCH)), [rows.get(key, 0) for key in keys]
+
+    async def bump(self, *keys):
+        # Sorted so that concurrent writes lock shared rows in the same order
+        if keys:
+            await self.db.execute(
+                'INSERT INTO cache_version (key, version) SELECT unnest($1::text[]), 1 '
+                'ON CONFLICT (key) DO UPDATE SET version = cache_version.version + 1',
+                sorted(set(keys)))
+
+
+async def create_cache(url=None, maxsize=10000, ttl=60):
+    """Shared cache when `url` is given, in-process otherwise."""
+    if url:
+        return await RedisCache.create(url, ttl)
+    return MemoryCache(maxsize, ttl)
+
+
+def create_versions(cache, db):
+    """Write counters of `cache` when it is shared, of `db` otherwise."""
+    if isinstance(cache, RedisCache):
+        return cache
+    return DatabaseVersions(db)
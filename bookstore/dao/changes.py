@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+from collections import deque, namedtuple
+
+import asyncpg
+from sanic.log import logger
+
+
+CHANNEL = 'bookstore_changes'
+
+# Events are encoded by Postgres once and fanned out as they are
+CHANGES = ("SELECT seq, tbl, json_build_object("
+           "'seq', seq, 'table', tbl, 'op', op, 'data', data, 'at', at)::text "
+           "FROM change_log WHERE seq > $1 AND ($2::bigint IS NULL OR seq <= $2) "
+           "ORDER BY seq LIMIT $3")
+
+Change = namedtuple('Change', ['seq', 'table', 'json'])
+
+
+class Subscription:
+    """Changes of a single client: those after `since` first,
+    then live ones. `overflowed` is set once the client fell
+    behind by more than it may, it has to start over then.
+    """
+    def __init__(self, tables=None, maxsize=1000):
+        self.tables = tables
+        self.queue = asyncio.Queue(maxsize)
+        self.replay = deque()
+        self.replayed = set()
+        self.overflowed = False
+
+    def put(self, change):
+        if self.tables and change.table not in self.tables:
+            return
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout=None):
+        """Next change, None once `timeout` seconds pass without one"""
+        if self.replay:
+            return self.replay.popleft()
+        while not self.overflowed:
+            try:
+                change = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            if change.seq not in self.replayed:
+                return change
+        return None
+
+
+class ChangeFeed:
+    """Listens to the change log notifications on a connection
+    of its own and fans the changes out to the subscribers of
+    this worker. The latest `backlog` changes are kept to resume
+    from, older ones are replayed from the log through `db`.
+    :retention: seconds changes are kept in the log for
+    :max_replay: changes a subscriber may resume at most
+    """
+    def __init__(self, dsn, db, backlog=1000, retention=86400, queue_size=1000,
+                 max_replay=10000, interval=5):
+        self.dsn = dsn
+        self.db = db
+        self.recent = deque(maxlen=backlog)
+        self.retention = retention
+        self.queue_size = queue_size
+        self.max_replay = max_replay
+        self.interval = interval
+        self.subscribers = set()
+        self.ranges = asyncio.Queue()
+        self.conn = None
+        self.task = None
+        self.maintainer = None
+        self.last_seq = 0
+        self.pruned_at = 0
+
+    async def start(self):
+        self.last_seq = await self.db.fetchval('SELECT coalesce(max(seq), 0) FROM change_log')
+        await self.connect()
+        self.task = asyncio.ensure_future(self.run())
+        self.maintainer = asyncio.ensure_future(self.keep())
+
+    async def stop(self):
+        for task in (self.task, self.maintainer):
+            if task:
+                task.cancel()
+        self.task = self.maintainer = None
+        if self.conn and not self.conn.is_closed():
+            await self.conn.close()
+
+    async def connect(self):
+        self.conn = await asyncpg.connect(self.dsn)
+        await self.conn.add_listener(CHANNEL, self.notified)
+
+    def notified(self, conn, pid, channel, payload):
+        first, last = payload.split(',')
+        self.ranges.put_nowait((int(first) - 1, int(last)))
+
+    async def run(self):
+        while True:
+            after, upto = await self.ranges.get()
+            try:
+                changes = await self.conn.fetch(CHANGES, after, upto, None)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning('Change feed fetch failed: %s', e)
+                # Whatever is after the last change seen is fetched on reconnect
+                continue
+            for change in changes:
+                self.publish(Change(*change))
+
+    async def keep(self):
+        # On a timer of its own, a busy feed is never idle
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.maintain()
+
+    async def maintain(self):
+        """Reconnects a lost listener and prunes the log"""
+        try:
+            if self.conn is None or self.conn.is_closed():
+                await self.connect()
+                # Notifications sent while disconnected are lost
+                self.ranges.put_nowait((self.last_seq, None))
+            if time.monotonic() - self.pruned_at > self.retention / 24:
+                self.pruned_at = time.monotonic()
+                await self.db.execute(
+                    'DELETE FROM change_log WHERE at < now() - make_interval(secs => $1)',
+                    float(self.retention))
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            logger.warning('Change feed maintenance failed: %s', e)
+
+    def publish(self, change):
+        self.last_seq = max(self.last_seq, change.seq)
+        self.recent.append(change)
+        for subscription in self.subscribers:
+            subscription.put(change)
+
+    async def subscribe(self, since=None, tables=None):
+        """Subscription receiving live changes of `tables` (all
+        by default) preceded by the ones after `since` sequence.
+        """
+        subscription = Subscription(tables, self.queue_size)
+        self.subscribers.add(subscription)
+        if since is None:
+            return subscription
+        upto = self.last_seq
+        if self.recent and self.recent[0].seq <= since + 1:
+            replay = [c for c in self.recent if since < c.seq <= upto]
+        else:
+            replay = [Change(*c) for c in await self.db.fetch(
+                CHANGES, since, upto, self.max_replay + 1)]
+        replay = [c for c in replay if not tables or c.table in tables]
+        if len(replay) > self.max_replay:
+            subscription.overflowed = True
+        else:
+            subscription.replay.extend(replay)
+            subscription.replayed.update(c.seq for c in replay)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
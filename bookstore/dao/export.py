@@ -0,0 +1,58 @@
+from collections import OrderedDict
+
+
+# Tables by their export name, rows in primary key order
+TABLES = OrderedDict([
+    ('authors', ('author', ['id', 'name', 'book_count'], 'id')),
+    ('books', ('book', ['id', 'name', 'author_count'], 'id')),
+    ('relations', ('author_book_rel', ['author_id', 'book_id'], 'author_id, book_id')),
+])
+
+# Rows per group of the columnar format
+ROW_GROUP = 10000
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'columns': ('application/x-ndjson', 'columns.ndjson'),
+}
+
+
+def export_query(table, fmt):
+    """COPY statement and options of a table in one of FORMATS,
+    the rows are encoded by Postgres and passed on as they come.
+    """
+    name, columns, order = TABLES[table]
+    select = 'SELECT {} FROM {} ORDER BY {}'.format(', '.join(columns), name, order)
+    if fmt == 'csv':
+        return select, {'format': 'csv', 'header': True}
+    if fmt == 'ndjson':
+        select = 'SELECT row_to_json(t) FROM ({}) t'.format(select)
+    elif fmt == 'columns':
+        # A JSON object per row group holding an array per column
+        select = ("SELECT json_build_object('rows', count(*), {}) FROM ("
+                  "SELECT *, (row_number() OVER (ORDER BY {}) - 1) / {} AS row_group FROM {}"
+                  ") t GROUP BY row_group ORDER BY row_group").format(
+            ', '.join("'{0}', json_agg({0} ORDER BY {1})".format(c, order) for c in columns),
+            order, ROW_GROUP, name)
+    else:
+        raise ValueError('Formats are {}.'.format(', '.join(sorted(FORMATS))))
+    # JSON has neither raw control characters nor line breaks, with
+    # these as quote and delimiter CSV writes every line as it is,
+    # unlike the text format escaping backslashes
+    return select, {'format': 'csv', 'quote': '\x01', 'delimiter': '\x02'}
+
+
+def snapshot(db):
+    """Transaction all the tables of an export are read in, they
+    are consistent with each other even while writes go on.
+    """
+    return db.transaction(isolation='repeatable_read', readonly=True)
+
+
+async def export(db, table, fmt, output):
+    """Copies a table to the `output` coroutine chunk by chunk,
+    `db` has to be bound to a connection, see snapshot().
+    """
+    query, options = export_query(table, fmt)
+    await db.conn.copy_from_query(query, output=output, **options)
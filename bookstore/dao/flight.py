@@ -0,0 +1,35 @@
+import asyncio
+
+
+def flight_key(method, args):
+    """Hashable key of a call, arrays become tuples"""
+    return (method,) + tuple(tuple(a) if isinstance(a, list) else a for a in args)
+
+
+class SingleFlight:
+    """Identical calls made while one is in flight await its
+    result instead of running again. The call runs in a task of
+    its own, so a cancelled caller does not fail the others.
+    Results are shared and must not be mutated.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, call):
+        task = self.calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = self.calls[key] = asyncio.ensure_future(call())
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            'in_flight': len(self.calls),
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+        }
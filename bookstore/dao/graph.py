@@ -0,0 +1,321 @@
+import asyncio
+import json
+import sys
+import time
+
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+import asyncpg
+from sanic.log import logger
+
+
+RELATIONS = 'SELECT author_id, book_id FROM author_book_rel ORDER BY author_id, book_id'
+
+
+class CSR:
+    """Compressed sparse rows: neighbours of node `i` are
+    `targets[offsets[i]:offsets[i + 1]]`, in the order of the
+    pairs given. Node IDs index the offsets directly, serial IDs
+    keep them dense.
+    """
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, sources, targets):
+        size = (max(sources) + 2) if sources else 1
+        offsets = array('i', [0]) * size
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(1, size):
+            offsets[i] += offsets[i - 1]
+        position = array('i', offsets)
+        out = array('i', [0]) * len(targets)
+        for source, target in zip(sources, targets):
+            out[position[source]] = target
+            position[source] += 1
+        self.offsets = offsets
+        self.targets = out
+
+    def row(self, node):
+        if not 0 <= node < len(self.offsets) - 1:
+            return self.targets[0:0]
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def has(self, node, target):
+        """Whether `target` is in the sorted row of `node`"""
+        if not 0 <= node < len(self.offsets) - 1:
+            return False
+        hi = self.offsets[node + 1]
+        i = bisect_left(self.targets, target, self.offsets[node], hi)
+        return i < hi and self.targets[i] == target
+
+    def nbytes(self):
+        return (len(self.offsets) + len(self.targets)) * self.offsets.itemsize
+
+
+class Graph:
+    """Author–book relations held both ways as CSR built from
+    pairs sorted by author then book, so that every row is sorted.
+    Relations added or removed afterwards are kept aside until
+    the next rebuild.
+    """
+    def __init__(self, authors=(), books=()):
+        started = time.monotonic()
+        self.books = CSR(authors, books)
+        # Sorting by book is stable, authors of a book stay sorted
+        self.authors = CSR(books, authors)
+        self.edges = len(authors)
+        self.added_books = defaultdict(set)
+        self.added_authors = defaultdict(set)
+        self.removed = set()
+        self.pending = 0
+        self.build_seconds = time.monotonic() - started
+
+    def books_of(self, author_id):
+        return self.neighbours(self.books, self.added_books, author_id, False)
+
+    def authors_of(self, book_id):
+        return self.neighbours(self.authors, self.added_authors, book_id, True)
+
+    def neighbours(self, csr, added, node, backward):
+        row = csr.row(node)
+        if not self.pending:
+            return row
+        removed = self.removed
+        result = [n for n in row if ((n, node) if backward else (node, n)) not in removed]
+        if node in added:
+            result = sorted(set(result) | added[node])
+        return result
+
+    def relate(self, author_id, book_id):
+        pair = (author_id, book_id)
+        if pair in self.removed:
+            self.removed.discard(pair)
+            self.pending -= 1
+        elif self.books.has(author_id, book_id) or book_id in self.added_books.get(author_id, ()):
+            return
+        else:
+            self.added_books[author_id].add(book_id)
+            self.added_authors[book_id].add(author_id)
+            self.pending += 1
+        self.edges += 1
+
+    def unrelate(self, author_id, book_id):
+        if book_id in self.added_books.get(author_id, ()):
+            self.added_books[author_id].discard(book_id)
+            self.added_authors[book_id].discard(author_id)
+            self.pending -= 1
+            self.edges -= 1
+        elif self.books.has(author_id, book_id) and (author_id, book_id) not in self.removed:
+            self.removed.add((author_id, book_id))
+            self.pending += 1
+            self.edges -= 1
+
+    def coauthors(self, author_id, limit=None):
+        """(author ID, books in common) most shared first"""
+        shared = defaultdict(int)
+        for book_id in self.books_of(author_id):
+            for other in self.authors_of(book_id):
+                if other != author_id:
+                    shared[other] += 1
+        return ranked(shared, limit)
+
+    def related_books(self, book_id, limit=None):
+        """(book ID, authors in common) of other books of the
+        authors of a book, most shared first
+        """
+        shared = defaultdict(int)
+        for author_id in self.authors_of(book_id):
+            for other in self.books_of(author_id):
+                if other != book_id:
+                    shared[other] += 1
+        return ranked(shared, limit)
+
+    def neighbourhood(self, kind, node, hops, limit):
+        """Authors and books within `hops` relations of a node
+        as {kind: [(ID, hops away)]}, breadth first until `limit`
+        nodes are reached.
+        """
+        found = {'author': {}, 'book': {}}
+        frontier = [(kind, node)]
+        seen = {(kind, node)}
+        reached = 0
+        for distance in range(1, hops + 1):
+            following = []
+            for node_kind, node_id in frontier:
+                if node_kind == 'author':
+                    step, neighbours = 'book', self.books_of(node_id)
+                else:
+                    step, neighbours = 'author', self.authors_of(node_id)
+                for neighbour in neighbours:
+                    if (step, neighbour) in seen:
+                        continue
+                    seen.add((step, neighbour))
+                    found[step][neighbour] = distance
+                    following.append((step, neighbour))
+                    reached += 1
+                    if reached >= limit:
+                        return found
+            frontier = following
+        return found
+
+    def nbytes(self):
+        """Arrays plus a rough size of the relations kept aside"""
+        aside = sys.getsizeof(self.removed) + sum(
+            sys.getsizeof(s) for s in self.added_books.values()
+        ) + sum(sys.getsizeof(s) for s in self.added_authors.values())
+        return self.books.nbytes() + self.authors.nbytes() + aside
+
+
+def ranked(counts, limit=None):
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class GraphIndex:
+    """Graph of the relations of this worker loaded from `db`
+    and kept in step with the relation changes of `feed`. It is
+    rebuilt in the background from the database once relations
+    kept aside exceed `compact` of the built ones, an ID of a
+    related record changes or the worker falls behind the feed.
+    Without a feed it is rebuilt every `reload` seconds.
+    A failed rebuild is tried again `retry` seconds later.
+    """
+    def __init__(self, db, feed=None, compact=0.05, reload=60, retry=5):
+        self.db = db
+        self.feed = feed
+        self.compact = compact
+        self.reload = reload
+        self.retry = retry
+        self.graph = Graph()
+        self.subscription = None
+        self.task = None
+        self.rebuilding = None
+        self.retrying = None
+        # Changes applied while rebuilding, applied again on the new graph
+        self.replay = None
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.loaded_at = None
+
+    async def start(self):
+        if self.feed is not None:
+            self.subscription = await self.feed.subscribe(tables={'author_book_rel'})
+        await self.load()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.rebuilding:
+            self.rebuilding.cancel()
+        if self.retrying:
+            self.retrying.cancel()
+        if self.subscription is not None:
+            self.feed.unsubscribe(self.subscription)
+
+    async def load(self):
+        """Builds a graph of all the relations, swaps it in once done.
+        False when a change that came meanwhile takes another build.
+        """
+        started = time.monotonic()
+        self.replay = []
+        authors, books = array('i'), array('i')
+        rest = [b'']
+
+        async def sink(chunk):
+            lines = (rest[0] + chunk).split(b'\n')
+            rest[0] = lines.pop()
+            for line in lines:
+                author_id, book_id = line.split(b'\t')
+                authors.append(int(author_id))
+                books.append(int(book_id))
+
+        try:
+            async with self.db.acquire() as conn:
+                await conn.copy_from_query(RELATIONS, output=sink)
+            # Building takes seconds for millions of relations
+            graph = await asyncio.get_event_loop().run_in_executor(None, Graph, authors, books)
+            # Cascaded ID changes may or may not be part of what was copied
+            applied = [self.apply(graph, change) for change in self.replay]
+        finally:
+            self.replay = None
+        self.graph = graph
+        self.loads += 1
+        self.load_seconds = time.monotonic() - started
+        self.loaded_at = time.time()
+        logger.info('Relation graph of %s relations built in %.3fs', graph.edges, self.load_seconds)
+        return all(applied)
+
+    def rebuild(self):
+        if self.rebuilding is None or self.rebuilding.done():
+            self.retrying = None
+            self.rebuilding = asyncio.ensure_future(self.load())
+            self.rebuilding.add_done_callback(self.rebuilt)
+
+    def rebuilt(self, task):
+        """Rebuilds again right away when the rebuild took changes
+        it could not apply, `retry` seconds later when it failed
+        """
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.warning('Relation graph rebuild failed, retrying in %ss: %r', self.retry, error)
+            self.retrying = asyncio.get_event_loop().call_later(self.retry, self.rebuild)
+        elif not task.result():
+            self.rebuild()
+
+    def apply(self, graph, change):
+        """Applies a change, False when it takes a rebuild"""
+        event = json.loads(change.json)
+        data = event['data']
+        if event['op'] == 'INSERT':
+            graph.relate(data['author_id'], data['book_id'])
+        elif event['op'] == 'DELETE':
+            graph.unrelate(data['author_id'], data['book_id'])
+        else:
+            # Cascaded ID changes only carry the new pairs
+            return False
+        return True
+
+    async def run(self):
+        while True:
+            if self.subscription is None:
+                await asyncio.sleep(self.reload)
+                await self.guarded(self.load())
+                continue
+            change = await self.subscription.get(self.reload)
+            if change is not None:
+                if self.replay is not None:
+                    self.replay.append(change)
+                if not self.apply(self.graph, change):
+                    self.rebuild()
+                elif self.graph.pending > max(1000, self.graph.edges * self.compact):
+                    self.rebuild()
+            elif self.subscription.overflowed:
+                self.feed.unsubscribe(self.subscription)
+                self.subscription = await self.feed.subscribe(tables={'author_book_rel'})
+                self.rebuild()
+
+    async def guarded(self, load):
+        try:
+            await load
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            logger.warning('Relation graph load failed: %s', e)
+
+    def stats(self):
+        graph = self.graph
+        return {
+            'relations': graph.edges,
+            'max_author_id': max(len(graph.books.offsets) - 2, 0),
+            'max_book_id': max(len(graph.authors.offsets) - 2, 0),
+            'pending': graph.pending,
+            'bytes': graph.nbytes(),
+            'build_seconds': graph.build_seconds,
+            'load_seconds': self.load_seconds,
+            'loads': self.loads,
+            'loaded_at': self.loaded_at,
+            'rebuilding': self.replay is not None,
+        }
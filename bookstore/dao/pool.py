@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+
+# SANIC_* settings to asyncpg.create_pool() keyword arguments.
+# asyncpg has no absolute connection lifetime, idle connections are
+# closed after DB_CONNECTION_LIFETIME seconds and busy ones are
+# replaced after DB_MAX_QUERIES queries instead.
+POOL_OPTIONS = [
+    ('DB_POOL_MIN_SIZE', 'min_size', int),
+    ('DB_POOL_MAX_SIZE', 'max_size', int),
+    ('DB_STATEMENT_CACHE_SIZE', 'statement_cache_size', int),
+    ('DB_COMMAND_TIMEOUT', 'command_timeout', float),
+    ('DB_CONNECTION_LIFETIME', 'max_inactive_connection_lifetime', float),
+    ('DB_MAX_QUERIES', 'max_queries', int),
+]
+
+
+def pool_options(config):
+    """Keyword arguments for the pool out of the app config"""
+    return {option: convert(config[key])
+            for key, option, convert in POOL_OPTIONS if key in config}
+
+
+class PoolStats:
+    """Times and counts connection acquisitions of a pool.
+    :timeout: seconds to wait for a connection, None waits forever
+    """
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.acquired = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def acquire(self):
+        return TimedAcquire(self)
+
+    def stats(self):
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'acquired': self.acquired,
+            'wait_seconds': self.wait_seconds,
+            'max_wait_seconds': self.max_wait_seconds,
+            'timeouts': self.timeouts,
+        }
+
+
+class TimedAcquire:
+    """pool.acquire() counterpart feeding PoolStats"""
+    __slots__ = ('stats', 'conn')
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.conn = None
+
+    async def __aenter__(self):
+        stats = self.stats
+        stats.waiting += 1
+        started = time.monotonic()
+        try:
+            self.conn = await stats.pool.acquire(timeout=stats.timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            stats.waiting -= 1
+            stats.wait_seconds += waited
+            stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+        stats.acquired += 1
+        stats.in_use += 1
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.stats.in_use -= 1
+        await self.stats.pool.release(self.conn)
+
+
+class Held:
+    """Acquire context of an already held connection"""
+    __slots__ = ('conn',)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class Transaction:
+    """`async with app.apg.transaction() as db:` runs all the
+    statements of the block through `db` on a single connection
+    atomically. Nested transactions become savepoints.
+    """
+    def __init__(self, db, **kwargs):
+        self.db = db
+        self.kwargs = kwargs
+        self.acquire = None
+        self.transaction = None
+
+    async def __aenter__(self):
+        self.acquire = self.db.acquire()
+        conn = await self.acquire.__aenter__()
+        self.transaction = conn.transaction(**self.kwargs)
+        try:
+            await self.transaction.start()
+        except Exception:
+            await self.acquire.__aexit__(None, None, None)
+            raise
+        return self.db.bind(conn)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.transaction.commit()
+            else:
+                await self.transaction.rollback()
+        finally:
+            await self.acquire.__aexit__(exc_type, exc, tb)
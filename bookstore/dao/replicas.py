@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+from collections import deque
+from itertools import count
+
+import asyncpg
+import asyncpgsa
+from sanic.log import logger
+
+from bookstore.dao.flight import SingleFlight
+from bookstore.dao.pool import PoolStats
+
+
+# Write-ahead log positions as plain numbers, the replayed one of a
+# standby and the current one of the primary (or of a promoted standby)
+PRIMARY_LSN = "SELECT (pg_current_wal_lsn() - '0/0')::bigint"
+REPLAYED_LSN = ("SELECT CASE WHEN pg_is_in_recovery() "
+                "THEN coalesce((pg_last_wal_replay_lsn() - '0/0')::bigint, 0) "
+                "ELSE (pg_current_wal_lsn() - '0/0')::bigint END")
+
+# Errors of a replica that is gone, it is ejected for a while then
+UNREACHABLE = (OSError, asyncpg.InterfaceError, asyncpg.CannotConnectNowError)
+# Errors worth retrying on the primary without ejecting the replica:
+# a saturated replica pool and queries cancelled by WAL replay
+RETRYABLE = UNREACHABLE + (asyncio.TimeoutError, asyncpg.TransactionRollbackError)
+
+
+def unreachable(error):
+    """Whether a replica is gone. Timeouts come first, they
+    subclass OSError from Python 3.11 on.
+    """
+    return not isinstance(error, asyncio.TimeoutError) and isinstance(error, UNREACHABLE)
+
+
+def replica_dsns(value, user, password, database):
+    """DSNs out of `SANIC_DB_REPLICAS`, comma separated DSNs or
+    `host[:port]` sharing the credentials of the primary.
+    """
+    dsns = []
+    for item in (i.strip() for i in (value or '').split(',')):
+        if not item:
+            continue
+        if '://' not in item:
+            item = 'postgres://{}:{}@{}/{}'.format(user, password, item, database)
+        dsns.append(item)
+    return dsns
+
+
+class Replica:
+    """A standby and its own pool, connected by the health
+    checks so that a replica being down does not stop a worker
+    from starting.
+    """
+    def __init__(self, dsn, name=None):
+        self.dsn = dsn
+        self.name = name or dsn.rpartition('@')[2]
+        self.pool = None
+        self.pool_stats = None
+        self.flights = None
+        self.replayed = 0
+        self.lagging = False
+        self.ejected_until = 0
+        self.ejections = 0
+        self.reads = 0
+        self.error = None
+
+    def available(self, now):
+        return self.pool is not None and not self.lagging and now >= self.ejected_until
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {
+            'name': self.name,
+            'available': self.available(now),
+            'lagging': self.lagging,
+            'replayed_lsn': self.replayed,
+            'reads': self.reads,
+            'ejections': self.ejections,
+            'error': self.error,
+            'pool': self.pool_stats.stats() if self.pool_stats else {},
+        }
+
+
+class ReplicaSet:
+    """Hands out healthy replicas in turn. A replica is ejected
+    for `eject_for` seconds once it cannot be reached and set
+    aside while it has not replayed what the primary had written
+    `max_lag` seconds before, both are found out by checks every
+    `interval` seconds.
+    :options: asyncpg.create_pool() keyword arguments of replica pools
+    :acquire_timeout: seconds to wait for a replica connection
+    :coalesce: whether identical reads of a replica share a round-trip
+    """
+    def __init__(self, replicas, options=None, acquire_timeout=None, coalesce=True,
+                 max_lag=1.0, interval=1.0, eject_for=5.0):
+        self.replicas = replicas
+        self.options = options or {}
+        self.acquire_timeout = acquire_timeout
+        self.coalesce = coalesce
+        self.max_lag = max_lag
+        self.interval = interval
+        self.eject_for = eject_for
+        self.turn = count()
+        # (time, primary LSN) of the latest checks
+        self.samples = deque()
+        self.task = None
+
+    def pick(self, after=None, now=None):
+        """Next available replica that replayed the `after` LSN
+        if given, None when there is none.
+        """
+        now = time.monotonic() if now is None else now
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self.turn) % len(self.replicas)]
+            if replica.available(now) and (after is None or replica.replayed >= after):
+                replica.reads += 1
+                return replica
+        return None
+
+    def eject(self, replica, error, now=None):
+        now = time.monotonic() if now is None else now
+        if now >= replica.ejected_until:
+            replica.ejections += 1
+            logger.warning('Replica %s ejected: %s', replica.name, error)
+        replica.ejected_until = now + self.eject_for
+        replica.error = str(error) or type(error).__name__
+
+    def observe(self, primary_lsn, now=None):
+        """Records the primary LSN, returns the one replicas have
+        to have replayed not to lag
+        """
+        now = time.monotonic() if now is None else now
+        self.samples.append((now, primary_lsn))
+        while len(self.samples) > 1 and self.samples[1][0] <= now - self.max_lag:
+            self.samples.popleft()
+        sampled_at, lsn = self.samples[0]
+        return lsn if sampled_at <= now - self.max_lag else 0
+
+    async def check_replica(self, replica, required):
+        try:
+            if replica.pool is None:
+                replica.pool = await asyncpgsa.create_pool(replica.dsn, **self.options)
+                replica.pool_stats = PoolStats(replica.pool, self.acquire_timeout)
+                replica.flights = SingleFlight() if self.coalesce else None
+            async with replica.pool_stats.acquire() as conn:
+                replica.replayed = await conn.fetchval(REPLAYED_LSN, timeout=self.interval)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            self.eject(replica, e)
+            return
+        replica.error = None
+        replica.ejected_until = 0
+        if replica.replayed < required and not replica.lagging:
+            logger.warning('Replica %s is lagging', replica.name)
+        replica.lagging = replica.replayed < required
+
+    async def check(self, primary):
+        """Checks the replicas against the LSN of `primary` apg"""
+        required = self.observe(await primary.fetchval(PRIMARY_LSN))
+        await asyncio.gather(*[self.check_replica(r, required) for r in self.replicas])
+
+    async def run(self, primary):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check(primary)
+            except Exception as e:
+                logger.warning('Replica checks failed: %s', e)
+
+    async def start(self, primary):
+        """Connects the replicas and keeps checking them"""
+        await self.check(primary)
+        self.task = asyncio.ensure_future(self.run(primary))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+
+    def after_lag(self, callback):
+        """Calls the `callback` coroutine function once lagging
+        replicas are set aside
+        """
+        asyncio.get_event_loop().call_later(
+            self.max_lag + self.interval, lambda: asyncio.ensure_future(callback()))
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'max_lag': self.max_lag,
+            'replicas': [r.stats(now) for r in self.replicas],
+        }
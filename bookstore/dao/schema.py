@@ -0,0 +1,298 @@
+import hashlib
+import os
+
+from sanic.log import logger
+
+
+# Statement level triggers of every table feeding the change log,
+# transition tables only allow a single event per trigger
+LOG_TRIGGERS = """
+    CREATE TRIGGER {table}_insert_log AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_changes();
+    CREATE TRIGGER {table}_update_log AFTER UPDATE ON {table}
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_changes();
+    CREATE TRIGGER {table}_delete_log AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_changes();
+"""
+
+# Versioned schema migrations applied in order, each exactly once.
+# The first one is idempotent on its own to adopt databases
+# created before versioning was introduced.
+MIGRATIONS = [
+    (1, """CREATE TABLE IF NOT EXISTS author (
+               id serial primary key,
+               name varchar(32)
+           );
+           CREATE TABLE IF NOT EXISTS book (
+               id serial primary key,
+               name varchar(128)
+           );
+           CREATE TABLE IF NOT EXISTS author_book_rel (
+               author_id INTEGER REFERENCES author(id)
+                         ON DELETE CASCADE ON UPDATE CASCADE,
+               book_id INTEGER REFERENCES book(id)
+                       ON DELETE CASCADE ON UPDATE CASCADE
+           );"""),
+    # Relation lookups by either side and the idempotent relation insert
+    # in CRUDFactory.update are index scans instead of sequential ones
+    (2, """DELETE FROM author_book_rel WHERE author_id IS NULL OR book_id IS NULL;
+           DELETE FROM author_book_rel a USING author_book_rel b
+               WHERE a.ctid < b.ctid
+               AND a.author_id = b.author_id AND a.book_id = b.book_id;
+           ALTER TABLE author_book_rel ADD PRIMARY KEY (author_id, book_id);
+           CREATE INDEX IF NOT EXISTS author_book_rel_book_id_idx
+               ON author_book_rel (book_id);"""),
+    # Name search of CRUDFactory.search: prefix, trigram and full text
+    (3, """CREATE EXTENSION IF NOT EXISTS pg_trgm;
+           CREATE INDEX IF NOT EXISTS author_name_prefix_idx
+               ON author (lower(name) text_pattern_ops);
+           CREATE INDEX IF NOT EXISTS author_name_trgm_idx
+               ON author USING gin (name gin_trgm_ops);
+           CREATE INDEX IF NOT EXISTS author_name_tsv_idx
+               ON author USING gin (to_tsvector('simple', name));
+           CREATE INDEX IF NOT EXISTS book_name_prefix_idx
+               ON book (lower(name) text_pattern_ops);
+           CREATE INDEX IF NOT EXISTS book_name_trgm_idx
+               ON book USING gin (name gin_trgm_ops);
+           CREATE INDEX IF NOT EXISTS book_name_tsv_idx
+               ON book USING gin (to_tsvector('simple', name));"""),
+    # Change feed, every statement logs its rows and notifies
+    # listeners of the range of log sequence numbers it took
+    (4, """CREATE TABLE IF NOT EXISTS change_log (
+               seq bigserial primary key,
+               tbl text not null,
+               op text not null,
+               data jsonb not null,
+               at timestamptz not null default now()
+           );
+           CREATE INDEX IF NOT EXISTS change_log_at_idx ON change_log (at);
+           CREATE OR REPLACE FUNCTION log_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+           DECLARE
+               first_seq bigint;
+               last_seq bigint;
+           BEGIN
+               IF TG_OP = 'DELETE' THEN
+                   WITH logged AS (
+                       INSERT INTO change_log (tbl, op, data)
+                       SELECT TG_TABLE_NAME, TG_OP, to_jsonb(o) FROM old_rows o RETURNING seq
+                   ) SELECT min(seq), max(seq) INTO first_seq, last_seq FROM logged;
+               ELSE
+                   WITH logged AS (
+                       INSERT INTO change_log (tbl, op, data)
+                       SELECT TG_TABLE_NAME, TG_OP, to_jsonb(n) FROM new_rows n RETURNING seq
+                   ) SELECT min(seq), max(seq) INTO first_seq, last_seq FROM logged;
+               END IF;
+               IF first_seq IS NOT NULL THEN
+                   PERFORM pg_notify('bookstore_changes', first_seq || ',' || last_seq);
+               END IF;
+               RETURN NULL;
+           END $$;""" + ''.join(LOG_TRIGGERS.format(table=table)
+                                for table in ('author', 'book', 'author_book_rel'))),
+    # Related record counters kept by the mapping table triggers, so
+    # relcount is a primary key lookup and records can be ordered by them
+    (5, """ALTER TABLE author ADD COLUMN IF NOT EXISTS book_count integer NOT NULL DEFAULT 0;
+           ALTER TABLE book ADD COLUMN IF NOT EXISTS author_count integer NOT NULL DEFAULT 0;
+           CREATE OR REPLACE FUNCTION count_relations() RETURNS trigger LANGUAGE plpgsql AS $$
+           BEGIN
+               IF TG_OP = 'INSERT' THEN
+                   UPDATE author SET book_count = book_count + d.n
+                       FROM (SELECT author_id, count(*) AS n FROM new_rows GROUP BY author_id) d
+                       WHERE author.id = d.author_id;
+                   UPDATE book SET author_count = author_count + d.n
+                       FROM (SELECT book_id, count(*) AS n FROM new_rows GROUP BY book_id) d
+                       WHERE book.id = d.book_id;
+               ELSIF TG_OP = 'DELETE' THEN
+                   UPDATE author SET book_count = book_count - d.n
+                       FROM (SELECT author_id, count(*) AS n FROM old_rows GROUP BY author_id) d
+                       WHERE author.id = d.author_id;
+                   UPDATE book SET author_count = author_count - d.n
+                       FROM (SELECT book_id, count(*) AS n FROM old_rows GROUP BY book_id) d
+                       WHERE book.id = d.book_id;
+               ELSE
+                   -- Counters of cascaded ID changes move along with the records,
+                   -- affected ones are recounted instead of being adjusted
+                   UPDATE author SET book_count = (
+                           SELECT count(*) FROM author_book_rel r WHERE r.author_id = author.id)
+                       WHERE id IN (SELECT author_id FROM old_rows
+                                    UNION SELECT author_id FROM new_rows);
+                   UPDATE book SET author_count = (
+                           SELECT count(*) FROM author_book_rel r WHERE r.book_id = book.id)
+                       WHERE id IN (SELECT book_id FROM old_rows
+                                    UNION SELECT book_id FROM new_rows);
+               END IF;
+               RETURN NULL;
+           END $$;
+           CREATE TRIGGER author_book_rel_insert_count AFTER INSERT ON author_book_rel
+               REFERENCING NEW TABLE AS new_rows
+               FOR EACH STATEMENT EXECUTE PROCEDURE count_relations();
+           CREATE TRIGGER author_book_rel_update_count AFTER UPDATE ON author_book_rel
+               REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+               FOR EACH STATEMENT EXECUTE PROCEDURE count_relations();
+           CREATE TRIGGER author_book_rel_delete_count AFTER DELETE ON author_book_rel
+               REFERENCING OLD TABLE AS old_rows
+               FOR EACH STATEMENT EXECUTE PROCEDURE count_relations();
+           UPDATE author SET book_count = c.n
+               FROM (SELECT author_id, count(*) AS n FROM author_book_rel GROUP BY author_id) c
+               WHERE author.id = c.author_id;
+           UPDATE book SET author_count = c.n
+               FROM (SELECT book_id, count(*) AS n FROM author_book_rel GROUP BY book_id) c
+               WHERE book.id = c.book_id;
+           CREATE INDEX IF NOT EXISTS author_book_count_idx ON author (book_count, id);
+           CREATE INDEX IF NOT EXISTS book_author_count_idx ON book (author_count, id);"""),
+    # Keyset pages of list reads sorted or filtered by name
+    (6, """CREATE INDEX IF NOT EXISTS author_name_id_idx ON author (name, id);
+           CREATE INDEX IF NOT EXISTS book_name_id_idx ON book (name, id);"""),
+    # Counter updates of the mapping table triggers run nested in them
+    # and are not record changes, they are left out of the change log
+    (7, """CREATE OR REPLACE FUNCTION log_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+           DECLARE
+               first_seq bigint;
+               last_seq bigint;
+           BEGIN
+               IF TG_OP = 'UPDATE' AND TG_TABLE_NAME IN ('author', 'book')
+                       AND pg_trigger_depth() > 1 THEN
+                   RETURN NULL;
+               END IF;
+               IF TG_OP = 'DELETE' THEN
+                   WITH logged AS (
+                       INSERT INTO change_log (tbl, op, data)
+                       SELECT TG_TABLE_NAME, TG_OP, to_jsonb(o) FROM old_rows o RETURNING seq
+                   ) SELECT min(seq), max(seq) INTO first_seq, last_seq FROM logged;
+               ELSE
+                   WITH logged AS (
+                       INSERT INTO change_log (tbl, op, data)
+                       SELECT TG_TABLE_NAME, TG_OP, to_jsonb(n) FROM new_rows n RETURNING seq
+                   ) SELECT min(seq), max(seq) INTO first_seq, last_seq FROM logged;
+               END IF;
+               IF first_seq IS NOT NULL THEN
+                   PERFORM pg_notify('bookstore_changes', first_seq || ',' || last_seq);
+               END IF;
+               RETURN NULL;
+           END $$;"""),
+    # ETag write counters shared by the workers of an in-process cache,
+    # see cache.DatabaseVersions
+    (8, """CREATE TABLE IF NOT EXISTS cache_version (
+               key text primary key,
+               version bigint not null
+           );
+           INSERT INTO cache_version (key, version)
+               VALUES (':epoch', (random() * 1e15)::bigint)
+               ON CONFLICT (key) DO NOTHING;"""),
+]
+
+# Seed files are named after the tables, columns to populate.
+# ID column turned out not to auto increment on COPY that is why
+# populating name column explicitly.
+SEED = [
+    ('author', ['name']),
+    ('book', ['name']),
+    ('author_book_rel', None),
+]
+
+
+def seed_checksum(seed_dir):
+    """sha256 over all the seed files in load order"""
+    digest = hashlib.sha256()
+    for table, _ in SEED:
+        with open(os.path.join(seed_dir, table), 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+async def drop(conn):
+    await conn.execute('DROP TABLE IF EXISTS author_book_rel, author, book, '
+                       'change_log, cache_version, schema_version, schema_seed')
+    await conn.execute('DROP FUNCTION IF EXISTS log_changes(), count_relations()')
+
+
+async def migrate(conn):
+    await conn.execute('CREATE TABLE IF NOT EXISTS schema_version ('
+                       'version integer primary key, '
+                       'applied_at timestamptz not null default now())')
+    current = await conn.fetchval('SELECT coalesce(max(version), 0) FROM schema_version')
+    for version, sql in MIGRATIONS:
+        if version > current:
+            await conn.execute(sql)
+            await conn.execute('INSERT INTO schema_version (version) VALUES ($1)', version)
+            logger.info('Applied schema migration %s', version)
+
+
+# Stored counters against the mapping table, see counters.py
+COUNTERS = [
+    ('author', 'book_count', 'author_id'),
+    ('book', 'author_count', 'book_id'),
+]
+
+COUNTER_DRIFT = """SELECT t.id, t.{counter} AS stored, coalesce(c.n, 0) AS actual
+    FROM {table} t LEFT JOIN (
+        SELECT {key}, count(*) AS n FROM author_book_rel GROUP BY {key}
+    ) c ON c.{key} = t.id
+    WHERE t.{counter} <> coalesce(c.n, 0) ORDER BY t.id"""
+
+
+async def check_counters(conn):
+    """{table: [(id, stored, actual)]} of drifted counters"""
+    drift = {}
+    for table, counter, key in COUNTERS:
+        drift[table] = [tuple(r) for r in await conn.fetch(
+            COUNTER_DRIFT.format(table=table, counter=counter, key=key))]
+    return drift
+
+
+async def repair_counters(conn):
+    """Recounts drifted counters with relation writes blocked,
+    returns {table: records fixed}.
+    """
+    async with conn.transaction():
+        await conn.execute('LOCK TABLE author_book_rel IN SHARE MODE')
+        fixed = {}
+        for table, counter, key in COUNTERS:
+            fixed[table] = len(await conn.fetch(
+                'UPDATE {table} SET {counter} = d.actual FROM ({drift}) d '
+                'WHERE {table}.id = d.id RETURNING {table}.id'.format(
+                    table=table, counter=counter,
+                    drift=COUNTER_DRIFT.format(table=table, counter=counter, key=key))))
+        return fixed
+
+
+async def seed(conn, seed_dir):
+    """Loads the seed files with a client side COPY into empty
+    tables once. Tables holding data already, e.g. created before
+    the schema was versioned, are adopted as seeded. Changed files
+    are not loaded over existing data, that takes a reset.
+    """
+    checksum = seed_checksum(seed_dir)
+    await conn.execute('CREATE TABLE IF NOT EXISTS schema_seed ('
+                       'id boolean primary key default true check (id), '
+                       'checksum text not null)')
+    loaded = await conn.fetchval('SELECT checksum FROM schema_seed')
+    if loaded == checksum:
+        return
+    if loaded is not None:
+        logger.warning('Seed files changed since %s was loaded, set DB_SCHEMA=reset to reload them',
+                       loaded)
+        return
+    populated = await conn.fetchval('SELECT EXISTS (SELECT 1 FROM author) OR '
+                                    'EXISTS (SELECT 1 FROM book) OR '
+                                    'EXISTS (SELECT 1 FROM author_book_rel)')
+    if not populated:
+        for table, columns in SEED:
+            await conn.copy_to_table(table, source=os.path.join(seed_dir, table), columns=columns)
+    await conn.execute('INSERT INTO schema_seed (checksum) VALUES ($1)', checksum)
+    logger.info('%s seed data %s', 'Adopted' if populated else 'Loaded', checksum)
+
+
+async def prepare_schema(pool, seed_dir, reset=False):
+    """Brings the schema up to date and seeds it once.
+    Runs in a single transaction under an advisory lock, so
+    concurrently booting workers wait for the first one and
+    then find nothing to do. `reset` drops everything first.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('bookstore.schema'))")
+            if reset:
+                await drop(conn)
+            await migrate(conn)
+            await seed(conn, seed_dir)
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+
+from asyncpgsa.connection import get_dialect
+from sqlalchemy.sql.expression import Select
+
+
+_dialect = get_dialect()
+
+
+class Statement:
+    """SQLAlchemy query shape compiled once into parameterized
+    SQL (`$1`...). Bind parameters are numbered the same way
+    asyncpgsa does it, in sorted order of their names.
+    Values not supplied on `args()` fall back to the ones
+    captured at compile time. `shape` labels it in timings.
+    Plain SELECTs are `readonly` and can be coalesced.
+    """
+    __slots__ = ('sql', 'names', 'defaults', 'processors', 'shape', 'readonly')
+
+    def __init__(self, query, dialect=_dialect, shape=None):
+        self.shape = shape
+        self.readonly = isinstance(query, Select) and query._for_update_arg is None
+        compiled = query.compile(dialect=dialect)
+        params = sorted(compiled.construct_params(_check=False).items())
+        self.names = [name for name, _ in params]
+        self.defaults = dict(params)
+        self.sql = compiled.string % {
+            name: '$' + str(i) for i, name in enumerate(self.names, start=1)
+        }
+        self.processors = compiled._bind_processors
+
+    def args(self, values=None):
+        values = values or {}
+        args = []
+        for name in self.names:
+            value = values.get(name, self.defaults[name])
+            if name in self.processors:
+                value = self.processors[name](value)
+            args.append(value)
+        return args
+
+
+def bind(query, args):
+    """Turns a Statement and its dict of values into
+    positional asyncpg arguments, passes anything else as is.
+    """
+    if isinstance(query, Statement):
+        return [query.sql] + query.args(*args)
+    return [query] + list(args)
+
+
+def shape_label(key):
+    """('author', 'update', 'name') becomes author:update:name"""
+    if isinstance(key, tuple):
+        return ':'.join(shape_label(k) for k in key)
+    return str(key)
+
+
+class StatementCache:
+    """LRU of compiled statements keyed by query shape.
+    The SQL text of a shape never changes, so asyncpg reuses
+    its per-connection prepared statements for it as well.
+    :maxsize: amount of shapes kept compiled
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+
+    def get(self, key, build):
+        """Returns a compiled statement for `key`, calling
+        `build` for the SQLAlchemy query on a miss only.
+        """
+        try:
+            statement = self._statements[key]
+        except KeyError:
+            self.misses += 1
+            statement = self._statements[key] = Statement(build(), shape=shape_label(key))
+            if len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+        else:
+            self.hits += 1
+            self._statements.move_to_end(key)
+        return statement
+
+    def stats(self):
+        return {
+            'size': len(self._statements),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
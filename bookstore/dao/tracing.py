@@ -0,0 +1,79 @@
+import json
+import logging
+import re
+
+from collections import namedtuple
+
+
+logger = logging.getLogger('bookstore.queries')
+
+# What apg hooks get for every query: the query as given, the asyncpg
+# method, the SQL followed by its values, seconds waited for a
+# connection and seconds the query took, where it ran
+QueryTiming = namedtuple('QueryTiming', ['query', 'method', 'args', 'wait', 'seconds', 'source'])
+
+# Statements EXPLAIN takes, anything else (COPY, DDL) is not explained
+EXPLAINABLE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# Statements run again by EXPLAIN ANALYZE, writes are only planned as
+# even rolled back they take sequence values and fire triggers
+ANALYZABLE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+
+def loggable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [loggable(v) for v in value]
+    return str(value)
+
+
+def describe(timing, redact=True):
+    """JSON friendly dict of a QueryTiming, values are replaced
+    by their type names when `redact`
+    """
+    values = timing.args[1:]
+    return {
+        'sql': timing.args[0],
+        'shape': getattr(timing.query, 'shape', None),
+        'params': [type(v).__name__ for v in values] if redact else loggable(values),
+        'source': timing.source,
+        'wait_ms': round(timing.wait * 1000, 3),
+        'exec_ms': round(timing.seconds * 1000, 3),
+    }
+
+
+class SlowQueryLog:
+    """apg hook logging queries that took `threshold` seconds or
+    more, waiting for a connection included, as a `query` field
+    of a structured entry.
+    """
+    def __init__(self, threshold, redact=True, log=logger):
+        self.threshold = threshold
+        self.redact = redact
+        self.log = log
+        self.logged = 0
+
+    def __call__(self, timing):
+        if timing.wait + timing.seconds < self.threshold:
+            return
+        self.logged += 1
+        self.log.warning('Slow query', extra={'query': describe(timing, self.redact)})
+
+
+async def explain(conn, timing):
+    """EXPLAIN (ANALYZE, BUFFERS) plan of a traced SELECT run
+    again on `conn` in a savepoint that is rolled back, the plain
+    EXPLAIN plan of other statements, None for statements EXPLAIN
+    does not take.
+    """
+    sql = timing.args[0]
+    if not EXPLAINABLE.match(sql):
+        return None
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if ANALYZABLE.match(sql) else 'FORMAT JSON'
+    savepoint = conn.transaction()
+    await savepoint.start()
+    try:
+        plan = await conn.fetchval('EXPLAIN ({}) {}'.format(options, sql), *timing.args[1:])
+    finally:
+        await savepoint.rollback()
+    return json.loads(plan) if isinstance(plan, str) else plan
@@ -0,0 +1,204 @@
+import asyncio
+import math
+import time
+import weakref
+
+from collections import OrderedDict, deque
+
+from sanic.exceptions import SanicException
+from sanic.response import json
+
+
+class Gate:
+    """Admits at most `limit` requests at once, up to `queue`
+    more wait in line for `deadline` seconds at most.
+    """
+    def __init__(self, limit, queue, deadline):
+        self.limit = limit
+        self.queue = queue
+        self.deadline = deadline
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    async def enter(self):
+        """True once admitted, False when the request is shed"""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.queue:
+            self.shed += 1
+            return False
+        future = asyncio.Future()
+        self.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.deadline)
+        except asyncio.TimeoutError:
+            # The slot may have been handed over right at the deadline
+            if not future.done() or future.cancelled():
+                if future in self.waiters:
+                    self.waiters.remove(future)
+                self.timeouts += 1
+                return False
+        self.admitted += 1
+        return True
+
+    def leave(self):
+        """Hands the slot over to the first one still waiting"""
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def saturated(self):
+        return len(self.waiters) >= self.queue
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': len(self.waiters),
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'timeouts': self.timeouts,
+        }
+
+
+class Ticket:
+    """Leaves the gate exactly once, either from the response
+    middleware or once the request is gone if it was cancelled.
+    """
+    __slots__ = ('finalizer',)
+
+    def __init__(self, gate, request):
+        self.finalizer = weakref.finalize(request, gate.leave)
+
+    def release(self):
+        self.finalizer()
+
+
+class TokenBuckets:
+    """A token bucket per key refilled with `rate` tokens a
+    second up to `burst`. Only `maxsize` recently used buckets
+    are kept, evicted ones start over full.
+    """
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    def take(self, key, now=None):
+        """0 when a token is taken, seconds until the next one otherwise"""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+def rejected(message, status, retry_after):
+    return json({'error': message}, status=status, headers={
+        'Retry-After': str(max(1, int(math.ceil(retry_after)))),
+        'Access-Control-Allow-Origin': '*',
+    })
+
+
+def client_of(request, trusted=()):
+    """Peer address of a request, or the address the closest of
+    the `trusted` proxies it came through got it from. Addresses
+    in `X-Forwarded-For` are only taken from trusted proxies, the
+    header is whatever clients make it otherwise.
+    """
+    client = request.ip
+    if client not in trusted:
+        return client
+    forwarded = [a.strip() for a in request.headers.get('X-Forwarded-For', '').split(',')]
+    for address in reversed([a for a in forwarded if a]):
+        client = address
+        if address not in trusted:
+            break
+    return client
+
+
+def route_of(app, request):
+    """Route template the request is going to match, the router
+    only resolves it after request middleware.
+    """
+    try:
+        return app.router.get(request)[3]
+    except SanicException:
+        return 'unmatched'
+
+
+def register(app):
+    """Sheds load before it reaches the pool. Every worker runs
+    `SANIC_ADMISSION_LIMIT` requests at once (40 by default, 0
+    turns it off), `SANIC_ADMISSION_QUEUE` more (100) wait for
+    `SANIC_ADMISSION_DEADLINE` seconds (1) and get a 503 then.
+    `SANIC_RATE_LIMIT` requests a second per client and route
+    (off by default) with bursts of `SANIC_RATE_BURST` get a 429
+    beyond. Clients are told apart by their address, the one
+    proxies of `SANIC_TRUSTED_PROXIES` forward if any.
+    Paths starting with `SANIC_ADMISSION_EXEMPT` ones
+    are always let through, change feeds among them: a websocket
+    would hold its slot for as long as it is open.
+    """
+    app.admission = None
+    app.rate_limits = None
+    app.admission_exempt = ()
+    app.trusted_proxies = frozenset()
+
+    @app.listener('after_server_start')
+    async def start_admission(app, loop):
+        config = app.config
+        limit = int(config.get('ADMISSION_LIMIT', 40))
+        if limit:
+            app.admission = Gate(limit, int(config.get('ADMISSION_QUEUE', 100)),
+                                 float(config.get('ADMISSION_DEADLINE', 1)))
+        rate = float(config.get('RATE_LIMIT', 0))
+        if rate:
+            app.rate_limits = TokenBuckets(rate, float(config.get('RATE_BURST', max(rate, 1))))
+        app.trusted_proxies = frozenset(
+            p.strip() for p in config.get('TRUSTED_PROXIES', '').split(',') if p.strip()
+        )
+        app.admission_exempt = tuple(
+            p for p in config.get('ADMISSION_EXEMPT', '/health,/metrics,/swagger,/changes').split(',') if p
+        )
+
+    @app.middleware('request')
+    async def admit(request):
+        if request.method == 'OPTIONS' or request.path.startswith(app.admission_exempt):
+            return
+        if app.rate_limits:
+            client = client_of(request, app.trusted_proxies)
+            wait = app.rate_limits.take((client, request.method, route_of(app, request)))
+            if wait:
+                return rejected('Too many requests.', 429, wait)
+        if app.admission:
+            if not await app.admission.enter():
+                return rejected('Server is busy, retry later.', 503, app.admission.deadline)
+            request['admission'] = Ticket(app.admission, request)
+
+    @app.middleware('response')
+    async def release(request, response):
+        ticket = request.get('admission')
+        if ticket is not None:
+            ticket.release()
+
+    @app.exception(asyncio.TimeoutError)
+    async def pool_timeout(request, exception):
+        # Waiting for a pool connection or a query timed out
+        return rejected('Database is busy, retry later.', 503, 1)
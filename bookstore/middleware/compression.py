@@ -0,0 +1,40 @@
+from sanic.response import HTTPResponse
+
+from bookstore.util.encoding import compress, negotiate
+
+
+def register(app):
+    """Compresses response bodies of at least
+    `SANIC_COMPRESS_MIN_SIZE` bytes (1024 by default, 0 turns
+    compression off) for clients accepting br or gzip.
+    Bodies tagged with an ETag are compressed once per encoding
+    through `app.encoded` when the app has it.
+    """
+    @app.listener('after_server_start')
+    async def start_compression(app, loop):
+        app.compress_min_size = int(app.config.get('COMPRESS_MIN_SIZE', 1024))
+
+    @app.middleware('response')
+    async def compress_response(request, response):
+        min_size = getattr(app, 'compress_min_size', 0)
+        # Streaming responses have no body to compress upfront
+        if (not min_size or not isinstance(response, HTTPResponse)
+                or response.status != 200 or len(response.body) < min_size
+                or 'Content-Encoding' in response.headers):
+            return
+        response.headers['Vary'] = 'Accept-Encoding'
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return
+        etag = response.headers.get('ETag')
+        cache = getattr(app, 'encoded', None)
+        body = None
+        if etag and cache is not None:
+            key = '{};{}'.format(etag, encoding)
+            body = await cache.get(key)
+        if body is None:
+            body = compress(response.body, encoding)
+            if etag and cache is not None:
+                await cache.set(key, body)
+        response.body = body
+        response.headers['Content-Encoding'] = encoding
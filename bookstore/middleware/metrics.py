@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import time
+
+from bisect import bisect_left
+from collections import defaultdict
+
+
+# Upper bounds of latency histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Per bucket (not cumulative) counts, the last one is +Inf"""
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, counts=None, total=0.0):
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.sum = total
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def merge(self, counts, total):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**kwargs):
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in sorted(kwargs.items())) + '}'
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """Request and query timings of a worker.
+    With `directory` set every worker dumps its snapshot there
+    so that any of them can render the sum for all the workers.
+    Snapshots of exited workers are removed, a worker recycled
+    by gunicorn starts its counters over like a restarted one.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.pool_stats = None
+        self.flusher = None
+        self.requests = defaultdict(int)
+        self.request_seconds = defaultdict(Histogram)
+        self.query_seconds = defaultdict(Histogram)
+
+    def observe_request(self, route, method, status, seconds):
+        self.requests[(route, method, status)] += 1
+        self.request_seconds[(route, method)].observe(seconds)
+
+    def observe_query(self, timing):
+        """apg hook, statements are labeled by their shape"""
+        self.query_seconds[getattr(timing.query, 'shape', None) or 'sql'].observe(timing.seconds)
+
+    def snapshot(self):
+        pool = self.pool_stats.stats() if self.pool_stats else {}
+        return {
+            'pid': os.getpid(),
+            'requests': [list(k) + [v] for k, v in self.requests.items()],
+            'request_seconds': [list(k) + [h.counts, h.sum]
+                                for k, h in self.request_seconds.items()],
+            'query_seconds': [[k, h.counts, h.sum] for k, h in self.query_seconds.items()],
+            'pool_gauges': {k: pool[k] for k in ('size', 'idle', 'in_use', 'waiting') if k in pool},
+            'pool_counters': {k: pool[k] for k in ('acquired', 'wait_seconds', 'timeouts')
+                              if k in pool},
+        }
+
+    def path(self):
+        return os.path.join(self.directory, '{}.json'.format(os.getpid()))
+
+    def dump(self):
+        path = self.path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def remove(self):
+        try:
+            os.remove(self.path())
+        except OSError:
+            pass
+
+    def snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.dump()
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if alive(snapshot['pid']):
+                result.append(snapshot)
+                continue
+            # Left by a worker that died without removing it
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return result
+
+    async def flush(self, interval):
+        """Keeps the snapshot of this worker fresh"""
+        while True:
+            await asyncio.sleep(interval)
+            self.dump()
+
+    def render(self):
+        """Prometheus text exposition format"""
+        requests = defaultdict(int)
+        request_seconds = defaultdict(Histogram)
+        query_seconds = defaultdict(Histogram)
+        pool_gauges = defaultdict(int)
+        pool_counters = defaultdict(float)
+        for snapshot in self.snapshots():
+            for route, method, status, count in snapshot['requests']:
+                requests[(route, method, status)] += count
+            for route, method, counts, total in snapshot['request_seconds']:
+                request_seconds[(route, method)].merge(counts, total)
+            for shape, counts, total in snapshot['query_seconds']:
+                query_seconds[shape].merge(counts, total)
+            for k, v in snapshot['pool_gauges'].items():
+                pool_gauges[k] += v
+            for k, v in snapshot['pool_counters'].items():
+                pool_counters[k] += v
+
+        lines = [
+            '# HELP bookstore_requests_total Requests by route, method and status.',
+            '# TYPE bookstore_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append('bookstore_requests_total{} {}'.format(
+                labels(route=route, method=method, status=status), count))
+        lines += self.histogram(
+            'bookstore_request_duration_seconds', 'Request latency by route and method.',
+            [(dict(route=r, method=m), h) for (r, m), h in sorted(request_seconds.items())])
+        lines += self.histogram(
+            'bookstore_db_query_duration_seconds', 'Query latency by statement shape.',
+            [(dict(shape=s), h) for s, h in sorted(query_seconds.items())])
+        lines += [
+            '# HELP bookstore_db_pool_connections Pool connections by state.',
+            '# TYPE bookstore_db_pool_connections gauge',
+        ]
+        for state, value in sorted(pool_gauges.items()):
+            lines.append('bookstore_db_pool_connections{} {}'.format(labels(state=state), value))
+        for key, help_text in [('acquired', 'Pool connections acquired.'),
+                               ('wait_seconds', 'Time spent waiting for a pool connection.'),
+                               ('timeouts', 'Pool acquisitions timed out.')]:
+            name = 'bookstore_db_pool_{}_total'.format(key)
+            lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name),
+                      '{} {}'.format(name, pool_counters[key])]
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def histogram(name, help_text, series):
+        lines = ['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)]
+        for label_values, h in series:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), h.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, labels(le=bound, **label_values), cumulative))
+            lines.append('{}_sum{} {}'.format(name, labels(**label_values), h.sum))
+            lines.append('{}_count{} {}'.format(name, labels(**label_values), cumulative))
+        return lines
+
+
+def register(app):
+    """Times every request of `app` and every query going
+    through its apg, `SANIC_METRICS_DIR` shared by the workers
+    enables aggregation, `SANIC_METRICS_FLUSH` is the seconds
+    between snapshots.
+    """
+    app.metrics = Metrics()
+
+    @app.middleware('request')
+    async def start_timer(request):
+        request['started'] = time.monotonic()
+
+    @app.middleware('response')
+    async def observe_request(request, response):
+        started = request.get('started')
+        if started is not None:
+            app.metrics.observe_request(
+                request.uri_template or 'unmatched', request.method,
+                response.status, time.monotonic() - started
+            )
+
+    @app.listener('after_server_start')
+    async def start_metrics(app, loop):
+        app.metrics.pool_stats = app.apg.pool_stats
+        app.apg.hooks.append(app.metrics.observe_query)
+        app.metrics.directory = app.config.get('METRICS_DIR')
+        if app.metrics.directory:
+            os.makedirs(app.metrics.directory, exist_ok=True)
+            app.metrics.dump()
+            app.metrics.flusher = loop.create_task(
+                app.metrics.flush(float(app.config.get('METRICS_FLUSH', 5)))
+            )
+
+    @app.listener('before_server_stop')
+    async def stop_metrics(app, loop):
+        if app.metrics.flusher:
+            app.metrics.flusher.cancel()
+            app.metrics.flusher = None
+            app.metrics.remove()
@@ -0,0 +1,111 @@
+import json
+import time
+
+import asyncpg
+
+from bookstore.dao.tracing import describe, explain
+from bookstore.util.encoding import dumps
+
+
+HEADER = 'X-Bookstore-Profile'
+
+
+def breakdown(trace, total, plans=None, redact=True):
+    """Timing breakdown of a request out of its traced queries"""
+    queries = [describe(timing, redact) for timing in trace]
+    for query, plan in zip(queries, plans or []):
+        query['plan'] = plan
+    return {
+        'total_ms': round(total * 1000, 3),
+        'db_ms': round(sum(t.seconds for t in trace) * 1000, 3),
+        'wait_ms': round(sum(t.wait for t in trace) * 1000, 3),
+        'queries': queries,
+    }
+
+
+def server_timing(profile):
+    return 'total;dur={total_ms}, db;dur={db_ms}, wait;dur={wait_ms}'.format(**profile)
+
+
+def sources(db):
+    """Pool gauges of the primary and of every connected replica
+    by the source traced queries name, plans come from where the
+    statements ran.
+    """
+    pools = {'primary': db.pool_stats}
+    for replica in (db.replicas.replicas if db.replicas else []):
+        if replica.pool_stats is not None:
+            pools[replica.name] = replica.pool_stats
+    return pools
+
+
+async def explain_trace(db, trace):
+    """Plan of every traced statement, each run again in a
+    transaction that is rolled back on the pool it ran on.
+    """
+    pools = sources(db)
+    plans = []
+    for timing in trace:
+        pool = pools.get(timing.source)
+        if pool is None:
+            plans.append({'error': 'Source {} is not connected.'.format(timing.source)})
+            continue
+        async with pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                plans.append(await explain(conn, timing))
+            except asyncpg.PostgresError as e:
+                plans.append({'error': str(e)})
+            finally:
+                await transaction.rollback()
+    return plans
+
+
+def register(app):
+    """Profiles requests asking for it with `?_profile=1` or an
+    `X-Bookstore-Profile: 1` header when `SANIC_PROFILE=1`, meant
+    for staging. Responses get a `Server-Timing` header and JSON
+    objects a `_profile` member with the timing of every query
+    along with its plan, `EXPLAIN (ANALYZE, BUFFERS)` for reads
+    run again where they ran in a transaction that is rolled back,
+    plain `EXPLAIN` for writes, at most `SANIC_PROFILE_EXPLAIN` of
+    them (20).
+    Values are only listed with `SANIC_DB_LOG_PARAMS=1`.
+    """
+    app.profiling = False
+
+    @app.listener('after_server_start')
+    async def start_profiling(app, loop):
+        app.profiling = bool(int(app.config.get('PROFILE', 0)))
+        app.profile_explain = int(app.config.get('PROFILE_EXPLAIN', 20))
+        app.profile_redact = not int(app.config.get('DB_LOG_PARAMS', 0))
+
+    @app.middleware('request')
+    async def start_profile(request):
+        if app.profiling and '1' in (request.args.get('_profile'), request.headers.get(HEADER)):
+            request['profile'] = (time.monotonic(), app.apg.start_trace())
+
+    @app.middleware('response')
+    async def attach_profile(request, response):
+        if request.get('profile') is None:
+            return
+        started, trace = request.get('profile')
+        request['profile'] = None
+        app.apg.stop_trace()
+        total = time.monotonic() - started
+        plans = await explain_trace(app.apg, trace[:app.profile_explain])
+        profile = breakdown(trace, total, plans, app.profile_redact)
+        response.headers['Server-Timing'] = server_timing(profile)
+        # Profiled responses are neither cached nor revalidated
+        response.headers.pop('ETag', None)
+        response.headers['Cache-Control'] = 'no-store'
+        if not response.content_type.startswith('application/json'):
+            return
+        try:
+            body = json.loads(response.body.decode())
+        except (AttributeError, ValueError):
+            return
+        if isinstance(body, dict):
+            body['_profile'] = profile
+            response.body = dumps(body)
@@ -0,0 +1,43 @@
+from bookstore.dao.replicas import PRIMARY_LSN
+
+
+HEADER = 'X-Bookstore-LSN'
+COOKIE = 'bookstore_lsn'
+WRITES = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def register(app):
+    """Reads of a client see its own writes when they go to
+    replicas. Successful writes answer with the LSN of the primary
+    in the `X-Bookstore-LSN` header and in a cookie that lasts
+    `SANIC_DB_STICKY` seconds (10 by default). Reads sending it back
+    are served by a replica that replayed it or by the primary.
+    """
+    app.sticky = 0
+
+    @app.listener('after_server_start')
+    async def start_sticky(app, loop):
+        app.sticky = int(app.config.get('DB_STICKY', 10))
+
+    def replicated():
+        db = getattr(app, 'apg', None)
+        return db is not None and db.replicas is not None
+
+    @app.middleware('request')
+    async def read_after(request):
+        if not replicated():
+            return
+        token = request.headers.get(HEADER) or request.cookies.get(COOKIE)
+        if token and token.isdigit():
+            request['lsn'] = int(token)
+
+    @app.middleware('response')
+    async def written_at(request, response):
+        if request.method not in WRITES or response.status >= 300 or not replicated():
+            return
+        lsn = str(await app.apg.fetchval(PRIMARY_LSN))
+        response.headers[HEADER] = lsn
+        if app.sticky:
+            response.cookies[COOKIE] = lsn
+            response.cookies[COOKIE]['path'] = '/'
+            response.cookies[COOKIE]['max-age'] = app.sticky
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+
+
+def parse_records(body, content_type):
+    """Decodes a bulk request body into a list of rows:
+    a JSON array (default), NDJSON (`application/x-ndjson`)
+    or CSV with a header row (`text/csv`).
+    Raises ValueError on malformed bodies.
+    """
+    text = body.decode('utf-8')
+    if content_type.startswith('text/csv'):
+        return list(csv.DictReader(io.StringIO(text)))
+    if content_type.startswith('application/x-ndjson'):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    rows = json.loads(text)
+    if not isinstance(rows, list):
+        raise ValueError('A JSON array is expected.')
+    return rows
+
+
+def string(max_length):
+    """Converter for varchar columns"""
+    def convert(value):
+        if not isinstance(value, str) or not value:
+            raise ValueError('A non-empty string is expected.')
+        if len(value) > max_length:
+            raise ValueError('Longer than {} characters.'.format(max_length))
+        return value
+    return convert
+
+
+def integer(value):
+    """Converter for ID columns, CSV values come as strings"""
+    if isinstance(value, bool):
+        raise ValueError('An integer is expected.')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('An integer is expected.')
+
+
+def validate(rows, fields):
+    """Converts every row into a tuple of values in the order of
+    `fields`, a list of (name, converter) pairs.
+    Returns the tuples and row-level errors as
+    [{'row': index, 'error': message}].
+    """
+    records, errors = [], []
+    for i, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('An object is expected.')
+            record = []
+            for name, convert in fields:
+                if name not in row:
+                    raise ValueError('Missing field {}.'.format(name))
+                try:
+                    record.append(convert(row[name]))
+                except ValueError as e:
+                    raise ValueError('{}: {}'.format(name, e))
+            records.append(tuple(record))
+        except ValueError as e:
+            errors.append({'row': i, 'error': str(e)})
+    return records, errors
@@ -0,0 +1,36 @@
+"""Checks the related record counters of authors and books
+against the mapping table and optionally repairs them.
+
+    $ python counters.py [--repair]
+"""
+import argparse
+import asyncio
+import sys
+
+import asyncpg
+
+from bookstore.bookstore import connection
+from bookstore.dao.schema import check_counters, repair_counters
+
+
+async def main(repair):
+    conn = await asyncpg.connect(connection)
+    try:
+        drift = await check_counters(conn)
+        for table, records in sorted(drift.items()):
+            for db_id, stored, actual in records:
+                print('{} {}: {} stored, {} actual'.format(table, db_id, stored, actual))
+        if repair:
+            for table, fixed in sorted((await repair_counters(conn)).items()):
+                print('{}: {} repaired'.format(table, fixed))
+            return 0
+        return 1 if any(drift.values()) else 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repair', action='store_true', help='recount drifted counters')
+    args = parser.parse_args()
+    sys.exit(asyncio.get_event_loop().run_until_complete(main(args.repair)))
@@ -0,0 +1,66 @@
+"""Exports the catalogue to files, all the tables from the same snapshot.
+
+    $ python export.py --format csv --out /tmp/catalogue
+    $ python export.py --format ndjson --out /tmp/catalogue authors relations
+
+Writes `<out>/<table>.<extension>`, see `GET /export/<table>` for
+the formats. Connects with the `SANIC_DB_*` settings of run.py.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+
+from bookstore.bookstore import connection
+from bookstore.dao.apg import apg
+from bookstore.dao.export import FORMATS, TABLES, export, snapshot
+
+
+class Connection:
+    """A lone connection standing in for a pool"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def acquire(self, timeout=None):
+        return self.conn
+
+    async def release(self, conn):
+        pass
+
+
+async def run(dsn, tables, fmt, out):
+    conn = await asyncpg.connect(dsn)
+    try:
+        async with snapshot(apg(Connection(conn))) as tx:
+            for table in tables:
+                path = os.path.join(out, '{}.{}'.format(table, FORMATS[fmt][1]))
+                started = time.monotonic()
+                with open(path, 'wb') as f:
+                    async def write(chunk):
+                        f.write(chunk)
+                    await export(tx, table, fmt, write)
+                    size = f.tell()
+                print('{}: {} bytes in {:.1f}s'.format(path, size, time.monotonic() - started))
+    finally:
+        await conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('tables', nargs='*', help='of {}, all by default'.format(', '.join(TABLES)))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--out', default='.')
+    args = parser.parse_args(argv)
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        parser.error('unknown tables: {}'.format(', '.join(sorted(unknown))))
+    os.makedirs(args.out, exist_ok=True)
+    asyncio.get_event_loop().run_until_complete(
+        run(connection, args.tables or list(TABLES), args.format, args.out))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,6 +8,8 @@ import logging
 
 @fixture
 def sanic_app(request):
+    # Every test starts from freshly seeded tables
+    app.config['DB_SCHEMA'] = 'reset'
     return app
 
 
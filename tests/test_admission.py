@@ -0,0 +1,51 @@
+import asyncio
+
+from sanic.testing import SanicTestClient
+
+from bookstore.middleware.admission import Gate, TokenBuckets, client_of
+
+
+async def test_gate_admits_in_order_and_sheds():
+    gate = Gate(limit=1, queue=1, deadline=0.05)
+    assert await gate.enter()
+    waiting = asyncio.ensure_future(gate.enter())
+    await asyncio.sleep(0)
+    assert not await gate.enter()
+    gate.leave()
+    assert await waiting
+    assert gate.stats()['active'] == 1
+    assert not await gate.enter()
+    assert gate.stats()['timeouts'] == 1
+    gate.leave()
+    assert gate.stats()['active'] == 0
+    assert gate.stats()['shed'] == 1
+
+
+def test_token_buckets():
+    buckets = TokenBuckets(rate=2, burst=2)
+    assert buckets.take('a', now=0) == 0
+    assert buckets.take('a', now=0) == 0
+    assert buckets.take('a', now=0) == 0.5
+    assert buckets.take('b', now=0) == 0
+    assert buckets.take('a', now=0.5) == 0
+
+
+class Request:
+    def __init__(self, ip, forwarded=None):
+        self.ip = ip
+        self.headers = {'X-Forwarded-For': forwarded} if forwarded else {}
+
+
+def test_client_of_trusts_proxies_only():
+    assert client_of(Request('1.1.1.1', '9.9.9.9')) == '1.1.1.1'
+    proxies = {'10.0.0.1', '10.0.0.2'}
+    assert client_of(Request('10.0.0.1', '9.9.9.9, 2.2.2.2, 10.0.0.2'), proxies) == '2.2.2.2'
+    assert client_of(Request('10.0.0.1'), proxies) == '10.0.0.1'
+
+
+async def test_ready(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/health/ready')
+    result = await response.json()
+    assert response.status == 200
+    assert result['ready']
+    assert result['admission']['limit'] == 40
@@ -2,6 +2,8 @@ import json
 import random
 import string
 
+from urllib.parse import quote
+
 from sanic.testing import SanicTestClient
 
 
@@ -154,3 +156,157 @@ async def test_books_m2m_idempotency(sanic_tester: SanicTestClient):
     assert response.status == 304
     assert author_books['result'] == 2
 
+
+
+async def test_authors_keyset_pagination(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?limit=5")
+    first_page = await response.json()
+    assert [a['id'] for a in first_page['result']] == [1, 2, 3, 4, 5]
+    assert first_page['next'] == 5
+    response = await sanic_tester.get("/authors?after={}&limit=5".format(first_page['next']))
+    second_page = await response.json()
+    assert [a['id'] for a in second_page['result']] == [6, 7, 8, 9, 10]
+
+
+async def test_authors_invalid_pagination(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?limit=0")
+    assert response.status == 400
+    response = await sanic_tester.get("/authors?after=abc")
+    assert response.status == 400
+
+
+async def test_books_stream_ndjson(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/books?stream=ndjson&after=8")
+    body = await response.text()
+    assert response.status == 200
+    assert [json.loads(line)['id'] for line in body.splitlines()][:2] == [9, 10]
+
+
+async def test_books_stream_json(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/books?stream=json")
+    resp_json = await response.json()
+    assert [b['id'] for b in resp_json['result']][:10] == list(range(1, 11))
+
+
+async def test_books_stream_limit(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/books?stream=ndjson&after=2&limit=3")
+    body = await response.text()
+    assert [json.loads(line)['id'] for line in body.splitlines()] == [3, 4, 5]
+    response = await sanic_tester.get("/books?stream=json&limit=0")
+    assert response.status == 400
+
+
+async def test_authors_batched_relcount(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/authors/relcount?ids=1,4,100500')
+    resp_json = await response.json()
+    assert resp_json['result'] == {'1': 2, '4': 1, '100500': 0}
+
+
+async def test_books_batched_rellist(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/rellist?ids=7,10')
+    resp_json = await response.json()
+    assert {a['id'] for a in resp_json['result']['7']} == {2, 10}
+    assert {a['id'] for a in resp_json['result']['10']} == {12}
+
+
+async def test_batched_rellist_requires_ids(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/rellist?ids=')
+    assert response.status == 400
+
+
+async def test_authors_include_books(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/authors?include=books&limit=12')
+    resp_json = await response.json()
+    authors = {a['id']: a for a in resp_json['result']}
+    assert {b['id'] for b in authors[2]['books']} == {1, 7}
+    response = await sanic_tester.get('/authors/8?include=books')
+    resp_json = await response.json()
+    assert {b['id'] for b in resp_json['result']['books']} == {4, 5}
+    response = await sanic_tester.get('/authors/8?include=authors')
+    assert response.status == 400
+
+
+async def test_authors_prefix_search(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/authors/search?q=dennis')
+    resp_json = await response.json()
+    assert [a['name'] for a in resp_json['result']] == ['Dennis Ritchie']
+    assert resp_json['next'] is None
+
+
+async def test_books_fulltext_search(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/search?q=programming+language&mode=fulltext')
+    resp_json = await response.json()
+    assert resp_json['result'][0]['name'] == 'The C Programming Language'
+
+
+async def test_books_fuzzy_search(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/search?q=Comunicating+Sequental&mode=fuzzy&limit=1')
+    resp_json = await response.json()
+    assert resp_json['result'][0]['name'] == 'Communicating Sequential Processes'
+
+
+async def test_search_requires_text(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/search?mode=fuzzy')
+    assert response.status == 400
+
+
+async def test_authors_ordered_by_book_count(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?order_by=-book_count&limit=5")
+    resp_json = await response.json()
+    counts = [a['book_count'] for a in resp_json['result']]
+    assert counts == sorted(counts, reverse=True)
+    response = await sanic_tester.get(
+        "/authors?order_by=-book_count&limit=100&after={}".format(resp_json['next']))
+    rest = (await response.json())['result']
+    assert len(resp_json['result']) + len(rest) == 12
+    assert all(a['book_count'] <= counts[-1] for a in rest)
+
+
+async def test_invalid_order_by(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?order_by=name")
+    assert response.status == 400
+    response = await sanic_tester.put("/authors/1", data=json.dumps({'book_count': 100}))
+    assert response.status == 400
+
+
+async def test_authors_sparse_fields(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?fields=id&limit=2")
+    resp_json = await response.json()
+    assert resp_json['result'] == [{'id': 1}, {'id': 2}]
+    response = await sanic_tester.get("/authors?fields=name&sort=book_count&limit=1")
+    assert set((await response.json())['result'][0]) == {'id', 'name', 'book_count'}
+    response = await sanic_tester.get("/authors?fields=password")
+    assert response.status == 400
+
+
+async def test_authors_sorted_by_name(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?sort=name&fields=name&limit=3")
+    resp_json = await response.json()
+    assert [a['id'] for a in resp_json['result']] == [10, 3, 9]
+    assert resp_json['next'] == 'Bjarne Stroustrup,9'
+    response = await sanic_tester.get(
+        "/authors?sort=name&fields=name&limit=2&after={}".format(quote(resp_json['next'])))
+    assert [a['name'] for a in (await response.json())['result']] == [
+        'Brian Kernighan', 'C.A.R. Hoare']
+    response = await sanic_tester.get("/authors?sort=-id&limit=2")
+    assert [a['id'] for a in (await response.json())['result']] == [12, 11]
+
+
+async def test_authors_filtered(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?filter[name]=Edsger+Dijkstra")
+    assert [a['id'] for a in (await response.json())['result']] == [11]
+    response = await sanic_tester.get("/authors?filter[id]=3..6&ids=1,4,5,8&fields=id")
+    assert (await response.json())['result'] == [{'id': 4}, {'id': 5}]
+    response = await sanic_tester.get("/authors?filter[book_count]=2..&fields=id")
+    assert 2 in [a['id'] for a in (await response.json())['result']]
+
+
+async def test_authors_invalid_filter(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get("/authors?filter[password]=x")
+    assert response.status == 400
+    response = await sanic_tester.get("/authors?filter[id]=abc")
+    assert response.status == 400
+    response = await sanic_tester.get("/authors?sort=name&after=5")
+    assert response.status == 400
+    response = await sanic_tester.get("/authors?stream=ndjson&fields=id")
+    assert response.status == 400
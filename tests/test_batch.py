@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import asyncpg
+from pytest import fixture
+from sanic.testing import SanicTestClient
+
+from bookstore.bookstore import authors
+from bookstore.dao.batch import WriteBatcher
+
+
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        self.db.transactions += 1
+        return self.db
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class DB:
+    def __init__(self):
+        self.transactions = 0
+
+    def transaction(self):
+        return Transaction(self)
+
+
+async def double(db, items):
+    if 'fail' in items:
+        if len(items) > 1:
+            raise ValueError('batch')
+        raise ValueError(items[0])
+    return [item * 2 for item in items]
+
+
+async def test_batches_within_latency():
+    db = DB()
+    batcher = WriteBatcher(db, max_latency=0.01)
+    results = await asyncio.gather(*[batcher.submit(double, i) for i in range(3)])
+    assert results == [0, 2, 4]
+    assert db.transactions == 1
+    assert batcher.stats()['largest'] == 3
+
+
+async def test_batches_up_to_max_size():
+    db = DB()
+    batcher = WriteBatcher(db, max_latency=10, max_size=2)
+    results = await asyncio.wait_for(
+        asyncio.gather(*[batcher.submit(double, i) for i in range(4)]), 1)
+    assert results == [0, 2, 4, 6]
+    assert batcher.batches == 2
+
+
+async def test_failed_batch_is_retried_item_by_item():
+    db = DB()
+    batcher = WriteBatcher(db)
+    futures = [batcher.submit(double, i) for i in (1, 'fail', 2)]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    assert results[0] == 2 and results[2] == 4
+    assert str(results[1]) == 'fail'
+    assert batcher.retried == 1 and db.transactions == 4
+
+
+@fixture
+def batched_app(sanic_app):
+    sanic_app.config['DB_BATCH_WRITES'] = '1'
+    yield sanic_app
+    sanic_app.config['DB_BATCH_WRITES'] = '0'
+
+
+@fixture
+def batched_tester(loop, batched_app, test_client):
+    return loop.run_until_complete(test_client(batched_app))
+
+
+async def test_batched_updates_keep_statuses(batched_app, batched_tester: SanicTestClient):
+    requests = [
+        ('/authors/1', {'book_id': 4}),
+        ('/authors/1', {'book_id': 4}),
+        ('/authors/1', {'book_id': 1}),
+        ('/authors/1', {'book_id': 100500}),
+        ('/authors/100500', {'name': 'Nobody'}),
+        ('/authors/3', {'name': 'Renamed', 'book_id': 5}),
+    ]
+    responses = await asyncio.gather(*[
+        batched_tester.put(url, data=json.dumps(body)) for url, body in requests
+    ])
+    assert sorted(r.status for r in responses[:2]) == [200, 304]
+    assert [r.status for r in responses[2:]] == [304, 400, 404, 200]
+    assert batched_app.batcher.batches < len(requests)
+    response = await batched_tester.get('/authors/3?include=books')
+    resp_json = await response.json()
+    assert resp_json['result']['name'] == 'Renamed'
+    assert {b['id'] for b in resp_json['result']['books']} == {2, 3, 5}
+
+
+async def test_batched_relation_to_deleted_record(batched_tester: SanicTestClient, monkeypatch):
+    # The record is gone between the existence check and the insert
+    async def batch_update(db, items):
+        raise asyncpg.exceptions.ForeignKeyViolationError('deleted meanwhile')
+
+    monkeypatch.setattr(authors, 'batch_update', batch_update)
+    response = await batched_tester.put('/authors/1', data=json.dumps({'book_id': 4}))
+    assert response.status == 400
@@ -0,0 +1,78 @@
+import json
+
+from pytest import raises
+from sanic.testing import SanicTestClient
+
+from bookstore.util.bulk import integer, parse_records, string, validate
+
+
+def test_parse_records_formats():
+    assert parse_records(b'[{"name": "a"}]', 'application/json') == [{'name': 'a'}]
+    assert parse_records(b'{"name": "a"}\n\n{"name": "b"}\n', 'application/x-ndjson') == [
+        {'name': 'a'}, {'name': 'b'}
+    ]
+    assert parse_records(b'author_id,book_id\n1,2\n', 'text/csv') == [
+        {'author_id': '1', 'book_id': '2'}
+    ]
+    with raises(ValueError):
+        parse_records(b'{"name": "a"}', 'application/json')
+
+
+def test_validate_reports_rows():
+    records, errors = validate(
+        [{'id': '1', 'name': 'a'}, {'id': 'x', 'name': 'b'}, {'name': 'c'}, {'id': 2, 'name': 'dd'}],
+        [('id', integer), ('name', string(1))]
+    )
+    assert records == [(1, 'a')]
+    assert [e['row'] for e in errors] == [1, 2, 3]
+
+
+async def test_authors_bulk_create(sanic_tester: SanicTestClient):
+    response = await sanic_tester.post(
+        '/authors/bulk', data=json.dumps([{'name': 'Bulk One'}, {'name': 'Bulk Two'}])
+    )
+    resp_json = await response.json()
+    assert response.status == 201
+    first, second = resp_json['result']
+    assert second == first + 1
+    response = await sanic_tester.get('/authors/{}'.format(second))
+    assert (await response.json())['result']['name'] == 'Bulk Two'
+
+
+async def test_books_bulk_create_invalid_rows(sanic_tester: SanicTestClient):
+    response = await sanic_tester.post(
+        '/books/bulk', data=json.dumps([{'name': 'Fine'}, {'title': 'Wrong'}])
+    )
+    resp_json = await response.json()
+    assert response.status == 400
+    assert resp_json['errors'][0]['row'] == 1
+
+
+async def test_books_bulk_update_and_delete(sanic_tester: SanicTestClient):
+    response = await sanic_tester.post(
+        '/books/bulk', data='name\nBulk A\nBulk B\n', headers={'Content-Type': 'text/csv'}
+    )
+    ids = (await response.json())['result']
+    response = await sanic_tester.put(
+        '/books/bulk', data=json.dumps([{'id': ids[0], 'name': 'Bulk C'}, {'id': 100500, 'name': 'X'}])
+    )
+    resp_json = await response.json()
+    assert resp_json['result'] == [ids[0]]
+    assert resp_json['errors'] == [{'row': 1, 'error': 'Not found.'}]
+    response = await sanic_tester.delete('/books/bulk', data=json.dumps(ids))
+    assert (await response.json())['result'] == ids
+
+
+async def test_relations_bulk(sanic_tester: SanicTestClient):
+    response = await sanic_tester.post(
+        '/relations/bulk',
+        data='{"author_id": 2, "book_id": 3}\n{"author_id": 2, "book_id": 1}\n',
+        headers={'Content-Type': 'application/x-ndjson'}
+    )
+    resp_json = await response.json()
+    assert response.status == 201
+    assert resp_json['result'] == {'inserted': 1, 'skipped': 1}
+    response = await sanic_tester.post(
+        '/relations/bulk', data=json.dumps([{'author_id': 2, 'book_id': 100500}])
+    )
+    assert response.status == 400
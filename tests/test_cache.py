@@ -0,0 +1,100 @@
+import json
+
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.cache import DatabaseVersions, MemoryCache, cache_key
+
+
+async def test_memory_cache_lru():
+    cache = MemoryCache(maxsize=2)
+    await cache.set('a', 1)
+    await cache.set('b', 2)
+    assert await cache.get('a') == 1
+    await cache.set('c', 3)
+    assert await cache.get('b') is None
+    assert await cache.get('a') == 1
+    await cache.delete('a', 'missing')
+    assert await cache.get('a') is None
+
+
+async def test_memory_cache_ttl():
+    cache = MemoryCache(ttl=-1)
+    await cache.set('a', 1)
+    assert await cache.get('a') is None
+
+
+async def test_memory_cache_disabled():
+    cache = MemoryCache(maxsize=0)
+    await cache.set('a', 1)
+    assert await cache.get('a') is None
+
+
+def test_cache_key():
+    assert cache_key('author', 'rellist', 1) == 'author:rellist:1'
+
+
+async def test_cached_rename_invalidates_related_list(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/books/rellist/10')
+    assert {a['name'] for a in (await response.json())['result']} == {'C.A.R. Hoare'}
+    await sanic_tester.put('/authors/12', data=json.dumps({'name': 'Tony Hoare'}))
+    response = await sanic_tester.get('/books/rellist/10')
+    assert {a['name'] for a in (await response.json())['result']} == {'Tony Hoare'}
+    response = await sanic_tester.get('/authors/12')
+    assert (await response.json())['result']['name'] == 'Tony Hoare'
+    await sanic_tester.put('/authors/12', data=json.dumps({'name': 'C.A.R. Hoare'}))
+
+
+async def test_cached_delete_invalidates_relations(sanic_tester: SanicTestClient):
+    response = await sanic_tester.post('/books', data=json.dumps({'name': 'Cached'}))
+    book_id = (await response.json())['id']
+    await sanic_tester.put('/authors/3', data=json.dumps({'book_id': book_id}))
+    response = await sanic_tester.get('/authors/relcount/3')
+    count = (await response.json())['result']
+    await sanic_tester.delete('/books/{}'.format(book_id))
+    response = await sanic_tester.get('/authors/relcount/3')
+    assert (await response.json())['result'] == count - 1
+    response = await sanic_tester.get('/books/{}'.format(book_id))
+    assert response.status == 404
+
+
+async def test_database_versions(sanic_app, sanic_tester: SanicTestClient):
+    versions = DatabaseVersions(sanic_app.apg)
+    epoch, values = await versions.versions('a', 'b')
+    assert values == [0, 0] and epoch != 'None'
+    await versions.bump('a', 'a')
+    assert await versions.versions('a', 'b') == (epoch, [1, 0])
+    await versions.bump('a', 'b')
+    assert await versions.versions('a', 'b') == (epoch, [2, 1])
+
+
+async def test_etag_not_modified(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/authors/12')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+    response = await sanic_tester.get('/authors/12', headers={'If-None-Match': etag})
+    assert response.status == 304
+    assert await response.read() == b''
+    response = await sanic_tester.get('/authors/12', headers={'If-None-Match': etag[2:]})
+    assert response.status == 304
+    response = await sanic_tester.get('/authors/11', headers={'If-None-Match': etag})
+    assert response.status == 200
+
+
+async def test_etag_changes_on_writes(sanic_tester: SanicTestClient):
+    page = await sanic_tester.get('/books?include=authors')
+    rellist = await sanic_tester.get('/books/rellist/10')
+    relcount = await sanic_tester.get('/authors/relcount/1')
+    await sanic_tester.put('/authors/12', data=json.dumps({'name': 'Tony Hoare'}))
+    for url, response in [('/books?include=authors', page), ('/books/rellist/10', rellist)]:
+        response = await sanic_tester.get(url, headers={'If-None-Match': response.headers['ETag']})
+        assert response.status == 200
+    response = await sanic_tester.get(
+        '/authors/relcount/1', headers={'If-None-Match': relcount.headers['ETag']})
+    assert response.status == 304
+    await sanic_tester.put('/authors/12', data=json.dumps({'name': 'C.A.R. Hoare'}))
+    response = await sanic_tester.post('/books', data=json.dumps({'name': 'Versioned'}))
+    book_id = (await response.json())['id']
+    await sanic_tester.put('/authors/1', data=json.dumps({'book_id': book_id}))
+    response = await sanic_tester.get(
+        '/authors/relcount/1', headers={'If-None-Match': relcount.headers['ETag']})
+    assert response.status == 200
@@ -0,0 +1,89 @@
+import asyncio
+
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.changes import Change, ChangeFeed, Subscription
+
+
+async def test_subscription_filters_and_overflows():
+    subscription = Subscription(tables={'book'}, maxsize=1)
+    subscription.put(Change(1, 'author', '{}'))
+    subscription.put(Change(2, 'book', '{}'))
+    assert (await subscription.get(0.01)).seq == 2
+    assert await subscription.get(0.01) is None
+    assert not subscription.overflowed
+    subscription.put(Change(3, 'book', '{}'))
+    subscription.put(Change(4, 'book', '{}'))
+    assert subscription.overflowed
+
+
+async def test_feed_resumes_from_recent_changes():
+    feed = ChangeFeed(None, None, backlog=10)
+    for seq in range(1, 6):
+        feed.publish(Change(seq, 'author', '{}'))
+    subscription = await feed.subscribe(since=3)
+    feed.publish(Change(5, 'author', '{}'))
+    feed.publish(Change(6, 'author', '{}'))
+    seqs = []
+    for _ in range(3):
+        seqs.append((await subscription.get(0.01)).seq)
+    assert seqs == [4, 5, 6]
+    assert await subscription.get(0.01) is None
+    feed.unsubscribe(subscription)
+    assert not feed.subscribers
+
+
+class Conn:
+    def is_closed(self):
+        return False
+
+
+class DB:
+    def __init__(self):
+        self.executed = []
+
+    async def execute(self, sql, *args):
+        self.executed.append(sql)
+
+
+async def test_log_pruned_while_busy():
+    db = DB()
+    feed = ChangeFeed(None, db, retention=0, interval=0.01)
+    feed.conn = Conn()
+    keeper = asyncio.ensure_future(feed.keep())
+    # Notifications keep coming in, the log is pruned all the same
+    for seq in range(5):
+        feed.ranges.put_nowait((seq, seq + 1))
+        await asyncio.sleep(0.01)
+    keeper.cancel()
+    assert any(sql.startswith('DELETE FROM change_log') for sql in db.executed)
+
+
+async def test_writes_are_logged(sanic_app, sanic_tester: SanicTestClient):
+    since = await sanic_app.apg.fetchval('SELECT max(seq) FROM change_log')
+    response = await sanic_tester.post('/authors', data='{"name": "Logged"}')
+    author_id = (await response.json())['id']
+    await sanic_tester.put('/authors/{}'.format(author_id), data='{"book_id": 1}')
+    await sanic_tester.delete('/authors/{}'.format(author_id))
+    changes = await sanic_app.apg.fetch(
+        'SELECT tbl, op FROM change_log WHERE seq > $1 ORDER BY seq', since)
+    # Cascaded relation deletes may be logged either side of the record one
+    assert sorted(tuple(c) for c in changes) == [
+        ('author', 'DELETE'), ('author', 'INSERT'),
+        ('author_book_rel', 'DELETE'), ('author_book_rel', 'INSERT'),
+    ]
+
+
+async def test_feed_publishes_notified_changes(sanic_app, sanic_tester: SanicTestClient):
+    subscription = await sanic_app.changes.subscribe(tables={'book'})
+    try:
+        await sanic_tester.post('/books', data='{"name": "Announced"}')
+        change = await subscription.get(5)
+        assert '"Announced"' in change.json
+    finally:
+        sanic_app.changes.unsubscribe(subscription)
+
+
+async def test_invalid_feed_arguments(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/changes/stream?tables=user')
+    assert response.status == 400
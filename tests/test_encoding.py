@@ -0,0 +1,50 @@
+import gzip
+import json
+
+from sanic.testing import SanicTestClient
+
+from bookstore.util.encoding import compress, dumps, negotiate
+
+
+def test_dumps():
+    assert json.loads(dumps({'result': [{'id': 1, 'name': 'a'}], 'next': None})) == {
+        'result': [{'id': 1, 'name': 'a'}], 'next': None
+    }
+
+
+async def test_dumps_records(sanic_app, sanic_tester: SanicTestClient):
+    records = await sanic_app.apg.fetch('SELECT id, name FROM author WHERE id <= 2 ORDER BY id')
+    assert json.loads(dumps({'result': records, 'next': None})) == {
+        'result': [{'id': 1, 'name': 'Dennis Ritchie'}, {'id': 2, 'name': records[1]['name']}],
+        'next': None
+    }
+
+
+def test_negotiate():
+    assert negotiate('gzip, deflate') == 'gzip'
+    assert negotiate('gzip;q=0, identity') is None
+    assert negotiate('identity') is None
+    assert negotiate(None) is None
+    assert negotiate('*') in ('br', 'gzip')
+    assert negotiate('gzip;q=0, br;q=0, *') is None
+
+
+def test_compress_gzip():
+    assert gzip.decompress(compress(b'{}' * 100, 'gzip')) == b'{}' * 100
+
+
+async def test_large_list_compressed(sanic_tester: SanicTestClient):
+    await sanic_tester.post('/books/bulk', data=json.dumps(
+        [{'name': 'Compressed {}'.format(i)} for i in range(100)]))
+    for _ in range(2):
+        # The second response comes out of the encoded bodies
+        response = await sanic_tester.get('/books', headers={'Accept-Encoding': 'gzip'})
+        assert response.status == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert len((await response.json())['result']) == 100
+
+
+async def test_small_response_not_compressed(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/authors/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert (await response.json())['result']['name'] == 'Dennis Ritchie'
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.export import export_query
+
+
+def test_export_query():
+    query, options = export_query('relations', 'csv')
+    assert query == 'SELECT author_id, book_id FROM author_book_rel ORDER BY author_id, book_id'
+    assert options == {'format': 'csv', 'header': True}
+    query, options = export_query('books', 'columns')
+    assert "'author_count', json_agg(author_count ORDER BY id)" in query
+    assert options['quote'] == '\x01'
+    with pytest.raises(ValueError):
+        export_query('books', 'xml')
+
+
+async def test_export_csv(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/export/relations')
+    assert response.headers['Content-Type'] == 'text/csv'
+    lines = (await response.text()).splitlines()
+    assert lines[:3] == ['author_id,book_id', '1,1', '1,2']
+    assert len(lines) == 19
+
+
+async def test_export_ndjson(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/export/books?format=ndjson')
+    rows = [json.loads(line) for line in (await response.text()).splitlines()]
+    assert [r['id'] for r in rows] == list(range(1, 11))
+    assert set(rows[0]) == {'id', 'name', 'author_count'}
+
+
+async def test_export_columns(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/export/authors?format=columns')
+    groups = [json.loads(line) for line in (await response.text()).splitlines()]
+    assert len(groups) == 1 and groups[0]['rows'] == 12
+    assert groups[0]['id'] == list(range(1, 13))
+
+
+async def test_export_unknown_format(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/export/books?format=xml')
+    assert response.status == 400
@@ -0,0 +1,65 @@
+import asyncio
+
+import sqlalchemy as sa
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.flight import SingleFlight, flight_key
+from bookstore.dao.statements import Statement
+
+
+table = sa.Table('thing', sa.MetaData(), sa.Column('id', sa.Integer, primary_key=True))
+
+
+async def test_single_flight_shares_a_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    results = await asyncio.gather(*[flights.do('key', call) for _ in range(5)])
+    assert results == [1] * 5
+    assert flights.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 4}
+    assert await flights.do('key', call) == 2
+
+
+async def test_single_flight_shares_errors():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError
+
+    results = await asyncio.gather(*[flights.do('key', call) for _ in range(2)],
+                                   return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flights.calls == {}
+
+
+def test_flight_key_and_readonly():
+    assert flight_key('fetch', ['SELECT', [1, 2]]) == ('fetch', 'SELECT', (1, 2))
+    assert Statement(table.select()).readonly
+    assert not Statement(table.select().with_for_update()).readonly
+    assert not Statement(table.delete()).readonly
+
+
+async def test_concurrent_reads_coalesced(sanic_app, sanic_tester: SanicTestClient):
+    # Neither cached values nor encoded bodies answer, every read reaches apg
+    sanic_app.cache.maxsize = sanic_app.encoded.maxsize = 0
+    await sanic_app.cache.delete('book:relcount:10')
+    before = sanic_app.apg.flights.stats()
+    responses = await asyncio.gather(*[sanic_tester.get('/books/relcount/10') for _ in range(20)])
+    assert all(r.status == 200 for r in responses)
+    assert sanic_app.apg.flights.stats()['coalesced'] > before['coalesced']
+
+
+async def test_concurrent_statements_coalesced(sanic_app, sanic_tester: SanicTestClient):
+    statement = Statement(sa.select([sa.func.count()]).select_from(sa.table('author')))
+    before = sanic_app.apg.flights.stats()
+    results = await asyncio.gather(*[sanic_app.apg.fetchval(statement, {}) for _ in range(5)])
+    assert len(set(results)) == 1
+    after = sanic_app.apg.flights.stats()
+    assert after['executed'] - before['executed'] == 1
+    assert after['coalesced'] - before['coalesced'] == 4
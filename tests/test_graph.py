@@ -0,0 +1,161 @@
+import asyncio
+import json
+
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.changes import Change
+from bookstore.dao.graph import Graph, GraphIndex
+
+
+# (author, book) sorted by author then book as loaded
+PAIRS = [(1, 1), (1, 2), (2, 1), (2, 7), (3, 2), (3, 3), (4, 3), (8, 4), (8, 5), (9, 4)]
+
+
+def build():
+    return Graph(*zip(*PAIRS))
+
+
+def test_rows_both_ways():
+    graph = build()
+    assert list(graph.books_of(1)) == [1, 2]
+    assert list(graph.authors_of(4)) == [8, 9]
+    assert list(graph.books_of(100)) == []
+    assert graph.edges == 10
+    assert graph.nbytes() > 0
+
+
+def test_relations_kept_aside():
+    graph = build()
+    graph.relate(1, 3)
+    graph.relate(1, 3)
+    graph.unrelate(1, 1)
+    assert list(graph.books_of(1)) == [2, 3]
+    assert list(graph.authors_of(3)) == [1, 3, 4]
+    assert list(graph.authors_of(1)) == [2]
+    assert graph.pending == 2 and graph.edges == 10
+    graph.relate(1, 1)
+    graph.unrelate(1, 3)
+    assert list(graph.books_of(1)) == [1, 2]
+    assert graph.pending == 0 and graph.edges == 10
+
+
+def test_ranked_by_shared_relations():
+    graph = build()
+    graph.relate(9, 5)
+    assert graph.coauthors(8) == [(9, 2)]
+    assert graph.coauthors(1) == [(2, 1), (3, 1)]
+    assert graph.related_books(2, limit=1) == [(1, 1)]
+    assert graph.related_books(4) == [(5, 2)]
+
+
+def test_bounded_neighbourhood():
+    graph = build()
+    assert graph.neighbourhood('author', 1, 1, 100) == {'author': {}, 'book': {1: 1, 2: 1}}
+    found = graph.neighbourhood('author', 1, 3, 100)
+    assert found['author'] == {2: 2, 3: 2}
+    assert found['book'] == {1: 1, 2: 1, 3: 3, 7: 3}
+    assert sum(map(len, graph.neighbourhood('book', 3, 4, 3).values())) == 3
+
+
+def test_index_applies_relation_changes():
+    index = GraphIndex(None)
+    index.graph = build()
+    assert index.apply(index.graph, change('INSERT', 4, 4))
+    assert index.apply(index.graph, change('DELETE', 8, 4))
+    assert not index.apply(index.graph, change('UPDATE', 4, 5))
+    assert list(index.graph.authors_of(4)) == [4, 9]
+    assert index.stats()['pending'] == 2
+
+
+def change(op, author_id, book_id):
+    return Change(1, 'author_book_rel', json.dumps(
+        {'op': op, 'data': {'author_id': author_id, 'book_id': book_id}}))
+
+
+class Conn:
+    def __init__(self, db):
+        self.db = db
+
+    async def copy_from_query(self, query, output):
+        self.db.copies += 1
+        if self.db.failures:
+            self.db.failures -= 1
+            raise OSError('connection lost')
+        for chunk in self.db.chunks:
+            await output(chunk)
+
+
+class Acquire:
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return Conn(self.db)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class DB:
+    def __init__(self, chunks, failures=0):
+        self.chunks = chunks
+        self.failures = failures
+        self.copies = 0
+
+    def acquire(self):
+        return Acquire(self)
+
+
+async def test_failed_rebuild_is_retried():
+    index = GraphIndex(DB([b'1\t1\n8\t', b'4\n'], failures=1), retry=0.01)
+    index.rebuild()
+    for _ in range(100):
+        if index.loads:
+            break
+        await asyncio.sleep(0.01)
+    assert index.db.copies == 2
+    assert list(index.graph.authors_of(4)) == [8]
+
+
+async def test_rebuild_again_for_changes_it_could_not_apply():
+    index = GraphIndex(DB([b'1\t1\n']))
+    index.rebuild()
+    await asyncio.sleep(0)
+    # An ID change arrives while the first rebuild builds
+    index.replay.append(change('UPDATE', 1, 2))
+    for _ in range(100):
+        if index.loads == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert index.db.copies == 2
+
+
+async def test_coauthors(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/graph/authors/8/coauthors')
+    resp_json = await response.json()
+    assert resp_json['result'] == [{'id': 5, 'shared': 1}, {'id': 6, 'shared': 1},
+                                   {'id': 7, 'shared': 1}]
+
+
+async def test_related_books(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/graph/books/1/related?limit=1')
+    resp_json = await response.json()
+    assert resp_json['result'] == [{'id': 2, 'shared': 1}]
+
+
+async def test_neighbourhood(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/graph/authors/11/neighbourhood?hops=3')
+    resp_json = await response.json()
+    assert resp_json['result'] == {
+        'authors': [{'id': 12, 'hops': 2}],
+        'books': [{'id': 8, 'hops': 1}, {'id': 9, 'hops': 1}, {'id': 10, 'hops': 3}],
+    }
+    response = await sanic_tester.get('/graph/books/1/neighbourhood?hops=9')
+    assert response.status == 400
+
+
+async def test_graph_stats(sanic_tester: SanicTestClient):
+    response = await sanic_tester.get('/graph/stats')
+    resp_json = await response.json()
+    assert resp_json['relations'] >= 18
+    assert resp_json['bytes'] > 0 and resp_json['loads'] >= 1
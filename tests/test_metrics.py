@@ -0,0 +1,46 @@
+import json
+import os
+
+from sanic.testing import SanicTestClient
+
+from bookstore.middleware.metrics import Metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    metrics.observe_request('/authors', 'GET', 200, 0.003)
+    metrics.observe_request('/authors', 'GET', 200, 0.2)
+    text = metrics.render()
+    assert 'bookstore_requests_total{method="GET",route="/authors",status="200"} 2' in text
+    assert ('bookstore_request_duration_seconds_bucket'
+            '{le="0.005",method="GET",route="/authors"} 1') in text
+    assert ('bookstore_request_duration_seconds_bucket'
+            '{le="+Inf",method="GET",route="/authors"} 2') in text
+    assert 'bookstore_request_duration_seconds_count{method="GET",route="/authors"} 2' in text
+
+
+def test_workers_are_summed(tmpdir):
+    other = Metrics()
+    other.observe_request('/books', 'POST', 201, 0.01)
+    snapshot = other.snapshot()
+    # A worker alive next to this one and one that has exited already
+    for name, pid in [('other', os.getppid()), ('exited', 2 ** 22 + 1)]:
+        snapshot['pid'] = pid
+        with open(os.path.join(str(tmpdir), name + '.json'), 'w') as f:
+            json.dump(snapshot, f)
+    metrics = Metrics(str(tmpdir))
+    metrics.observe_request('/books', 'POST', 201, 0.02)
+    text = metrics.render()
+    assert 'bookstore_requests_total{method="POST",route="/books",status="201"} 2' in text
+    assert not tmpdir.join('exited.json').exists()
+    metrics.remove()
+    assert sorted(os.listdir(str(tmpdir))) == ['other.json']
+
+
+async def test_metrics_endpoint(sanic_tester: SanicTestClient):
+    await sanic_tester.get('/authors/1')
+    response = await sanic_tester.get('/metrics')
+    text = await response.text()
+    assert response.status == 200
+    assert 'route="/authors/<db_id:int>"' in text
+    assert 'shape="author:read"' in text
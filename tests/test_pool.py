@@ -0,0 +1,40 @@
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.pool import pool_options
+
+
+def test_pool_options_from_config():
+    config = {
+        'DB_POOL_MIN_SIZE': '2',
+        'DB_POOL_MAX_SIZE': '20',
+        'DB_COMMAND_TIMEOUT': '1.5',
+        'DB_CONNECTION_LIFETIME': '60',
+        'UNRELATED': 'x',
+    }
+    assert pool_options(config) == {
+        'min_size': 2,
+        'max_size': 20,
+        'command_timeout': 1.5,
+        'max_inactive_connection_lifetime': 60.0,
+    }
+
+
+async def test_pool_health(sanic_tester: SanicTestClient):
+    await sanic_tester.get("/authors/1")
+    response = await sanic_tester.get("/health/pool")
+    stats = await response.json()
+    assert response.status == 200
+    assert stats['acquired'] >= 1
+    assert stats['in_use'] == 0
+    assert stats['timeouts'] == 0
+
+
+async def test_transaction_rolls_back(sanic_app, sanic_tester: SanicTestClient):
+    try:
+        async with sanic_app.apg.transaction() as db:
+            await db.execute("INSERT INTO author (name) VALUES ('Rolled back')")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    response = await sanic_tester.get("/authors/search?q=rolled")
+    assert (await response.json())['result'] == []
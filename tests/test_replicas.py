@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.apg import apg
+from bookstore.dao.replicas import Replica, ReplicaSet, replica_dsns
+from bookstore.middleware.replicas import HEADER
+
+
+class Conn:
+    def __init__(self, value):
+        self.value = value
+
+    async def fetchval(self, *args, **kwargs):
+        return self.value
+
+
+class Pool:
+    """Hands out a connection answering `value` or fails with `error`"""
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    async def acquire(self, timeout=None):
+        if self.error:
+            raise self.error
+        return Conn(self.value)
+
+    async def release(self, conn):
+        pass
+
+
+def replica_set(*pools, **kwargs):
+    replicas = []
+    for i, pool in enumerate(pools):
+        replica = Replica('postgres://u:p@replica{}/db'.format(i))
+        replica.pool = pool
+        replica.pool_stats = apg(pool).pool_stats
+        replicas.append(replica)
+    return ReplicaSet(replicas, **kwargs)
+
+
+def test_replica_dsns():
+    assert replica_dsns(' r1:5433, postgres://a:b@r2/x ,', 'u', 'p', 'db') == [
+        'postgres://u:p@r1:5433/db', 'postgres://a:b@r2/x']
+    assert replica_dsns(None, 'u', 'p', 'db') == []
+
+
+def test_round_robin_skips_ejected_and_behind():
+    replicas = replica_set(Pool(), Pool(), Pool(), eject_for=5)
+    first, second, third = replicas.replicas
+    assert [replicas.pick(now=0) for _ in range(4)] == [first, second, third, first]
+    replicas.eject(second, OSError('refused'), now=0)
+    assert [replicas.pick(now=1) for _ in range(3)] == [third, first, third]
+    assert second.ejections == 1 and second.error == 'refused'
+    assert second in [replicas.pick(now=6) for _ in range(3)]
+    first.replayed, third.replayed = 100, 50
+    assert replicas.pick(after=80, now=6) is first
+    assert replicas.pick(after=200, now=6) is None
+
+
+def test_lag_is_judged_against_older_primary_positions():
+    replicas = replica_set(Pool(), max_lag=1)
+    assert replicas.observe(100, now=0) == 0
+    assert replicas.observe(200, now=0.5) == 0
+    assert replicas.observe(300, now=1.2) == 100
+    assert replicas.observe(400, now=2.0) == 200
+
+
+async def test_reader_falls_back_to_primary_and_ejects():
+    primary = apg(Pool(value='primary'))
+    primary.replicas = replica_set(Pool(error=ConnectionRefusedError()), Pool(value='replica'))
+    down, up = primary.replicas.replicas
+    db = primary.reader()
+    assert db.replica is down
+    assert await db.fetchval('SELECT 1') == 'primary'
+    assert down.ejections == 1
+    assert await primary.reader().fetchval('SELECT 1') == 'replica'
+    fresh = primary.reader(after=10)
+    assert fresh.fresh and fresh.replica is None and fresh.flights is None
+    assert await fresh.fetchval('SELECT 1') == 'primary'
+
+
+async def test_reader_retries_timeouts_without_ejecting():
+    primary = apg(Pool(value='primary'))
+    primary.replicas = replica_set(Pool(error=asyncio.TimeoutError()))
+    busy, = primary.replicas.replicas
+    assert await primary.reader().fetchval('SELECT 1') == 'primary'
+    assert busy.ejections == 0
+
+
+def test_reader_without_replicas():
+    primary = apg(Pool())
+    assert primary.reader() is primary
+    assert primary.reader(after=10) is primary
+
+
+@pytest.mark.skipif(not os.environ.get('SANIC_DB_REPLICAS'),
+                    reason='SANIC_DB_REPLICAS standbys are not configured')
+async def test_reads_see_own_writes(sanic_app, sanic_tester: SanicTestClient):
+    response = await sanic_tester.put('/books/1', data='{"name": "Fresh name"}')
+    assert response.status == 200
+    token = response.headers[HEADER]
+    response = await sanic_tester.get('/books/1', headers={HEADER: token})
+    assert (await response.json())['result']['name'] == 'Fresh name'
+    response = await sanic_tester.get('/health/replicas')
+    assert [r['name'] for r in (await response.json())['replicas']]
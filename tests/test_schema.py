@@ -0,0 +1,60 @@
+import json
+
+from sanic.testing import SanicTestClient
+
+from bookstore.bookstore import seed_dir
+from bookstore.dao.schema import (MIGRATIONS, check_counters, prepare_schema,
+                                  repair_counters, seed_checksum)
+
+
+def test_migrations_are_ordered():
+    versions = [version for version, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_seed_checksum_is_stable():
+    assert seed_checksum(seed_dir) == seed_checksum(seed_dir)
+
+
+async def test_migrate_keeps_data(sanic_app, sanic_tester: SanicTestClient):
+    response = await sanic_tester.post("/authors", data='{"name": "Survivor"}')
+    author_id = (await response.json())['id']
+    await prepare_schema(sanic_app.apg.pool, seed_dir)
+    response = await sanic_tester.get("/authors/{}".format(author_id))
+    assert (await response.json())['result']['name'] == 'Survivor'
+    response = await sanic_tester.get("/authors")
+    assert len((await response.json())['result']) == 13
+
+
+async def test_counters_follow_relations(sanic_app, sanic_tester: SanicTestClient):
+    response = await sanic_tester.post("/books", data='{"name": "Counted"}')
+    book_id = (await response.json())['id']
+    await sanic_tester.put("/authors/1", data=json.dumps({'book_id': book_id}))
+    await sanic_tester.put("/authors/2", data=json.dumps({'book_id': book_id}))
+    response = await sanic_tester.get("/books/{}".format(book_id))
+    assert (await response.json())['result']['author_count'] == 2
+    await sanic_tester.delete("/authors/2")
+    response = await sanic_tester.get("/books/relcount/{}".format(book_id))
+    assert (await response.json())['result'] == 1
+    async with sanic_app.apg.pool.acquire() as conn:
+        assert not any((await check_counters(conn)).values())
+
+
+async def test_counters_repair(sanic_app, sanic_tester: SanicTestClient):
+    async with sanic_app.apg.pool.acquire() as conn:
+        await conn.execute('UPDATE author SET book_count = 100 WHERE id = 1')
+        assert [r[0] for r in (await check_counters(conn))['author']] == [1]
+        assert await repair_counters(conn) == {'author': 1, 'book': 0}
+        assert not any((await check_counters(conn)).values())
+
+
+async def test_seed_never_loads_over_data(sanic_app, sanic_tester: SanicTestClient):
+    async with sanic_app.apg.pool.acquire() as conn:
+        # Databases created before versioning have no seed record
+        await conn.execute('DROP TABLE schema_seed')
+        await prepare_schema(sanic_app.apg.pool, seed_dir)
+        assert await conn.fetchval('SELECT checksum FROM schema_seed') == seed_checksum(seed_dir)
+        await conn.execute("UPDATE schema_seed SET checksum = 'changed'")
+        await prepare_schema(sanic_app.apg.pool, seed_dir)
+        assert await conn.fetchval('SELECT count(*) FROM author') == 12
+        assert await conn.fetchval('SELECT count(*) FROM author_book_rel') == 18
@@ -0,0 +1,49 @@
+import sqlalchemy as sa
+
+from bookstore.dao.statements import Statement, StatementCache, bind
+
+
+metadata = sa.MetaData()
+table = sa.Table(
+    'thing', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String(32)),
+)
+
+
+def test_statement_numbers_params_by_name():
+    statement = Statement(
+        table.update().values(name=sa.bindparam('set_name'))
+            .where(table.c.id == sa.bindparam('id'))
+    )
+    assert 'name=$2' in statement.sql
+    assert 'thing.id = $1' in statement.sql
+    assert statement.args({'id': 7, 'set_name': 'x'}) == [7, 'x']
+
+
+def test_bind_passes_plain_queries_through():
+    assert bind('SELECT 1', ()) == ['SELECT 1']
+    statement = Statement(table.select(table.c.id == sa.bindparam('id')))
+    assert bind(statement, ({'id': 1},)) == [statement.sql, 1]
+
+
+def test_statement_cache_counters_and_eviction():
+    cache = StatementCache(maxsize=2)
+    first = cache.get('a', table.select)
+    assert cache.get('a', table.select) is first
+    cache.get('b', table.select)
+    cache.get('c', table.select)
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 3}
+    cache.get('a', table.select)
+    assert cache.misses == 4
+
+
+async def test_statements_health(sanic_app, sanic_tester):
+    # Neither cached values nor encoded bodies answer, every read compiles
+    sanic_app.cache.maxsize = sanic_app.encoded.maxsize = 0
+    await sanic_tester.get("/authors/1")
+    await sanic_tester.get("/authors/1")
+    response = await sanic_tester.get("/health/statements")
+    stats = await response.json()
+    assert response.status == 200
+    assert stats['hits'] >= 1
@@ -0,0 +1,86 @@
+from sanic.testing import SanicTestClient
+
+from bookstore.dao.apg import apg
+from bookstore.dao.tracing import QueryTiming, SlowQueryLog, describe
+from bookstore.middleware.profile import HEADER
+
+
+class Conn:
+    async def fetchval(self, *args, **kwargs):
+        return 1
+
+
+class Pool:
+    async def acquire(self, timeout=None):
+        return Conn()
+
+    async def release(self, conn):
+        pass
+
+
+class Log:
+    def __init__(self):
+        self.entries = []
+
+    def warning(self, message, extra=None):
+        self.entries.append((message, extra))
+
+
+timing = QueryTiming(None, 'fetch', ['SELECT $1, $2', 'secret', [1, 2]], 0.2, 0.4, 'primary')
+
+
+def test_describe_redacts_values():
+    assert describe(timing)['params'] == ['str', 'list']
+    assert describe(timing, redact=False) == {
+        'sql': 'SELECT $1, $2', 'shape': None, 'params': ['secret', [1, 2]],
+        'source': 'primary', 'wait_ms': 200.0, 'exec_ms': 400.0,
+    }
+
+
+def test_slow_query_log_threshold():
+    log = Log()
+    hook = SlowQueryLog(0.5, log=log)
+    hook(timing._replace(wait=0, seconds=0.1))
+    hook(timing)
+    assert log.entries == [('Slow query', {'query': describe(timing)})]
+    assert hook.logged == 1
+
+
+async def test_trace_collects_queries_of_the_task():
+    db = apg(Pool())
+    seen = []
+    db.hooks.append(seen.append)
+    trace = db.start_trace()
+    await db.fetchval('SELECT 1')
+    assert db.stop_trace() is trace
+    await db.fetchval('SELECT 2')
+    assert [t.args[0] for t in trace] == ['SELECT 1']
+    assert [t.args[0] for t in seen] == ['SELECT 1', 'SELECT 2']
+    assert trace[0].source == 'primary' and trace[0].wait >= 0
+
+
+async def test_profiled_request(sanic_app, sanic_tester: SanicTestClient):
+    sanic_app.profiling = True
+    try:
+        response = await sanic_tester.get('/books/rellist/7', headers={HEADER: '1'})
+    finally:
+        sanic_app.profiling = False
+    resp_json = await response.json()
+    assert 'db;dur=' in response.headers['Server-Timing']
+    assert 'ETag' not in response.headers
+    # Besides the ETag write counters looked up by key
+    queries = [q for q in resp_json['_profile']['queries'] if 'cache_version' not in q['sql']]
+    assert queries and all(q['params'] == ['int'] for q in queries)
+    assert 'Plan' in queries[0]['plan'][0]
+
+
+async def test_profiled_writes_are_not_run_again(sanic_app, sanic_tester: SanicTestClient):
+    sanic_app.profiling = True
+    try:
+        response = await sanic_tester.put('/authors/1', data='{"name": "Profiled"}',
+                                          headers={HEADER: '1'})
+    finally:
+        sanic_app.profiling = False
+    queries = (await response.json())['_profile']['queries']
+    plans = {q['sql'].split()[0]: q['plan'][0]['Plan'] for q in queries if q['plan']}
+    assert 'Actual Total Time' not in plans['UPDATE']